@@ -28,8 +28,14 @@ from persistent_list import *
 from fsmonitor import *
 from filter import *
 from processors.processor import *
-from transporters.transporter import Transporter, ConnectionError
+from processors.output_cache import OutputCache
+import processors.hashing
+import processors.jvm_worker
+from transporters.transporter import Transporter, TransporterPool, ConnectionError
+from transporters.concurrency import AIMDController
+from transporters.ratelimit import RateLimiter
 from daemon_thread_runner import *
+import synced_files
 
 
 # Copied from django.utils.functional
@@ -40,7 +46,7 @@ def curry(_curried_func, *args, **kwargs):
 
 
 class AdvancedQueue(UserList):
-    """queue that supports peeking and jumping"""
+    """queue that supports peeking, jumping and prioritizing"""
 
     def peek(self):
         return self[0]
@@ -48,6 +54,12 @@ class AdvancedQueue(UserList):
     def jump(self, item):
         self.insert(0, item)
 
+    def prioritize(self, condition):
+        """move the items that satisfy a condition to the front"""
+        prioritized = [item for item in self.data if condition(item)]
+        if len(prioritized):
+            self.data = prioritized + [item for item in self.data if not condition(item)]
+
     def put(self, item):
         self.append(item)
 
@@ -66,6 +78,7 @@ class ProcessorAvailabilityTestError(ArbitratorInitError): pass
 class TransporterAvailabilityTestError(ArbitratorInitError): pass
 class ServerConnectionTestError(ArbitratorInitError): pass
 class FSMonitorInitError(ArbitratorInitError): pass
+class HashAlgorithmError(ArbitratorInitError): pass
 
 
 class Arbitrator(threading.Thread):
@@ -74,6 +87,9 @@ class Arbitrator(threading.Thread):
 
     DELETE_OLD_FILE = 0xFFFFFFFF
     PROCESSED_FOR_ANY_SERVER = None
+    # The signature of a file in the transport queue that hasn't been
+    # calculated yet. See __sign().
+    UNSIGNED = -1
 
 
     def __init__(self, configfile="config.xml", restart=False):
@@ -135,6 +151,14 @@ class Arbitrator(threading.Thread):
         if processors_not_found > 0:
             raise ProcessorAvailabilityTestError("Consult the log file for details")
 
+        # Verify that the hash algorithm is available and set up the cache of
+        # file digests. This happens before any worker processes are forked.
+        try:
+            processors.hashing.configure(HASH_ALGORITHM, HASH_CACHE_DB)
+        except processors.hashing.UnsupportedHashAlgorithmError, e:
+            self.logger.error(str(e))
+            raise HashAlgorithmError("Consult the log file for details.")
+
         # Verify that all referenced transporters are available.
         transporters_not_found = 0
         for server in self.config.servers.keys():
@@ -145,31 +169,76 @@ class Arbitrator(threading.Thread):
         if transporters_not_found > 0:
             raise TransporterAvailabilityTestError("Consult the log file for details")
 
-        # Verify that each of the servers works.
+        # Create the pool of workers that run the processor chains. Worker
+        # processes for CPU-bound processors are only needed if they're used.
+        # They are forked immediately, hence this must happen before any other
+        # threads are started and before any connections are opened, i.e.
+        # before the servers are tested.
+        cpu_bound_processors = False
+        for source in self.config.rules.keys():
+            for rule in self.config.rules[source]:
+                if not rule["processorChain"] is None:
+                    for processor in rule["processorChain"]:
+                        if getattr(self._import_processor(processor), "cpu_bound", False):
+                            cpu_bound_processors = True
+        self.processor_chain_pool = ProcessorChainPool(MAX_SIMULTANEOUS_PROCESSORCHAINS, "Arbitrator", cpu_bound_processors)
+        for resource_class in RESOURCE_CLASSES:
+            self.logger.warning("Setup: processor chain pool allows %d simultaneous '%s' processor chains (worker processes: %s)." % (self.processor_chain_pool.limits[resource_class], resource_class, cpu_bound_processors))
+
+        # Verify that each of the servers works. The transporters are kept,
+        # so their connections can be used once the arbitrator runs.
         successful_server_connections = 0
+        self.validated_transporters = {}
         for server in self.config.servers.keys():
             transporter = self.__create_transporter(server)
             if transporter:
                 successful_server_connections += 1
-            del transporter
+                self.validated_transporters[server] = transporter
         failed_server_connections = len(self.config.servers) - successful_server_connections
         if failed_server_connections > 0:
             self.logger.error("Server connection tests: could not connect with %d servers." % (failed_server_connections))
+            self.processor_chain_pool.stop()
             raise ServerConnectionTestError("Consult the log file for details.")
         else:
             self.logger.warning("Server connection tests succesful!")
 
 
     def __setup(self):
-        self.processor_chain_factory = ProcessorChainFactory("Arbitrator", WORKING_DIR)
-
-        # Create transporter (cfr. worker thread) pools for each server.
-        # Create one initial transporter per pool, possible other transporters
-        # will be created on-demand.
-        self.transporters = {}
+        self.processor_output_cache = None
+        if PROCESSOR_CACHE_MAX_SIZE > 0:
+            self.processor_output_cache = OutputCache(PROCESSOR_CACHE_DIR, PROCESSOR_CACHE_MAX_SIZE, "Arbitrator")
+            self.logger.warning("Setup: initialized the processor output cache in '%s' (maximum size: %d bytes)." % (PROCESSOR_CACHE_DIR, PROCESSOR_CACHE_MAX_SIZE))
+        self.processor_chain_factory = ProcessorChainFactory("Arbitrator", WORKING_DIR, self.processor_output_cache)
+
+        # Create transporter (cfr. worker thread) pools for each server. The
+        # transporter that was created to test the server is the initial
+        # transporter of each pool, other transporters will be created
+        # on-demand and stopped when they have been idle for too long. The
+        # number of transporters adapts to the throughput and latency of the
+        # server, up to its "maxConnections" setting. All transporters of a
+        # server share its bandwidth and request rate limits, if any.
+        self.transporter_pools = {}
         for server in self.config.servers.keys():
-            self.transporters[server] = []
-            self.logger.warning("Setup: created transporter pool for the '%s' server." % (server))
+            max_connections = self.config.servers[server]["maxConnections"]
+            controller = None
+            if TRANSPORTER_ADAPTIVE_CONCURRENCY:
+                if max_connections == 0:
+                    max_connections = MAX_SIMULTANEOUS_TRANSPORTERS
+                controller = AIMDController(server, min(max_connections, MAX_SIMULTANEOUS_TRANSPORTERS), "Arbitrator")
+            limiter = None
+            max_bytes_per_second = self.config.servers[server]["maxBytesPerSecond"]
+            max_requests_per_second = self.config.servers[server]["maxRequestsPerSecond"]
+            if max_bytes_per_second or max_requests_per_second:
+                limiter = RateLimiter(server, max_bytes_per_second, max_requests_per_second, self.config.servers[server]["fullSpeedHours"], "Arbitrator")
+                self.logger.warning("Setup: transports to the '%s' server are limited to %d bytes/s and %.1f requests/s (0 means unlimited)." % (server, max_bytes_per_second, max_requests_per_second))
+            create = curry(self.__create_transporter, server)
+            pool = TransporterPool(create, max_connections, TRANSPORTER_IDLE_TIMEOUT, TRANSPORTER_KEEPALIVE_INTERVAL, controller, limiter)
+            self.transporter_pools[server] = pool
+            transporter = self.validated_transporters.pop(server, None)
+            if transporter and self.transporters_running < MAX_SIMULTANEOUS_TRANSPORTERS:
+                pool.add(transporter)
+                self.transporters_running += 1
+            self.logger.warning("Setup: created transporter pool for the '%s' server, with %d transporters." % (server, len(pool)))
 
         # Collecting all necessary metadata for each rule.
         self.rules = []
@@ -213,6 +282,9 @@ class Arbitrator(threading.Thread):
         self.failed_files = PersistentList("failed_files_list", PERSISTENT_DATA_DB)
         num_failed_files = len(self.failed_files)
         self.logger.warning("Setup: initialized 'failed_files' persistent list, contains %d items." % (num_failed_files))
+        self.parked_files = PersistentList("parked_files_list", PERSISTENT_DATA_DB)
+        num_parked_files = len(self.parked_files)
+        self.logger.warning("Setup: initialized 'parked_files' persistent list, contains %d items." % (num_parked_files))
         self.files_to_delete = PersistentList("files_to_delete_list", PERSISTENT_DATA_DB)
         num_files_to_delete = len(self.files_to_delete)
         self.logger.warning("Setup: initialized 'files_to_delete' persistent list, contains %d items." % (num_files_to_delete))
@@ -222,10 +294,23 @@ class Arbitrator(threading.Thread):
         self.transport_queue = {}
         for server in self.config.servers.keys():
             self.transport_queue[server] = AdvancedQueue()
+        self.signature_queue = Queue.Queue()
         self.db_queue        = Queue.Queue()
         self.retry_queue     = Queue.Queue()
         self.remaining_transporters = {}
 
+        # The files that each parked file depends on and vice versa, as
+        # (input_file, server) tuples. The server is None if any server will
+        # do. See __park().
+        self.dependencies = {}
+        self.dependents   = {}
+        self.last_parked_files_check = time.time()
+
+        # Transports that were skipped because the output had been
+        # transported already, see __get_unchanged_url().
+        self.unchanged_transports = 0
+        self.unchanged_bytes      = 0
+
         # Move files from the 'files_in_pipeline' persistent list to the 
         # pipeline queue. This is what prevents files from being dropped from
         # the pipeline!
@@ -237,6 +322,17 @@ class Arbitrator(threading.Thread):
             self.files_in_pipeline.remove(item)
         self.logger.warning("Setup: moved %d items from the 'files_in_pipeline' persistent list into the 'pipeline' persistent queue." % (num_files_in_pipeline))
 
+        # Move files from the 'parked_files' persistent list to the pipeline
+        # queue. Processing them again determines which files they still
+        # depend on.
+        parked_items = []
+        for item in self.parked_files:
+            parked_items.append(item)
+            self.pipeline_queue.put(item)
+        for item in parked_items:
+            self.parked_files.remove(item)
+        self.logger.warning("Setup: moved %d items from the 'parked_files' persistent list into the 'pipeline' persistent queue." % (num_parked_files))
+
         # Move files from the 'failed_files' persistent list to the
         # pipeline queue. This is what ensures that even problematic files
         # are not forgotten!
@@ -246,8 +342,13 @@ class Arbitrator(threading.Thread):
         self.dbcon = sqlite3.connect(SYNCED_FILES_DB)
         self.dbcon.text_factory = unicode # This is the default, but we set it explicitly, just to be sure.
         self.dbcur = self.dbcon.cursor()
-        self.dbcur.execute("CREATE TABLE IF NOT EXISTS synced_files(input_file text, transported_file_basename text, url text, server text)")
+        self.dbcur.execute("CREATE TABLE IF NOT EXISTS synced_files(input_file text, transported_file_basename text, url text, server text, signature text)")
         self.dbcur.execute("CREATE UNIQUE INDEX IF NOT EXISTS file_unique_per_server ON synced_files (input_file, server)")
+        # The synced files DB of older versions has no signature column.
+        columns = [row[1] for row in self.dbcur.execute("PRAGMA table_info(synced_files)")]
+        if not "signature" in columns:
+            self.dbcur.execute("ALTER TABLE synced_files ADD COLUMN signature text")
+        synced_files.create_tables(self.dbcur)
         self.dbcon.commit()
         self.dbcur.execute("SELECT COUNT(input_file) FROM synced_files")
         num_synced_files = self.dbcur.fetchone()[0]
@@ -256,6 +357,15 @@ class Arbitrator(threading.Thread):
         # Initialize the FSMonitor.
         fsmonitor_class = get_fsmonitor()
         self.fsmonitor = fsmonitor_class(self.fsmonitor_callback, True, True, self.config.ignored_dirs.split(":"), "fsmonitor.db", "Arbitrator")
+        self.fsmonitor.initial_scan_max_files_per_second = INITIAL_SCAN_MAX_FILES_PER_SECOND
+        self.fsmonitor.modification_fields = PATHSCANNER_MODIFICATION_FIELDS
+        # Only used by FSMonitorPolling.
+        self.fsmonitor.interval = POLLING_INTERVAL
+        self.fsmonitor.min_interval = POLLING_MIN_INTERVAL
+        self.fsmonitor.max_interval = POLLING_MAX_INTERVAL
+        self.fsmonitor.stats_per_cycle = POLLING_STATS_PER_CYCLE
+        self.fsmonitor.burst_threshold = FSMONITOR_BURST_THRESHOLD
+        self.fsmonitor.burst_settle_time = FSMONITOR_BURST_SETTLE_TIME
         self.logger.warning("Setup: initialized FSMonitor.")
 
         # Monitor all sources' scan paths.
@@ -274,6 +384,12 @@ class Arbitrator(threading.Thread):
 
         self.fsmonitor.start()
 
+        # Files are hashed in a separate thread, so large files don't hold
+        # up the arbitrator.
+        self.signer = threading.Thread(target=self.__sign, name="SignerThread")
+        self.signer.setDaemon(True)
+        self.signer.start()
+
         self.clean_up_working_dir()
 
         self.logger.warning("Fully up and running now.")
@@ -287,6 +403,7 @@ class Arbitrator(threading.Thread):
                 self.__process_db_queue()
                 self.__process_files_to_delete()
                 self.__process_retry_queue()
+                self.__process_parked_files()
                 self.__allow_retry()
 
                 # Processing the queues 5 times per second is more than sufficient
@@ -310,24 +427,47 @@ class Arbitrator(threading.Thread):
         self.__process_discover_queue()
         self.logger.info("Final sync of discover queue to pipeline queue made.")
 
+        # Stop the processor chain pool and wait for its workers to end, then
+        # stop the JVM workers that its worker threads have used.
+        self.processor_chain_pool.stop()
+        processors.jvm_worker.stop()
+        self.logger.warning("Stopped processor chain pool.")
+
+        # Stop the signer thread.
+        self.signature_queue.put(None)
+        self.signer.join()
+
         # Stop the transporters and wait for their threads to end.
-        for server in self.transporters.keys():
-            if len(self.transporters[server]):
-                for transporter in self.transporters[server]:
-                    transporter.stop()
-                    transporter.join()
+        for server in self.transporter_pools.keys():
+            if len(self.transporter_pools[server]):
+                self.transporter_pools[server].stop()
                 self.logger.warning("Stopped transporters for the '%s' server." % (server))
+            controller = self.transporter_pools[server].controller
+            if controller is not None:
+                stats = controller.get_stats()
+                self.logger.warning("Concurrency window for the '%s' server: %d (maximum: %d), increased %d times, decreased %d times, %d errors." % (server, stats["window"], stats["max_window"], stats["increases"], stats["decreases"], stats["errors"]))
+            limiter = self.transporter_pools[server].limiter
+            if limiter is not None:
+                stats = limiter.get_stats()
+                self.logger.warning("Transports to the '%s' server waited %.1f seconds in total for its rate limits." % (server, stats["throttled_time"]))
 
         # Log information about the persistent data.
         self.logger.warning("'pipeline' persistent queue contains %d items." % (self.pipeline_queue.qsize()))
         self.logger.warning("'files_in_pipeline' persistent list contains %d items." % (len(self.files_in_pipeline)))
         self.logger.warning("'failed_files' persistent list contains %d items." % (len(self.failed_files)))
+        self.logger.warning("'parked_files' persistent list contains %d items." % (len(self.parked_files)))
         self.logger.warning("'files_to_delete' persistent list contains %d items." % (len(self.files_to_delete)))
 
         # Log information about the synced files DB.
         self.dbcur.execute("SELECT COUNT(input_file) FROM synced_files")
         num_synced_files = self.dbcur.fetchone()[0]
         self.logger.warning("synced files DB contains metadata for %d synced files." % (num_synced_files))
+        self.logger.warning("%d transports (%d bytes) were skipped because the output was unchanged." % (self.unchanged_transports, self.unchanged_bytes))
+
+        # Log information about the processor output cache.
+        if self.processor_output_cache is not None:
+            stats = self.processor_output_cache.get_stats()
+            self.logger.warning("processor output cache contains %d files (%d bytes). %d hits, %d misses (hit rate: %.1f%%), %d input bytes did not have to be processed." % (stats["files"], stats["size"], stats["hits"], stats["misses"], stats["hit_rate"], stats["bytes_saved"]))
 
         # Clean up working directory.
         self.clean_up_working_dir()
@@ -474,7 +614,7 @@ class Arbitrator(threading.Thread):
                         fake_output_file = os.path.join(os.path.dirname(input_file), transport_file_basename)
                         # Queue the transport (deletion).
                         for server in servers:
-                            self.transport_queue[server].put((input_file, event, rule, Arbitrator.PROCESSED_FOR_ANY_SERVER, fake_output_file))
+                            self.transport_queue[server].put((input_file, event, rule, Arbitrator.PROCESSED_FOR_ANY_SERVER, fake_output_file, None))
                             self.logger.info("Filtering: queued transporter to server '%s' for file '%s' to delete it ('%s' rule)." % (server, input_file, rule["label"]))
                     else:
                         # If a processor chain is configured, queue the file
@@ -518,7 +658,7 @@ class Arbitrator(threading.Thread):
                         else:
                             output_file = input_file
                             for server in servers:
-                                self.transport_queue[server].put((input_file, event, rule, Arbitrator.PROCESSED_FOR_ANY_SERVER, output_file))
+                                self.__queue_for_transport(server, (input_file, event, rule, Arbitrator.PROCESSED_FOR_ANY_SERVER, output_file, Arbitrator.UNSIGNED))
                                 self.logger.info("Filter queue -> transport queue: '%s' (rule: '%s')." % (input_file, rule["label"]))
                     self.lock.release()
 
@@ -535,7 +675,9 @@ class Arbitrator(threading.Thread):
     def __process_process_queue(self):
         processed = 0
 
-        while processed< QUEUE_PROCESS_BATCH_SIZE and self.process_queue.qsize() > 0 and self.processorchains_running < MAX_SIMULTANEOUS_PROCESSORCHAINS:
+        # The processor chain pool limits how many chains run simultaneously,
+        # per resource class.
+        while processed< QUEUE_PROCESS_BATCH_SIZE and self.process_queue.qsize() > 0:
             # Process queue -> ProcessorChain -> processor_chain_callback -> transport/db queue.
             self.lock.acquire()
             (input_file, event, rule, processed_for_server) = self.process_queue.get()
@@ -551,7 +693,8 @@ class Arbitrator(threading.Thread):
                                      processed_for_server=processed_for_server
                                      )
             curried_error_callback = curry(self.processor_chain_error_callback,
-                                           event=event
+                                           event=event,
+                                           processed_for_server=processed_for_server
                                            )
 
             # Start the processor chain.
@@ -569,15 +712,15 @@ class Arbitrator(threading.Thread):
                                                                           curried_callback,
                                                                           curried_error_callback
                                                                           )
-            processor_chain.start()
+            self.processor_chain_pool.submit(processor_chain)
             self.processorchains_running += 1
 
             # Log.
             processor_chain_string = "->".join(rule["processorChain"])
             if processed_for_server == Arbitrator.PROCESSED_FOR_ANY_SERVER:
-                self.logger.debug("Process queue: started the '%s' processor chain for the file '%s'." % (processor_chain_string, input_file))
+                self.logger.debug("Process queue: submitted the '%s' processor chain for the file '%s'." % (processor_chain_string, input_file))
             else:
-                self.logger.debug("Process queue: started the '%s' processor chain for the file '%s' for the server '%s'." % (processor_chain_string, input_file, processed_for_server))
+                self.logger.debug("Process queue: submitted the '%s' processor chain for the file '%s' for the server '%s'." % (processor_chain_string, input_file, processed_for_server))
             processed += 1
 
 
@@ -585,78 +728,85 @@ class Arbitrator(threading.Thread):
         for server in self.config.servers.keys():
             processed = 0
 
+            # Stop the transporters that have been idle for too long.
+            reaped = self.transporter_pools[server].reap()
+            if reaped > 0:
+                self.transporters_running -= reaped
+                self.logger.info("Transporting: stopped %d idle transporters for server '%s'." % (reaped, server))
+
             while processed < QUEUE_PROCESS_BATCH_SIZE and self.transport_queue[server].qsize() > 0:
                 # Peek at the first item from the queue. We cannot get the
                 # item from the queue, because there may be no transporter
                 # available, in which case the file should remain queued.
+                # Other threads may queue files in front of it meanwhile,
+                # hence it's removed rather than gotten later on.
                 self.lock.acquire()
-                (input_file, event, rule, processed_for_server, output_file) = self.transport_queue[server].peek()
+                item = self.transport_queue[server].peek()
                 self.lock.release()
+                (input_file, event, rule, processed_for_server, output_file, signature) = item
 
-                # Derive the action from the event.
-                if event == FSMonitor.DELETED:
-                    action = Transporter.DELETE
-                elif event == FSMonitor.CREATED or event == FSMonitor.MODIFIED:
-                    action = Transporter.ADD_MODIFY
-                elif event == Arbitrator.DELETE_OLD_FILE:
-                    # TRICKY: if the event is neither of DELETED, CREATED, nor
-                    # MODIFIED, which everywhere else in the arbitrator it
-                    # should be, then it must be the special case of a file
-                    # that has been modified and already transported, but the
-                    # old file must still be deleted. Hence we map this event
-                    # to the Transporter's DELETE action.
-                    action = Transporter.DELETE
-                else:
-                    raise Exception("Non-existing event set.")
-
-                # Get the additional settings from the rule.
-                dst_parent_path = ""
-                if rule["destinations"][server].has_key("path"):
-                    dst_parent_path = rule["destinations"][server]["path"]
+                action = self.__get_action(event)
 
-                (id, place_in_queue, transporter) = self.__get_transporter(server)
+                # Files are signed in the signer thread, then queued again.
+                if action == Transporter.ADD_MODIFY and signature == Arbitrator.UNSIGNED:
+                    self.lock.acquire()
+                    self.transport_queue[server].remove(item)
+                    self.lock.release()
+                    self.signature_queue.put((server, item, self.__get_src(item, action)))
+                    processed += 1
+                    continue
+
+                # Don't transport output that is identical to what has been
+                # transported already, e.g. after a touch or chmod. That
+                # doesn't need a transporter.
+                url = None
+                if action == Transporter.ADD_MODIFY and signature is not None and self.__is_transported(input_file, event, server, output_file):
+                    url = self.__get_unchanged_url(input_file, server, signature)
+                if url is not None:
+                    self.lock.acquire()
+                    self.transport_queue[server].remove(item)
+                    self.lock.release()
+                    (src, dst, exists, signature, curried_callback, curried_error_callback) = self.__prepare_transport(server, item, action)
+                    self.unchanged_transports += 1
+                    self.unchanged_bytes += os.path.getsize(src)
+                    curried_callback(src, dst, url, action)
+                    self.logger.info("Transport queue: '%s' is unchanged on server '%s', not transporting it." % (output_file, server))
+                    processed += 1
+                    continue
+
+                (place_in_queue, transporter) = self.__get_transporter(server)
                 if not transporter is None:
                     # A transporter is available!
                     # Transport queue -> Transporter -> transporter_callback -> db queue.
                     self.lock.acquire()
-                    (input_file, event, rule, processed_for_server, output_file) = self.transport_queue[server].get()
+                    self.transport_queue[server].remove(item)
+                    # Coalesce the deletions at the front of the queue into
+                    # one batch, if the transporter can delete in batches.
+                    batch = [item]
+                    if action == Transporter.DELETE and transporter.supports_batch_delete:
+                        while len(batch) < transporter.batch_delete_size and self.transport_queue[server].qsize() > 0:
+                            if self.__get_action(self.transport_queue[server].peek()[1]) != Transporter.DELETE:
+                                break
+                            batch.append(self.transport_queue[server].get())
                     self.lock.release()
 
-                    # Create curried callbacks so we can pass additional data
-                    # to the transporter callback without passing it to the
-                    # transporter itself (which cannot handle sending
-                    # additional data to its callback functions).
-                    curried_callback = curry(self.transporter_callback,
-                                             input_file=input_file,
-                                             event=event,
-                                             rule=rule,
-                                             processed_for_server=processed_for_server,
-                                             server=server
-                                             )
-                    curried_error_callback = curry(self.transporter_error_callback,
-                                                   input_file=input_file,
-                                                   event=event
-                                                   )
-
-
-                    # Calculate src and dst for the file.
-                    # - The src is the output file of the processor.
-                    # - The dst is the output file, but its source parent path
-                    #   (the working directory or its source root path) must
-                    #   be stripped and the destination parent path must be
-                    #   prepended.
-                    #   e.g.:
-                    #     - src                         -> dst
-                    #     - /htdocs/mysite/dir/the_file -> dir/the_file
-                    #     - /tmp/dir/the_file           -> dir/the_file
-                    src = output_file
-                    relative_paths = [WORKING_DIR, self.config.sources[rule["source"]]["scan_path"]]
-                    dst = self.__calculate_transporter_dst(output_file, dst_parent_path, relative_paths)
+                    if len(batch) > 1:
+                        files = []
+                        for item in batch:
+                            (src, dst, exists, signature, curried_callback, curried_error_callback) = self.__prepare_transport(server, item, action)
+                            files.append((src, dst, curried_callback, curried_error_callback, exists))
+                        transporter.delete_files(files)
+
+                        self.logger.info("Transport queue: %d files to delete on server '%s' in one batch, with %d transporters, place %d in the queue." % (len(batch), server, len(self.transporter_pools[server]), place_in_queue))
+                        processed += 1
+                        continue
+
+                    (src, dst, exists, signature, curried_callback, curried_error_callback) = self.__prepare_transport(server, item, action)
 
                     # Start the transport.
-                    transporter.sync_file(src, dst, action, curried_callback, curried_error_callback)
+                    transporter.sync_file(src, dst, action, curried_callback, curried_error_callback, exists)
 
-                    self.logger.info("Transport queue: '%s' to transfer to server '%s' with transporter #%d (of %d), place %d in the queue." % (output_file, server, id + 1, len(self.transporters[server]), place_in_queue))
+                    self.logger.info("Transport queue: '%s' to transfer to server '%s' with %d transporters, place %d in the queue." % (output_file, server, len(self.transporter_pools[server]), place_in_queue))
                 else:
                     self.logger.debug("Transporting: no more transporters are available for server '%s'." % (server))
                     break
@@ -664,21 +814,132 @@ class Arbitrator(threading.Thread):
                 processed += 1
 
 
+    def __get_action(self, event):
+        """derive the transporter action from an event"""
+        if event == FSMonitor.DELETED:
+            return Transporter.DELETE
+        elif event == FSMonitor.CREATED or event == FSMonitor.MODIFIED:
+            return Transporter.ADD_MODIFY
+        elif event == Arbitrator.DELETE_OLD_FILE:
+            # TRICKY: if the event is neither of DELETED, CREATED, nor
+            # MODIFIED, which everywhere else in the arbitrator it should be,
+            # then it must be the special case of a file that has been
+            # modified and already transported, but the old file must still
+            # be deleted. Hence we map this event to the Transporter's DELETE
+            # action.
+            return Transporter.DELETE
+        else:
+            raise Exception("Non-existing event set.")
+
+
+    def __prepare_transport(self, server, item, action):
+        """calculate everything a transporter needs to transport an item of
+        the transport queue
+        """
+        (input_file, event, rule, processed_for_server, output_file, signature) = item
+
+        # Get the additional settings from the rule.
+        dst_parent_path = ""
+        if rule["destinations"][server].has_key("path"):
+            dst_parent_path = rule["destinations"][server]["path"]
+
+        # Calculate src and dst for the file.
+        # - The src is the output file of the processor (see __get_src()).
+        # - The dst is the output file, but its source parent path (the
+        #   working directory or its source root path) must be stripped and
+        #   the destination parent path must be prepended.
+        #   e.g.:
+        #     - src                         -> dst
+        #     - /htdocs/mysite/dir/the_file -> dir/the_file
+        #     - /tmp/dir/the_file           -> dir/the_file
+        src = self.__get_src(item, action)
+        relative_paths = [WORKING_DIR, self.config.sources[rule["source"]]["scan_path"]]
+        dst = self.__calculate_transporter_dst(output_file, dst_parent_path, relative_paths)
+
+        # The synced files DB knows whether dst exists already, which saves
+        # the transporter a round trip.
+        exists = self.__is_transported(input_file, event, server, output_file)
+
+        # The signature of the output is stored in the synced files DB, to
+        # detect identical output next time.
+        if signature == Arbitrator.UNSIGNED:
+            signature = None
+
+        # Create curried callbacks so we can pass additional data to the
+        # transporter callback without passing it to the transporter itself
+        # (which cannot handle sending additional data to its callback
+        # functions).
+        curried_callback = curry(self.transporter_callback,
+                                 input_file=input_file,
+                                 event=event,
+                                 rule=rule,
+                                 processed_for_server=processed_for_server,
+                                 server=server,
+                                 output_file=output_file,
+                                 signature=signature
+                                 )
+        curried_error_callback = curry(self.transporter_error_callback,
+                                       input_file=input_file,
+                                       event=event
+                                       )
+
+        return (src, dst, exists, signature, curried_callback, curried_error_callback)
+
+
+    def __get_src(self, item, action):
+        """get the file to transport for an item of the transport queue: the
+        output file, or the input file if the processor chain only renamed
+        it (then the output file is virtual, it was never created)
+        """
+        (input_file, event, rule, processed_for_server, output_file, signature) = item
+        if action == Transporter.ADD_MODIFY and self.__has_virtual_output(input_file, rule, output_file):
+            return input_file
+        return output_file
+
+
+    def __sign(self):
+        """calculate the signatures of the files in the signature queue and
+        queue them for transport again; runs in the signer thread
+        """
+        while True:
+            work = self.signature_queue.get()
+            if work is None:
+                break
+            (server, item, src) = work
+            (input_file, event, rule, processed_for_server, output_file, signature) = item
+            # This thread is the only way back to the transport queue for
+            # these files: no error may stop it. A file that can't be signed
+            # is transported unconditionally.
+            try:
+                signature = self.__get_signature(src)
+            except Exception, e:
+                self.logger.error("Signing: could not calculate the signature of '%s', it will be transported regardless. Error: '%s'." % (src, e))
+                signature = None
+            self.lock.acquire()
+            try:
+                self.__queue_for_transport(server, (input_file, event, rule, processed_for_server, output_file, signature))
+            except Exception, e:
+                self.logger.error("Signing: could not queue '%s' for transport to server '%s'. Error: '%s'." % (src, server, e))
+            finally:
+                self.lock.release()
+
+
     def __process_db_queue(self):
         processed = 0
 
         while processed < QUEUE_PROCESS_BATCH_SIZE and self.db_queue.qsize() > 0:
             # DB queue -> database.
             self.lock.acquire()
-            (input_file, event, rule, processed_for_server, output_file, transported_file, url, server) = self.db_queue.get()
+            (input_file, event, rule, processed_for_server, output_file, transported_file, url, server, signature) = self.db_queue.get()
             self.lock.release()
 
             # Commit the result to the database.            
             remove_server_from_remaining_transporters = True
+            synced = event == FSMonitor.CREATED or event == FSMonitor.MODIFIED
             transported_file_basename = os.path.basename(output_file)
             if event == FSMonitor.CREATED:
                 try:
-                    self.dbcur.execute("INSERT INTO synced_files VALUES(?, ?, ?, ?)", (input_file, transported_file_basename, url, server))
+                    self.dbcur.execute("INSERT INTO synced_files VALUES(?, ?, ?, ?, ?)", (input_file, transported_file_basename, url, server, signature))
                     self.dbcon.commit()
                 except sqlite3.IntegrityError, e:
                     self.logger.critical("Database integrity error: %s. Duplicate key: input_file = '%s', server = '%s'." % (e, input_file, server))
@@ -694,7 +955,8 @@ class Arbitrator(threading.Thread):
 
                     # Update the transported_file_basename and url fields for
                     # the input_file that has been transported.
-                    self.dbcur.execute("UPDATE synced_files SET transported_file_basename=?, url=? WHERE input_file=? AND server=?", (transported_file_basename, url, input_file, server))
+                    self.dbcur.execute("UPDATE synced_files SET transported_file_basename=?, url=?, signature=? WHERE input_file=? AND server=?", (transported_file_basename, url, signature, input_file, server))
+                    synced_files.log_change(self.dbcur, input_file, server)
                     self.dbcon.commit()
                     
                     # If a file was modified that had already been synced
@@ -720,13 +982,14 @@ class Arbitrator(threading.Thread):
                         # 'files_in_pipeline' persistent list.
                         pseudo_event = Arbitrator.DELETE_OLD_FILE
                         # Queue the transport (deletion), but jump the queue!.
-                        self.transport_queue[server].jump((input_file, pseudo_event, rule, Arbitrator.PROCESSED_FOR_ANY_SERVER, fake_output_file))
+                        self.transport_queue[server].jump((input_file, pseudo_event, rule, Arbitrator.PROCESSED_FOR_ANY_SERVER, fake_output_file, None))
                         self.logger.info("DB queue -> transport queue (jumped): '%s' to delete its old transported file '%s' on server '%s'." % (input_file, old_transport_file_basename, server))
                 else:
-                    self.dbcur.execute("INSERT INTO synced_files VALUES(?, ?, ?, ?)", (input_file, transported_file_basename, url, server))
+                    self.dbcur.execute("INSERT INTO synced_files VALUES(?, ?, ?, ?, ?)", (input_file, transported_file_basename, url, server, signature))
                     self.dbcon.commit()
             elif event == FSMonitor.DELETED:
                 self.dbcur.execute("DELETE FROM synced_files WHERE input_file=? AND server=?", (input_file, server))
+                synced_files.log_change(self.dbcur, input_file, server)
                 self.dbcon.commit()
             elif event == Arbitrator.DELETE_OLD_FILE:
                 # This is a pseudo-event. See the comments for the
@@ -737,6 +1000,10 @@ class Arbitrator(threading.Thread):
 
             self.logger.debug("DB queue -> 'synced files' DB: '%s' (URL: '%s')." % (input_file, url))
 
+            # Parked files may have been waiting for this file.
+            if synced:
+                self.__dependency_synced(input_file, server)
+
             key = input_file + str(event) + repr(rule)
 
             # Remove this server from the 'remaining transporters' list for
@@ -831,15 +1098,25 @@ class Arbitrator(threading.Thread):
         processed = 0
 
         while processed < QUEUE_PROCESS_BATCH_SIZE and self.retry_queue.qsize() > 0:
-            # Retry queue -> failed files list.
+            # Retry queue -> parked files list, if the file has to wait for
+            # other files to be synced.
             # And remove from files in pipeline.
             self.lock.acquire()
-            (input_file, event) = self.retry_queue.get()
+            (input_file, event, dependencies) = self.retry_queue.get()
+            if len(dependencies) and (input_file, event) not in self.failed_files and (input_file, event) not in self.pipeline_queue:
+                self.files_in_pipeline.remove((input_file, event))
+                self.lock.release()
+                self.__park((input_file, event), dependencies)
+                self.logger.warning("Retry queue -> 'parked_files' persistent list: '%s'. Waiting for %d files to be synced." % (input_file, len(self.dependencies.get((input_file, event), ()))))
+                processed += 1
+                continue
+
+            # Retry queue -> failed files list.
             # It's possible that the file is already in the failed_files
             # persistent list or in the pipeline queue (if it is being retried
             # already) if it is being processed per server and now a second
             # (or third or ...) processor is requesting a retry.
-            if (input_file, event) not in self.failed_files and (input_file, event) not in self.pipeline_queue:
+            if (input_file, event) not in self.failed_files and (input_file, event) not in self.pipeline_queue and (input_file, event) not in self.parked_files:
                 self.failed_files.append((input_file, event))
                 already_in_failed_files = False
             else:
@@ -855,6 +1132,90 @@ class Arbitrator(threading.Thread):
             processed += 1
 
 
+    def __park(self, item, dependencies):
+        """park a file until the files it depends on have been synced
+
+        The files it depends on are transported before unrelated files.
+        """
+        self.lock.acquire()
+        if item not in self.parked_files:
+            self.parked_files.append(item)
+            self.dependencies[item] = set()
+        for dependency in dependencies:
+            self.dependencies[item].add(dependency)
+            self.dependents.setdefault(dependency, set()).add(item)
+        for server in self.transport_queue.keys():
+            self.transport_queue[server].prioritize(lambda queued_item: self.__is_dependency(queued_item[0], server))
+        self.lock.release()
+
+        # The files it depends on may have been synced in the meantime.
+        self.__check_dependencies(item)
+
+
+    def __is_dependency(self, input_file, server):
+        """check if a parked file depends on a file being synced to a server"""
+        return (input_file, server) in self.dependents or (input_file, None) in self.dependents
+
+
+    def __check_dependencies(self, item):
+        """check in the synced files DB which files a parked file still
+        depends on
+        """
+        for (input_file, server) in list(self.dependencies.get(item, ())):
+            if server is None:
+                self.dbcur.execute("SELECT COUNT(*) FROM synced_files WHERE input_file=?", (input_file, ))
+            else:
+                self.dbcur.execute("SELECT COUNT(*) FROM synced_files WHERE input_file=? AND server=?", (input_file, server))
+            # A file that no longer exists will never be synced.
+            if self.dbcur.fetchone()[0] > 0 or not os.path.exists(input_file):
+                self.__dependency_synced(input_file, server)
+
+
+    def __dependency_synced(self, input_file, server):
+        """move the parked files that depended on only this file (synced to
+        this server) to the pipeline queue
+        """
+        keys = [(input_file, server)]
+        if server is not None:
+            keys.append((input_file, None))
+        released_items = []
+        self.lock.acquire()
+        for key in keys:
+            for item in self.dependents.pop(key, ()):
+                self.dependencies[item].discard(key)
+                if not len(self.dependencies[item]):
+                    del self.dependencies[item]
+                    self.parked_files.remove(item)
+                    self.pipeline_queue.put(item)
+                    released_items.append(item)
+        self.lock.release()
+
+        for (parked_file, event) in released_items:
+            self.logger.warning("'parked_files' persistent list -> pipeline queue: '%s'. All files it depends on have been synced." % (parked_file))
+
+
+    def __process_parked_files(self):
+        # Files on which parked files depend may have been synced without
+        # passing through the DB queue, e.g. by another instance. Check every
+        # RETRY_INTERVAL seconds.
+        if len(self.dependencies) and self.last_parked_files_check + RETRY_INTERVAL < time.time():
+            for item in self.dependencies.keys():
+                self.__check_dependencies(item)
+            self.last_parked_files_check = time.time()
+
+
+    def __queue_for_transport(self, server, item):
+        """queue a file for transport; files that parked files depend on jump
+        the queue
+
+        Must be called with self.lock acquired.
+        """
+        if self.__is_dependency(item[0], server):
+            self.transport_queue[server].jump(item)
+        else:
+            self.transport_queue[server].put(item)
+
+
     def __allow_retry(self):
         num_failed_files = len(self.failed_files)
         should_retry = self.last_retry + RETRY_INTERVAL < time.time()
@@ -880,40 +1241,48 @@ class Arbitrator(threading.Thread):
 
 
     def __get_transporter(self, server):
-        """get a transporter; if one is ready for new work, use that one,
-        otherwise try to start a new transporter"""
-
-        # Try to find a running transporter that is ready for new work.
-        for id in range(0, len(self.transporters[server])):
-            transporter = self.transporters[server][id]
-            # Don't put more than MAX_TRANSPORTER_QUEUE_SIZE files in each
-            # transporter's queue.
-            if transporter.qsize() <= MAX_TRANSPORTER_QUEUE_SIZE:
-                place_in_queue = transporter.qsize() + 1
-                return (id, place_in_queue, transporter)
+        """get a transporter to queue a file with, which ends up in the
+        server's shared queue; if no transporter is idle, try to start a new
+        transporter, returns (place in the queue, transporter)"""
+
+        # All transporters for a server take files from the same queue, so
+        # whichever is available first transports the next file.
+        pool = self.transporter_pools[server]
+        queued = pool.qsize()
+        idle = pool.idle()
+        if queued < idle:
+            return (queued + 1, pool.get_transporter())
+
+        transporter = self.__start_transporter(server)
+        if transporter:
+            return (queued + 1, transporter)
+
+        # If no more transporters can be started, queue files for the busy
+        # transporters: each transporter may have "prefetch" files queued
+        # while it's transporting another one, so it never has to wait for
+        # the arbitrator.
+        prefetch = self.config.servers[server]["prefetch"]
+        if prefetch is None:
+            prefetch = MAX_TRANSPORTER_QUEUE_SIZE
+        if queued < idle + prefetch * len(pool):
+            return (queued + 1, pool.get_transporter())
+
+        return (None, None)
+
+
+    def __start_transporter(self, server):
+        """start a new transporter for the given server, if allowed"""
 
         # Don't run more than the allowed number of simultaneous transporters.
         if not self.transporters_running < MAX_SIMULTANEOUS_TRANSPORTERS:
-            return (None, None, None)
-
-        # Don't run more transporters for each server than its "maxConnections"
-        # setting allows.
-        num_connections = len(self.transporters[server])
-        max_connections = self.config.servers[server]["maxConnections"]
-        if max_connections == 0 or num_connections < max_connections:
-            transporter    = self.__create_transporter(server)
-            id             = len(self.transporters[server]) - 1
-            # If a transporter was succesfully created, add it to the pool.
-            if transporter:
-                self.transporters[server].append(transporter)
-                transporter.start()
-                self.transporters_running += 1
-                # Since this transporter was just created, it's obvious that we're
-                # first in line.
-                place_in_queue = 1
-                return (id, 1, transporter)
+            return None
 
-        return (None, None, None)
+        # The pool doesn't run more transporters for each server than its
+        # "maxConnections" setting allows.
+        transporter = self.transporter_pools[server].start_transporter()
+        if transporter:
+            self.transporters_running += 1
+        return transporter
 
 
     def __create_transporter(self, server):
@@ -935,6 +1304,50 @@ class Arbitrator(threading.Thread):
         return transporter
 
 
+    def __has_virtual_output(self, input_file, rule, output_file):
+        """check if the output file is virtual, i.e. the processor chain only
+        renamed the input file (see ProcessorChain)
+        """
+        if output_file == input_file or os.path.exists(output_file):
+            return False
+        if rule["processorChain"] is None:
+            return False
+        return ProcessorChain.has_virtual_output(rule["processorChain"])
+
+
+    def __is_transported(self, input_file, event, server, output_file):
+        """check in the synced files DB if the output file exists on a server
+        already, so the transporter can skip checking that
+        """
+        if event == Arbitrator.DELETE_OLD_FILE:
+            # The DB has been updated already, but the old transported file
+            # still exists.
+            return True
+        self.dbcur.execute("SELECT transported_file_basename FROM synced_files WHERE input_file=? AND server=?", (input_file, server))
+        result = self.dbcur.fetchone()
+        return result is not None and result[0] == os.path.basename(output_file)
+
+
+    def __get_signature(self, filename):
+        """get the signature of a file's contents: its size and digest"""
+        try:
+            return "%d:%s:%s" % (os.path.getsize(filename), processors.hashing.default_algorithm, processors.hashing.get_digest(filename))
+        except (processors.hashing.HashingError, OSError):
+            # The transporter will fail on this file as well.
+            return None
+
+
+    def __get_unchanged_url(self, input_file, server, signature):
+        """get the URL of the file that has been transported for an input
+        file, if it has the same signature
+        """
+        self.dbcur.execute("SELECT url FROM synced_files WHERE input_file=? AND server=? AND signature=?", (input_file, server, signature))
+        result = self.dbcur.fetchone()
+        if result is None:
+            return None
+        return result[0]
+
+
     def __calculate_transporter_dst(self, src, parent_path=None, relative_paths=[]):
         dst = src
 
@@ -999,6 +1412,14 @@ class Arbitrator(threading.Thread):
                     (curried): processed_for_server='%s'
                     output_file='%s'""" % (input_file, event, rule["label"], processed_for_server, output_file)
 
+        # The output is signed here, in the worker thread of the processor
+        # chain pool, rather than in the arbitrator's thread.
+        item = (input_file, event, rule, processed_for_server, output_file, None)
+        action = self.__get_action(event)
+        signature = None
+        if action == Transporter.ADD_MODIFY:
+            signature = self.__get_signature(self.__get_src(item, action))
+
         # Decrease number of running processor chains.
         self.lock.acquire()
         self.processorchains_running -= 1
@@ -1011,33 +1432,39 @@ class Arbitrator(threading.Thread):
             for server in rule["destinations"].keys():
                 # Add to transport queue.
                 self.lock.acquire()
-                self.transport_queue[server].put((input_file, event, rule, processed_for_server, output_file))
+                self.__queue_for_transport(server, (input_file, event, rule, processed_for_server, output_file, signature))
                 self.lock.release()
             self.logger.info("Process queue -> transport queue: '%s'." % (input_file))
         else:
             # Add to transport queue.
             self.lock.acquire()
-            self.transport_queue[processed_for_server].put((input_file, event, rule, processed_for_server, output_file))
+            self.__queue_for_transport(processed_for_server, (input_file, event, rule, processed_for_server, output_file, signature))
             self.lock.release()
             self.logger.info("Process queue -> transport queue: '%s' (processed for server '%s')." % (input_file, processed_for_server))
 
 
-    def processor_chain_error_callback(self, input_file, event):
+    def processor_chain_error_callback(self, input_file, event, processed_for_server=None, dependencies=[]):
         if CALLBACKS_CONSOLE_OUTPUT:
             print """PROCESSOR CHAIN ERROR CALLBACK FIRED:
                     input_file='%s'
-                    (curried): event=%d""" % (input_file, event)
+                    (curried): event=%d
+                    (curried): processed_for_server='%s'
+                    dependencies=%d""" % (input_file, event, processed_for_server, len(dependencies))
 
-        # Add to retry queue.
+        # Add to retry queue, with the files that must be synced first (to
+        # the server it was processed for).
+        dependencies = [(dependency, processed_for_server) for dependency in dependencies]
         self.lock.acquire()
-        self.retry_queue.put((input_file, event))
+        self.retry_queue.put((input_file, event, dependencies))
         self.processorchains_running -= 1
         self.lock.release()
 
 
-    def transporter_callback(self, src, dst, url, action, input_file, event, rule, processed_for_server, server):
-        # Map Transporter's variable names to ours.
-        output_file      = src
+    def transporter_callback(self, src, dst, url, action, input_file, event, rule, processed_for_server, server, output_file=None, signature=None):
+        # Map Transporter's variable names to ours. The src is the input file
+        # instead of the output file if the output file is virtual.
+        if output_file is None:
+            output_file  = src
         transported_file = dst
 
         if CALLBACKS_CONSOLE_OUTPUT:
@@ -1053,7 +1480,7 @@ class Arbitrator(threading.Thread):
 
         # Add to db queue.
         self.lock.acquire()
-        self.db_queue.put((input_file, event, rule, processed_for_server, output_file, transported_file, url, server))
+        self.db_queue.put((input_file, event, rule, processed_for_server, output_file, transported_file, url, server, signature))
         self.lock.release()
 
         self.logger.info("Transport queue -> DB queue: '%s' (server: '%s')." % (input_file, server))
@@ -1065,7 +1492,7 @@ class Arbitrator(threading.Thread):
                     (curried): input_file='%s'
                     (curried): event=%d""" % (input_file, event)
 
-        self.retry_queue.put((input_file, event))
+        self.retry_queue.put((input_file, event, []))
 
 
     def stop(self):
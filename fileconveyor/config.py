@@ -15,6 +15,7 @@ import re
 import logging
 
 from filter import *
+from transporters.ratelimit import parse_hours
 
 
 # Define exceptions.
@@ -124,12 +125,30 @@ class Config(object):
             name           = Config.__ensure_unicode(server_node.get("name"))
             transporter    = Config.__ensure_unicode(server_node.get("transporter"))
             maxConnections = server_node.get("maxConnections", 0)
+            prefetch       = server_node.get("prefetch", None)
+            if prefetch is not None:
+                prefetch = int(prefetch)
+            # Rate limits, which don't apply during the full speed hours.
+            maxBytesPerSecond    = server_node.get("maxBytesPerSecond", 0)
+            maxRequestsPerSecond = server_node.get("maxRequestsPerSecond", 0)
+            fullSpeedHours       = server_node.get("fullSpeedHours", None)
+            if fullSpeedHours is not None:
+                try:
+                    fullSpeedHours = parse_hours(fullSpeedHours)
+                except ValueError, e:
+                    self.logger.error("The %s server's full speed hours are invalid: %s" % (name, e))
+                    self.errors += 1
+                    fullSpeedHours = None
             for setting in server_node.getchildren():
                 settings[setting.tag] = Config.__ensure_unicode(setting.text)
             self.servers[name] = {
-                "maxConnections" : int(maxConnections),
-                "transporter"    : transporter,
-                "settings"       : settings,
+                "maxConnections"       : int(maxConnections),
+                "prefetch"             : prefetch,
+                "maxBytesPerSecond"    : int(maxBytesPerSecond),
+                "maxRequestsPerSecond" : float(maxRequestsPerSecond),
+                "fullSpeedHours"       : fullSpeedHours,
+                "transporter"          : transporter,
+                "settings"             : settings,
             }
 
 
@@ -51,6 +51,7 @@ import sqlite3
 import threading
 import Queue
 import os
+import time
 import logging
 from pathscanner import PathScanner
 
@@ -76,6 +77,25 @@ class FSMonitor(threading.Thread):
     EVENTNAMES = {}
     MERGE_EVENTS = {}
 
+    # I/O throttling of the initial scan (0 means unthrottled) and how often
+    # its progress is logged.
+    initial_scan_max_files_per_second = 0
+    initial_scan_progress_interval    = 10000
+
+    # The metadata fields that count as a modification. See PathScanner.
+    modification_fields = PathScanner.DEFAULT_MODIFICATION_FIELDS
+
+    # Event storms (e.g. untarring a release or a "git checkout") are
+    # collapsed: once burst_threshold events occur within burst_window
+    # seconds in a directory tree, its events are no longer processed one by
+    # one. When no more events have occurred for burst_settle_time seconds
+    # (or after burst_max_duration seconds), the tree is scanned once and all
+    # changes are reported at once. A threshold of 0 disables this.
+    burst_threshold    = 1000
+    burst_window       = 1
+    burst_settle_time  = 2
+    burst_max_duration = 60
+
     def __init__(self, callback, persistent=False, trigger_events_for_initial_scan=False, ignored_dirs=[], dbfile="fsmonitor.db", parent_logger=None):
         self.persistent                      = persistent
         self.trigger_events_for_initial_scan = trigger_events_for_initial_scan
@@ -90,6 +110,9 @@ class FSMonitor(threading.Thread):
         self.add_queue                       = Queue.Queue()
         self.remove_queue                    = Queue.Queue()
         self.die                             = False
+        self.burst_counts                    = {}
+        self.burst_window_start              = time.time()
+        self.bursts                          = {}
         if parent_logger is None:
             parent_logger = ""
         self.logger                          = logging.getLogger(".".join([parent_logger, "FSMonitor"]))
@@ -127,11 +150,42 @@ class FSMonitor(threading.Thread):
     def generate_missed_events(self, path, event_mask=None):
         """generate the missed events for a persistent DB"""
         self.logger.info("Generating missed events for '%s' (event mask: %s)." % (path, event_mask))
-        for event_path, result in self.pathscanner.scan_tree(path):
-            self.trigger_events_for_pathscanner_result(path, event_path, result, "generate_missed_events", event_mask)
+        # If this path has never been scanned completely, then perform the
+        # initial scan, which will resume where it left off if it was
+        # interrupted (and scan what it had completed for changes).
+        # Otherwise, scan the entire tree for changes.
+        self.initial_scan_progress = {"dirs" : 0, "files" : 0, "start_time" : time.time()}
+        callback = lambda event_path, files: self.__initial_scan_callback(path, event_path, files, event_mask)
+        changes_callback = lambda event_path, result: self.trigger_events_for_pathscanner_result(path, event_path, result, "generate_missed_events", event_mask)
+        if self.pathscanner.initial_scan(path, callback, changes_callback):
+            self.logger.info("Initial scan of '%s' complete: scanned %d files in %d directories." % (path, self.initial_scan_progress["files"], self.initial_scan_progress["dirs"]))
+        else:
+            for event_path, result in self.pathscanner.scan_tree(path):
+                self.trigger_events_for_pathscanner_result(path, event_path, result, "generate_missed_events", event_mask)
         self.logger.info("Done generating missed events for '%s' (event mask: %s)." % (path, event_mask))
 
 
+    def __initial_scan_callback(self, monitored_path, event_path, files, event_mask):
+        """report progress of and trigger events for the initial scan"""
+        progress = self.initial_scan_progress
+        progress["dirs"] += 1
+        old_num_files = progress["files"]
+        progress["files"] += len(files)
+        interval = self.initial_scan_progress_interval
+        if progress["files"] / interval > old_num_files / interval:
+            duration = time.time() - progress["start_time"]
+            self.logger.info("Initial scan of '%s' in progress: scanned %d files in %d directories (%.1f files per second)." % (monitored_path, progress["files"], progress["dirs"], progress["files"] / max(duration, 0.001)))
+
+        if self.trigger_events_for_initial_scan:
+            # Directories are stored with an mtime of -1.
+            result = {
+                "created"  : [row[1] for row in files if row[2] != -1],
+                "modified" : [],
+                "deleted"  : [],
+            }
+            self.trigger_events_for_pathscanner_result(monitored_path, event_path, result, "initial_scan", event_mask)
+
+
     def stop(self):
         """stop the file system monitor (stops the separate thread)"""
         raise NotImplemented
@@ -163,7 +217,7 @@ class FSMonitor(threading.Thread):
             self.dbcur = self.dbcon.cursor()
         # PathScanner.
         if self.persistent == True and self.dbcur is not None:
-            self.pathscanner = PathScanner(self.dbcon, self.ignored_dirs, "pathscanner")
+            self.pathscanner = PathScanner(self.dbcon, self.ignored_dirs, "pathscanner", max_files_per_second=self.initial_scan_max_files_per_second, modification_fields=self.modification_fields)
 
 
     def trigger_events_for_pathscanner_result(self, monitored_path, event_path, result, discovered_through=None, event_mask=None):
@@ -181,6 +235,99 @@ class FSMonitor(threading.Thread):
                 self.trigger_event(monitored_path, os.path.join(event_path, filename), self.DELETED, discovered_through)
 
 
+    def detect_burst(self, monitored_path, path):
+        """count an event for path, returns True if it's part of a burst
+
+        Events that are part of a burst should not be processed: they will be
+        detected by process_bursts() once the burst has settled.
+        """
+        if self.burst_threshold <= 0 or self.pathscanner is None or monitored_path is None:
+            return False
+
+        now = time.time()
+        self.lock.acquire()
+        try:
+            # Events in a directory tree with an ongoing burst only postpone
+            # the scan of that tree.
+            for root in self.bursts.keys():
+                if path == root or path.startswith(root + os.sep):
+                    self.bursts[root][2] = now
+                    return True
+
+            # Count the event for its directory and each of its ancestors, up
+            # to the monitored path.
+            if now - self.burst_window_start > self.burst_window:
+                self.burst_counts = {}
+                self.burst_window_start = now
+            ancestors = []
+            dir = os.path.dirname(path)
+            while dir.startswith(monitored_path):
+                ancestors.append(dir)
+                self.burst_counts[dir] = self.burst_counts.get(dir, 0) + 1
+                if dir == monitored_path:
+                    break
+                dir = os.path.dirname(dir)
+
+            # The deepest directory that has reached the threshold is the root
+            # of the burst.
+            for i in range(len(ancestors)):
+                root = ancestors[i]
+                if self.burst_counts[root] >= self.burst_threshold:
+                    break
+            else:
+                return False
+
+            # A burst in a directory tree absorbs the bursts below it.
+            start = now
+            for other_root in self.bursts.keys():
+                if other_root.startswith(root + os.sep):
+                    start = min(start, self.bursts[other_root][1])
+                    del self.bursts[other_root]
+            self.bursts[root] = [monitored_path, start, now]
+            # Its events should not count towards a burst of its ancestors.
+            for ancestor in ancestors[i + 1:]:
+                self.burst_counts[ancestor] -= self.burst_counts[root]
+            del self.burst_counts[root]
+        finally:
+            self.lock.release()
+
+        self.logger.info("Detected a burst of events in '%s', individual events will be ignored until it settles." % (root))
+        return True
+
+
+    def process_bursts(self):
+        """scan the directory trees of settled bursts and trigger events
+
+        Must be called from the thread that owns the PathScanner DB, after the
+        pending PathScanner DB updates have been applied.
+        """
+        now = time.time()
+        settled = []
+        self.lock.acquire()
+        for root in self.bursts.keys():
+            (monitored_path, start, last_event) = self.bursts[root]
+            if now - last_event >= self.burst_settle_time or now - start >= self.burst_max_duration:
+                settled.append((monitored_path, root))
+                del self.bursts[root]
+        self.lock.release()
+
+        discovered_through = "burst scan"
+        for monitored_path, root in settled:
+            self.logger.info("Burst of events in '%s' has settled, scanning it." % (root))
+            if os.path.isdir(root):
+                for event_path, result in self.pathscanner.scan_tree(root):
+                    self.trigger_events_for_pathscanner_result(monitored_path, event_path, result, discovered_through)
+            else:
+                # The directory tree itself was deleted: scanning the closest
+                # directory that still exists will detect that.
+                path = os.path.dirname(root)
+                while not os.path.isdir(path) and path != monitored_path:
+                    path = os.path.dirname(path)
+                result = self.pathscanner.scan(path)
+                self.trigger_events_for_pathscanner_result(monitored_path, path, result, discovered_through)
+            self.logger.info("Done scanning '%s' after a burst of events." % (root))
+
+
     def is_in_ignored_directory(self, path):
         """checks if the given path is in an ignored directory"""
         dirs = os.path.split(path)
@@ -172,6 +172,10 @@ class FSMonitorInotify(FSMonitor):
         self.__process_pathscanner_updates(self.pathscanner_files_modified, self.pathscanner.update_files)
         self.__process_pathscanner_updates(self.pathscanner_files_deleted,  self.pathscanner.delete_files)
 
+        # Collect the changes of event storms (of which the events have been
+        # ignored) by scanning the affected directory trees.
+        FSMonitor.process_bursts(self)
+
 
 
 
@@ -200,15 +204,11 @@ class FSMonitorInotifyProcessEvent(ProcessEvent):
             t = (path, filename)
             self.fsmonitor_ref.pathscanner_files_deleted.append(t)
         else:
-            # Build tuple for PathScanner's DB of the form (path, filename,
-            # mtime), with mtime = -1 when it's a directory.
+            # Build tuple for PathScanner's DB, with mtime = -1 when it's a
+            # directory.
             st = os.stat(pathname)
             is_dir = stat.S_ISDIR(st.st_mode)
-            if not is_dir:
-                mtime = st[stat.ST_MTIME]
-                t = (path, filename, mtime)
-            else:
-                t = (path, filename, -1)
+            t = PathScanner.stat_to_row(path, filename, st, is_dir)
 
             # Update PathScanner's DB.
             if event_type == FSMonitor.CREATED:
@@ -229,6 +229,8 @@ class FSMonitorInotifyProcessEvent(ProcessEvent):
         if FSMonitor.is_in_ignored_directory(self.fsmonitor_ref, event.path):
             return
         monitored_path = self.fsmonitor_ref.inotify_path_to_monitored_path(event.path)
+        if FSMonitor.detect_burst(self.fsmonitor_ref, monitored_path, event.pathname):
+            return
         self.fsmonitor_ref.logger.debug("inotify reports that an IN_CREATE event has occurred for '%s'." % (event.pathname))
         self.__update_pathscanner_db(event.pathname, FSMonitor.CREATED)
         FSMonitor.trigger_event(self.fsmonitor_ref, monitored_path, event.pathname, FSMonitor.CREATED, self.discovered_through)
@@ -239,6 +241,8 @@ class FSMonitorInotifyProcessEvent(ProcessEvent):
         if FSMonitor.is_in_ignored_directory(self.fsmonitor_ref, event.path):
             return
         monitored_path = self.fsmonitor_ref.inotify_path_to_monitored_path(event.path)
+        if FSMonitor.detect_burst(self.fsmonitor_ref, monitored_path, event.pathname):
+            return
         self.fsmonitor_ref.logger.debug("inotify reports that an IN_DELETE event has occurred for '%s'." % (event.pathname))
         self.__update_pathscanner_db(event.pathname, FSMonitor.DELETED)
         FSMonitor.trigger_event(self.fsmonitor_ref, monitored_path, event.pathname, FSMonitor.DELETED, self.discovered_through)
@@ -249,6 +253,8 @@ class FSMonitorInotifyProcessEvent(ProcessEvent):
         if FSMonitor.is_in_ignored_directory(self.fsmonitor_ref, event.path):
             return
         monitored_path = self.fsmonitor_ref.inotify_path_to_monitored_path(event.path)
+        if FSMonitor.detect_burst(self.fsmonitor_ref, monitored_path, event.pathname):
+            return
         self.fsmonitor_ref.logger.debug("inotify reports that an IN_MODIFY event has occurred for '%s'." % (event.pathname))
         self.__update_pathscanner_db(event.pathname, FSMonitor.MODIFIED)
         FSMonitor.trigger_event(self.fsmonitor_ref, monitored_path, event.pathname, FSMonitor.MODIFIED, self.discovered_through)
@@ -259,6 +265,8 @@ class FSMonitorInotifyProcessEvent(ProcessEvent):
         if FSMonitor.is_in_ignored_directory(self.fsmonitor_ref, event.path):
             return
         monitored_path = self.fsmonitor_ref.inotify_path_to_monitored_path(event.path)
+        if FSMonitor.detect_burst(self.fsmonitor_ref, monitored_path, event.pathname):
+            return
         self.fsmonitor_ref.logger.debug("inotify reports that an IN_ATTRIB event has occurred for '%s'." % (event.pathname))
         self.__update_pathscanner_db(event.pathname, FSMonitor.MODIFIED)
         FSMonitor.trigger_event(self.fsmonitor_ref, monitored_path, event.pathname, FSMonitor.MODIFIED, self.discovered_through)
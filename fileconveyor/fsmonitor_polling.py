@@ -1,6 +1,12 @@
 """fsmonitor_polling.py FSMonitor subclass that uses polling
 
 Always works in persistent mode by design.
+
+Polling is adaptive: each directory is polled separately. Directories in
+which changes were detected recently are polled often, directories that
+remain unchanged are polled exponentially less often. The number of files
+that may be stat()ed per polling cycle is capped, to limit the I/O cost (e.g.
+on NFS mounts).
 """
 
 
@@ -11,7 +17,9 @@ __license__ = "GPL"
 
 
 from fsmonitor import *
+import heapq
 import time
+from sets import Set
 
 
 # Define exceptions.
@@ -22,12 +30,32 @@ class FSMonitorPolling(FSMonitor):
     """polling support for FSMonitor"""
 
 
-    interval = 10
+    # Polling intervals, in seconds. Directories start at interval. Whenever
+    # a change is detected in a directory, it is polled every min_interval
+    # seconds, every poll without changes doubles its interval again, up to
+    # max_interval.
+    interval     = 10
+    min_interval = 1
+    max_interval = 320
+
+    # The maximum number of files that may be stat()ed per polling cycle.
+    # Directories that are due but don't fit in the budget are polled first
+    # in the next cycle.
+    stats_per_cycle = 10000
 
 
     def __init__(self, callback, persistent=True, trigger_events_for_initial_scan=False, ignored_dirs=[], dbfile="fsmonitor.db", parent_logger=None):
         FSMonitor.__init__(self, callback, True, trigger_events_for_initial_scan, ignored_dirs, dbfile, parent_logger)
         self.logger.info("FSMonitor class used: FSMonitorPolling.")
+        # The polling schedule: a dictionary of [monitored_path, interval,
+        # next_poll] lists, keyed by directory, plus a heap of (next_poll,
+        # directory) tuples. Heap items that no longer match the schedule are
+        # obsolete and are skipped. The scheduled subdirectories of every
+        # directory are indexed, so a deleted tree is unscheduled without
+        # going through the whole schedule.
+        self.schedule      = {}
+        self.schedule_heap = []
+        self.children      = {}
 
 
     def __add_dir(self, path, event_mask):
@@ -48,6 +76,10 @@ class FSMonitorPolling(FSMonitor):
             # already been done, then it will return immediately.
             self.pathscanner.initial_scan(path)
 
+        # Schedule all of its directories to be polled.
+        for dirpath in self.pathscanner.list_dirs(path):
+            self.__schedule(path, dirpath, self.interval)
+
         return self.monitored_paths[path]
 
 
@@ -55,6 +87,33 @@ class FSMonitorPolling(FSMonitor):
         """override of FSMonitor.__remove_dir()"""
         if path in self.monitored_paths.keys():
             del self.monitored_paths[path]
+            self.__unschedule(path)
+
+
+    def __schedule(self, monitored_path, path, interval):
+        """(re)schedule a directory to be polled after interval seconds"""
+        next_poll = time.time() + interval
+        if path not in self.schedule:
+            self.children.setdefault(os.path.dirname(path), Set()).add(path)
+        self.schedule[path] = [monitored_path, interval, next_poll]
+        heapq.heappush(self.schedule_heap, (next_poll, path))
+
+
+    def __unschedule(self, path):
+        """stop polling a directory and all directories below it"""
+        # Most deleted paths are files, which aren't scheduled.
+        if path not in self.schedule and path not in self.children:
+            return
+        parent = os.path.dirname(path)
+        if parent in self.children:
+            self.children[parent].discard(path)
+            if not self.children[parent]:
+                del self.children[parent]
+        paths = [path]
+        while paths:
+            dirpath = paths.pop()
+            self.schedule.pop(dirpath, None)
+            paths.extend(self.children.pop(dirpath, []))
 
 
     def run(self):
@@ -66,9 +125,7 @@ class FSMonitorPolling(FSMonitor):
 
         while not self.die:
             self.__process_queues()
-            # Sleep some time.
-            # TODO: make this configurable!
-            time.sleep(self.__class__.interval)
+            time.sleep(self.min_interval)
 
 
     def stop(self):
@@ -109,10 +166,55 @@ class FSMonitorPolling(FSMonitor):
         else:
             self.lock.release()
 
-        # Scan all paths.
+        self.__poll()
+
+
+    def __poll(self):
+        """poll the directories that are due, within the stat budget"""
         discovered_through = "polling"
-        for monitored_path in self.monitored_paths.keys():
+        now = time.time()
+        num_stats_start = self.pathscanner.num_stats
+        num_polled = 0
+        while len(self.schedule_heap) and self.schedule_heap[0][0] <= now:
+            # Stay within the budget, but always poll at least one directory.
+            if num_polled > 0 and self.pathscanner.num_stats - num_stats_start >= self.stats_per_cycle:
+                self.logger.debug("Polling: stat budget of %d files exhausted, postponed polling of the remaining directories." % (self.stats_per_cycle))
+                break
+
+            (next_poll, path) = heapq.heappop(self.schedule_heap)
+            if path not in self.schedule or self.schedule[path][2] != next_poll:
+                continue
+            (monitored_path, interval, next_poll) = self.schedule[path]
+            if monitored_path not in self.monitored_paths:
+                self.__unschedule(path)
+                continue
+
             # These calls to PathScanner is what ensures that FSMonitor.db
             # remains up-to-date.
-            for event_path, result in self.pathscanner.scan_tree(monitored_path):
-                FSMonitor.trigger_events_for_pathscanner_result(self, monitored_path, event_path, result, discovered_through)
+            result = self.pathscanner.scan(path)
+            num_polled += 1
+            FSMonitor.trigger_events_for_pathscanner_result(self, monitored_path, path, result, discovered_through)
+
+            # Stop polling deleted directories.
+            for filename in result["deleted"]:
+                self.__unschedule(os.path.join(path, filename))
+            if not os.path.isdir(path):
+                self.__unschedule(path)
+                continue
+
+            # scan() cannot detect newly created directory trees: scan them
+            # entirely and start polling them.
+            for filename in result["created"]:
+                subpath = os.path.join(path, filename)
+                if os.path.isdir(subpath) and not os.path.islink(subpath) and filename not in self.ignored_dirs:
+                    for event_path, subresult in self.pathscanner.scan_tree(subpath):
+                        FSMonitor.trigger_events_for_pathscanner_result(self, monitored_path, event_path, subresult, discovered_through)
+                        self.__schedule(monitored_path, event_path, self.min_interval)
+
+            # Poll changed directories often, back off for unchanged ones.
+            changed = len(result["created"]) + len(result["deleted"]) + len(result["modified"]) > 0
+            if changed:
+                interval = self.min_interval
+            else:
+                interval = min(interval * 2, self.max_interval)
+            self.__schedule(monitored_path, path, interval)
@@ -4,18 +4,27 @@ You can use PathScanner to detect changes in a directory structure. For
 efficiency, only creations, deletions and modifications are detected, not
 moves.
 
-Modified files are detected by looking at the mtime.
+Modified files are detected by comparing the metadata that is stored for each
+file: its mtime (also with nanosecond resolution), size, inode and ctime.
+Which of these fields count as a modification is configurable, see
+PathScanner.FIELDS.
 
 Instructions:
-- Use initial_scan() to build the initial database.
+- Use initial_scan() to build the initial database. It records checkpoints
+  (the directories that have been completed), so an interrupted initial scan
+  is resumed where it left off when it is called again. The directories it
+  had completed are then scanned for changes instead.
 - Use scan() afterwards, to get the changes.
 - Use scan_tree() (which uses scan()) to get the changes in an entire
   directory structure.
+- Use list_dirs() to get all known directories in a directory tree.
 - Use purge_path() to purge all the metadata for a path from the database.
 - Use (add|update|remove)_files() to add/update/remove files manually (useful
   when your application has more/faster knowledge of changes)
 
-TODO: unit tests (with *many* mock functions). Stable enough without them.
+scan() compares the sorted directory listing with the sorted metadata in the
+database in a single pass (a merge join), so its memory consumption does not
+depend on the number of files in a directory.
 """
 
 
@@ -28,55 +37,102 @@ __license__ = "GPL"
 import os
 import stat
 import sqlite3
+import time
 from sets import Set
 
 
+# Define exceptions.
+class PathScannerError(Exception): pass
+class InvalidModificationFieldError(PathScannerError): pass
+
+
 class PathScanner(object):
     """scan paths for changes, persistent storage using SQLite"""
-    def __init__(self, dbcon, ignored_dirs=[], table="pathscanner", commit_interval=50):
+
+
+    # The metadata fields that can be used to detect modifications, in the
+    # order in which they are stored after the path and filename.
+    FIELDS = ("mtime", "size", "inode", "ctime", "mtime_ns")
+    DEFAULT_MODIFICATION_FIELDS = ("mtime_ns", "size", "inode")
+
+
+    def __init__(self, dbcon, ignored_dirs=[], table="pathscanner", commit_interval=50, max_files_per_second=0, modification_fields=DEFAULT_MODIFICATION_FIELDS):
+        for field in modification_fields:
+            if field not in PathScanner.FIELDS:
+                raise InvalidModificationFieldError(field)
+
         self.dbcon                  = dbcon
         self.dbcur                  = dbcon.cursor()
         self.ignored_dirs           = ignored_dirs
         self.table                  = table
         self.uncommitted_statements = 0
         self.commit_interval        = commit_interval
+        self.max_files_per_second   = max_files_per_second
+        self.modification_fields    = [PathScanner.FIELDS.index(field) for field in modification_fields]
+        # The number of os.stat() calls performed, to allow for I/O budgets.
+        self.num_stats              = 0
         self.__prepare_db()
 
 
     def __prepare_db(self):
         """prepare the database (create the table structure)"""
 
-        self.dbcur.execute("CREATE TABLE IF NOT EXISTS %s(path text, filename text, mtime integer)" % (self.table))
+        self.dbcur.execute("CREATE TABLE IF NOT EXISTS %s(path text, filename text, mtime integer, size integer, inode integer, ctime integer, mtime_ns integer)" % (self.table))
+        # Upgrade tables of older versions, which only stored the mtime.
+        self.dbcur.execute("PRAGMA table_info(%s)" % (self.table))
+        columns = [row[1] for row in self.dbcur.fetchall()]
+        for field in PathScanner.FIELDS:
+            if field not in columns:
+                self.dbcur.execute("ALTER TABLE %s ADD COLUMN %s integer" % (self.table, field))
         self.dbcur.execute("CREATE UNIQUE INDEX IF NOT EXISTS file_unique_per_path ON %s (path, filename)" % (self.table))
+        # Checkpoints of initial scans that are in progress: a row with a NULL
+        # path marks the initial scan of scan_path as started, every other
+        # row is a directory whose entire subtree has been stored already.
+        self.dbcur.execute("CREATE TABLE IF NOT EXISTS %s_checkpoints(scan_path text, path text)" % (self.table))
+        self.dbcur.execute("CREATE UNIQUE INDEX IF NOT EXISTS %s_checkpoint_unique_per_scan_path ON %s_checkpoints (scan_path, path)" % (self.table, self.table))
         self.dbcon.commit()
 
 
-    def __walktree(self, path):
+    def __walktree(self, path, completed_dirs=Set(), skipped_dirs=None):
+        """walk a directory tree, bottom-up
+
+        Yields a (path, rows) tuple for each directory, *after* all of its
+        subdirectories have been yielded. Directories in completed_dirs are
+        skipped entirely, as are their subtrees; they are appended to
+        skipped_dirs, if set.
+        """
+        if path in completed_dirs:
+            if skipped_dirs is not None:
+                skipped_dirs.append(path)
+            return
         rows = []
-        for path, filename, mtime, is_dir in self.__listdir(path):
-            rows.append((path, filename, mtime if not is_dir else -1))
+        for row, is_dir in self.__listdir(path):
+            rows.append(row)
             if is_dir:
-                for childrows in self.__walktree(os.path.join(path, filename)):
-                    yield childrows
-        yield rows
+                (path, filename) = row[:2]
+                for childpath, childrows in self.__walktree(os.path.join(path, filename), completed_dirs, skipped_dirs):
+                    yield (childpath, childrows)
+        yield (path, rows)
 
 
     def __listdir(self, path):
         """list all the files in a directory
         
-        Returns (path, filename, mtime, is_dir) tuples.
+        Returns (row, is_dir) tuples, sorted by filename in the same order as
+        SQLite sorts them. See sort_key() and stat_to_row().
         """
 
         try:
             filenames = os.listdir(path)
         except os.error:
             return
+        filenames.sort(key=PathScanner.sort_key)
 
         for filename in filenames:
             try:
                 path_to_file = os.path.join(path, filename)
+                self.num_stats += 1
                 st = os.stat(path_to_file)
-                mtime = st[stat.ST_MTIME]
                 if stat.S_ISDIR(st.st_mode):
                     # If this is one of the ignored directories, skip it.
                     if filename in self.ignored_dirs:
@@ -88,26 +144,125 @@ class PathScanner(object):
                         is_dir = not os.path.islink(path_to_file)
                 else:
                     is_dir = False
-                row = (path, filename, mtime, is_dir)
+                row = (PathScanner.stat_to_row(path, filename, st, is_dir), is_dir)
             except os.error:
                 continue
             yield row
 
 
-    def initial_scan(self, path):
+    @staticmethod
+    def stat_to_row(path, filename, st, is_dir=False):
+        """build the row to store for a file from its os.stat() result
+
+        Directories are stored with an mtime of -1 and no other metadata.
+        Python 2's os.stat() offers no integer nanosecond mtime, hence it is
+        derived from the floating point mtime (which has sub-microsecond
+        precision).
+        """
+        if is_dir:
+            return (path, filename, -1, None, None, None, None)
+        return (path, filename, st[stat.ST_MTIME], st.st_size, st.st_ino, st[stat.ST_CTIME], long(st.st_mtime * 1000000000))
+
+
+    @staticmethod
+    def sort_key(filename):
+        """key to sort filenames in the same order as SQLite does
+
+        SQLite compares text with memcmp() on its UTF-8 representation, which
+        does not always match the order of Python's unicode strings.
+        """
+        if isinstance(filename, unicode):
+            return filename.encode('utf-8')
+        return filename
+
+
+    def initial_scan(self, path, callback=None, changes_callback=None):
         """perform the initial scan
-        
+
+        Every directory is checkpointed once its files have been stored, so
+        when the initial scan is interrupted, calling this method again will
+        resume it without walking the completed subtrees again. Instead,
+        those subtrees are scanned for the changes that were made meanwhile.
+        If set, callback is called for each directory with (path, files) as
+        arguments, with files in the same format as for add_files().
+        If set, changes_callback is called for each directory of the
+        completed subtrees with (path, result) as arguments, like scan_tree()
+        yields them.
+
         Returns False if there is already data available for this path.
         """
         assert type(path) == type(u'.')
 
-        # Check if there really isn't any data available for this path.
-        self.dbcur.execute("SELECT COUNT(filename) FROM %s WHERE path=?" % (self.table), (path,))
-        if self.dbcur.fetchone()[0] > 0:
-            return False
-        
-        for files in self.__walktree(path):
+        completed_dirs = self.__get_checkpoints(path)
+        if completed_dirs is None:
+            # Check if there really isn't any data available for this path.
+            self.dbcur.execute("SELECT COUNT(filename) FROM %s WHERE path=?" % (self.table), (path,))
+            if self.dbcur.fetchone()[0] > 0:
+                return False
+
+            # Mark the initial scan for this path as started.
+            self.dbcur.execute("INSERT INTO %s_checkpoints VALUES(?, NULL)" % (self.table), (path,))
+            self.dbcon.commit()
+            completed_dirs = Set()
+
+        start_time = time.time()
+        num_files = 0
+        skipped_dirs = []
+        for dirpath, files in self.__walktree(path, completed_dirs, skipped_dirs):
             self.add_files(files)
+            if callable(callback):
+                callback(dirpath, files)
+            self.dbcur.execute("INSERT OR REPLACE INTO %s_checkpoints VALUES(?, ?)" % (self.table), (path, dirpath))
+            self.dbcon.commit()
+
+            num_files += len(files)
+            self.__throttle(start_time, num_files)
+
+        # Files may have been created, modified or deleted in the subtrees
+        # that were completed before the initial scan was interrupted. If it
+        # is interrupted again meanwhile, they are scanned again.
+        for skipped_dir in skipped_dirs:
+            for dirpath, result in self.scan_tree(skipped_dir):
+                if callable(changes_callback):
+                    changes_callback(dirpath, result)
+
+        # The initial scan is complete, hence its checkpoints are obsolete.
+        self.dbcur.execute("DELETE FROM %s_checkpoints WHERE scan_path=?" % (self.table), (path,))
+        self.dbcon.commit()
+        return True
+
+
+    def __get_checkpoints(self, path):
+        """get the checkpoints of the initial scan of a path
+
+        Returns None if no initial scan is in progress for this path,
+        otherwise the set of directories that have been completed.
+        """
+        self.dbcur.execute("SELECT path FROM %s_checkpoints WHERE scan_path=?" % (self.table), (path,))
+        rows = self.dbcur.fetchall()
+        if len(rows) == 0:
+            return None
+        return Set([completed_dir for (completed_dir, ) in rows if completed_dir is not None])
+
+
+    def __throttle(self, start_time, num_files):
+        """sleep if files are being scanned faster than max_files_per_second"""
+        if self.max_files_per_second > 0:
+            ahead = float(num_files) / self.max_files_per_second - (time.time() - start_time)
+            if ahead > 0:
+                time.sleep(ahead)
+
+
+    def list_dirs(self, path):
+        """list a directory and all known directories in its tree"""
+        assert type(path) == type(u'.')
+
+        dirs = [path]
+        # An mtime of -1 means that this is a directory.
+        self.dbcur.execute("SELECT path, filename FROM %s WHERE mtime = -1 AND (path = ? OR path LIKE ?)" % (self.table), (path, path + os.sep + "%"))
+        for (dirpath, filename) in self.dbcur.fetchall():
+            dirs.append(os.path.join(dirpath, filename))
+        return dirs
 
 
     def purge_path(self, path):
@@ -115,6 +270,7 @@ class PathScanner(object):
         assert type(path) == type(u'.')
 
         self.dbcur.execute("DELETE FROM %s WHERE path LIKE ?" % (self.table), (path + "%",))
+        self.dbcur.execute("DELETE FROM %s_checkpoints WHERE scan_path LIKE ?" % (self.table), (path + "%",))
         self.dbcur.execute("VACUUM %s" % (self.table))
         self.dbcon.commit()
 
@@ -122,7 +278,8 @@ class PathScanner(object):
     def add_files(self, files):
         """add file metadata to the database
         
-        Expected format: a set of (path, filename, mtime) tuples.
+        Expected format: a set of (path, filename, mtime, size, inode, ctime,
+        mtime_ns) tuples, see stat_to_row().
         """
         self.update_files(files)
 
@@ -130,7 +287,9 @@ class PathScanner(object):
     def update_files(self, files):
         """update file metadata in the database
 
-        Expected format: a set of (path, filename, mtime) tuples.
+        Expected format: a set of (path, filename, mtime, size, inode, ctime,
+        mtime_ns) tuples, see stat_to_row(). For backwards compatibility,
+        (path, filename, mtime) tuples are accepted as well.
         """
 
         for row in files:
@@ -138,7 +297,8 @@ class PathScanner(object):
             # (inotify on Linux, FSEvents on OS X) run *while* missed events
             # are being generated.
             # See https://github.com/wimleers/fileconveyor/issues/69.
-            self.dbcur.execute("INSERT OR REPLACE INTO %s VALUES(?, ?, ?)" % (self.table), row)
+            row = tuple(row) + (None, ) * (2 + len(PathScanner.FIELDS) - len(row))
+            self.dbcur.execute("INSERT OR REPLACE INTO %s (path, filename, mtime, size, inode, ctime, mtime_ns) VALUES(?, ?, ?, ?, ?, ?, ?)" % (self.table), row)
             self.__db_batched_commit()
         # Commit the remaining rows.
         self.__db_batched_commit(True)
@@ -176,46 +336,112 @@ class PathScanner(object):
         By design, so that this function can be used by scan_tree():
         - Cannot detect newly created directory trees.
         - Can detect deleted directory trees.
+
+        Returns a dictionary of sets of filenames with the keys "created",
+        "deleted" and "modified".
         """
 
         assert type(path) == type(u'.')
-        # Fetch the old metadata from the DB.
-        self.dbcur.execute("SELECT filename, mtime FROM %s WHERE path=?" % (self.table), (path, ))
-        old_files = {}
-        for filename, mtime in self.dbcur.fetchall():
-            old_files[filename] = (filename, mtime)
-
-        # Get the current metadata.
-        new_files = {}
-        for path, filename, mtime, is_dir in self.__listdir(path):
-            new_files[filename] = (filename, mtime if not is_dir else -1)
-
-        scan_result = self.__scanhelper(path, old_files, new_files)
-
-        # Add the created files to the DB.
-        files = Set()
-        for filename in scan_result["created"]:
-            (filename, mtime) = new_files[filename]
-            files.add((path, filename, mtime))
-        self.add_files(files)
-        # Update the modified files in the DB.
-        files = Set()
-        for filename in scan_result["modified"]:
-            (filename, mtime) = new_files[filename]
-            files.add((path, filename, mtime))
-        self.update_files(files)
-        # Remove the deleted files from the DB.
-        files = Set()
-        for filename in scan_result["deleted"]:
-            if len(os.path.dirname(filename)):
-                realpath = path + os.sep + os.path.dirname(filename)
+
+        # The dictionary that will be returned.
+        result = {}
+        result["created"] = Set()
+        result["deleted"] = Set()
+        result["modified"] = Set()
+
+        # The rows that must be added, updated or deleted in the DB. Rows
+        # that lack metadata (because they were stored by an older version)
+        # are also updated, without reporting them as modified.
+        created_rows  = []
+        modified_rows = []
+        upgraded_rows = []
+        deleted_rows  = []
+        deleted_dirs  = []
+
+        # Walk the old metadata (from the DB) and the current metadata (from
+        # the file system) in lockstep: both are sorted by filename, so a
+        # merge join finds all differences without loading either of them in
+        # memory entirely. This keeps memory consumption bounded, even for
+        # directories that contain huge numbers of files.
+        # A separate cursor is used because the rows are fetched lazily.
+        old_files = self.dbcon.cursor().execute("SELECT filename, mtime, size, inode, ctime, mtime_ns FROM %s WHERE path=? ORDER BY filename" % (self.table), (path, ))
+        new_files = self.__listdir(path)
+        old = next(old_files, None)
+        new = next(new_files, None)
+        while old is not None or new is not None:
+            if old is not None:
+                old_filename = old[0]
+                old_mtime    = old[1]
+            if new is not None:
+                (new_row, is_dir) = new
+                new_filename = new_row[1]
+
+            if new is None or (old is not None and PathScanner.sort_key(old_filename) < PathScanner.sort_key(new_filename)):
+                # Only in the DB: this file was deleted.
+                result["deleted"].add(old_filename)
+                deleted_rows.append((path, old_filename))
+                # An mtime of -1 means that this is a directory.
+                if old_mtime == -1:
+                    deleted_dirs.append(old_filename)
+                old = next(old_files, None)
+            elif old is None or PathScanner.sort_key(old_filename) > PathScanner.sort_key(new_filename):
+                # Only on the file system: this file was created.
+                result["created"].add(new_filename)
+                created_rows.append(new_row)
+                new = next(new_files, None)
             else:
-                realpath = path
-            realfilename = os.path.basename(filename)
-            files.add((realpath, realfilename))
-        self.delete_files(files)
+                # In both: this file may have been modified.
+                modified = self.__is_modified(old[1:], new_row[2:])
+                if modified:
+                    result["modified"].add(new_filename)
+                    modified_rows.append(new_row)
+                elif None in old[1:] and old_mtime != -1:
+                    upgraded_rows.append(new_row)
+                old = next(old_files, None)
+                new = next(new_files, None)
+
+        # If a directory was deleted, we also need to retrieve the filenames
+        # and paths of the files within that subtree.
+        for filename in deleted_dirs:
+            dirpath = path + os.sep + filename
+            self.dbcur.execute("SELECT path, filename FROM %s WHERE path LIKE ?" % (self.table), (dirpath + "%",))
+            # Mark all files below the deleted directory also as deleted.
+            for (subpath, subfilename) in self.dbcur.fetchall():
+                result["deleted"].add(os.path.join(subpath, subfilename)[len(path) + 1:])
+                deleted_rows.append((subpath, subfilename))
+
+        # Add the created files to the DB, update the modified files and
+        # remove the deleted files.
+        self.add_files(created_rows)
+        self.update_files(modified_rows)
+        self.update_files(upgraded_rows)
+        self.delete_files(deleted_rows)
+
+        return result
 
-        return scan_result
+
+    def __is_modified(self, old_metadata, new_metadata):
+        """check whether a file has been modified, according to the
+        modification fields
+
+        Both arguments are tuples of the fields in PathScanner.FIELDS.
+        """
+        # A file that became a directory or vice versa (an mtime of -1 means
+        # that this is a directory).
+        if (old_metadata[0] == -1) != (new_metadata[0] == -1):
+            return True
+
+        # Metadata stored by an older version only contains the mtime: then
+        # fall back to comparing the mtime.
+        compared = False
+        for i in self.modification_fields:
+            if old_metadata[i] is not None:
+                compared = True
+                if old_metadata[i] != new_metadata[i]:
+                    return True
+        if not compared:
+            return old_metadata[0] != new_metadata[0]
+        return False
 
 
     def scan_tree(self, path):
@@ -234,68 +460,13 @@ class PathScanner(object):
         yield (path, result)
 
         # Also scan each subdirectory.
-        for path, filename, mtime, is_dir in self.__listdir(path):
+        for row, is_dir in self.__listdir(path):
             if is_dir:
+                (path, filename) = row[:2]
                 for subpath, subresult in self.scan_tree(os.path.join(path, filename)):
                     yield (subpath, subresult)
 
 
-    def __scanhelper(self, path, old_files, new_files):
-        """helper function for scan()
-
-        old_files and new_files should be dictionaries of (filename, mtime)
-        tuples, keyed by filename
-
-        Returns a dictionary of sets of filenames with the keys "created",
-        "deleted" and "modified".
-        """
-
-        # The dictionary that will be returned.
-        result = {}
-        result["created"] = Set()
-        result["deleted"] = Set()
-        result["modified"] = Set()
-
-        # Create some sets that will make our work easier.
-        old_filenames = Set(old_files.keys())
-        new_filenames = Set(new_files.keys())
-
-        # Step 1: find newly created files.
-        result["created"] = new_filenames.difference(old_filenames)
-
-        # Step 2: find deleted files.
-        result["deleted"] = old_filenames.difference(new_filenames)
-
-        # Step 3: find modified files.
-        # Only files that are not created and not deleted can be modified!
-        possibly_modified_files = new_filenames.union(old_filenames)
-        possibly_modified_files = possibly_modified_files.symmetric_difference(result["created"])
-        possibly_modified_files = possibly_modified_files.symmetric_difference(result["deleted"])
-        for filename in possibly_modified_files:
-            (filename, old_mtime) = old_files[filename]
-            (filename, new_mtime) = new_files[filename]
-            if old_mtime != new_mtime:
-                result["modified"].add(filename)
-
-        # Step 4
-        # If a directory was deleted, we also need to retrieve the filenames
-        # and paths of the files within that subtree.
-        deleted_tree = Set()
-        for deleted_file in result["deleted"]:
-            (filename, mtime) = old_files[deleted_file]
-            # An mtime of -1 means that this is a directory.
-            if mtime == -1:
-                dirpath = path + os.sep + filename
-                self.dbcur.execute("SELECT * FROM %s WHERE path LIKE ?" % (self.table), (dirpath + "%",))
-                files_in_dir = self.dbcur.fetchall()
-                # Mark all files below the deleted directory also as deleted.
-                for (subpath, subfilename, submtime) in files_in_dir:
-                    deleted_tree.add(os.path.join(subpath, subfilename)[len(path) + 1:])
-        result["deleted"] = result["deleted"].union(deleted_tree)
-        
-        return result
-
-
 if __name__ == "__main__":
     # Sample usage
     path = "/Users/wimleers/Downloads"
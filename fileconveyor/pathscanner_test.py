@@ -0,0 +1,198 @@
+"""Unit test for pathscanner.py"""
+
+
+__author__ = "Wim Leers (work@wimleers.com)"
+__version__ = "$Rev$"
+__date__ = "$Date$"
+__license__ = "GPL"
+
+
+from pathscanner import *
+import os
+import os.path
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+
+class Interrupted(Exception): pass
+
+
+class TestConditions(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp().decode('utf-8')
+        self.db = "pathscanner_test.db"
+        if os.path.exists(self.db):
+            os.remove(self.db)
+        self.dbcon = sqlite3.connect(self.db)
+        self.dbcon.text_factory = unicode
+
+        # Build a small directory tree.
+        for subdir in [u"a", u"a/b", u"c"]:
+            os.mkdir(os.path.join(self.path, subdir))
+        for filename in [u"1.txt", u"a/2.txt", u"a/b/3.txt", u"c/4.txt"]:
+            self.touch(filename)
+
+
+    def tearDown(self):
+        self.dbcon.close()
+        if os.path.exists(self.db):
+            os.remove(self.db)
+        shutil.rmtree(self.path)
+
+
+    def touch(self, filename, mtime=None):
+        f = open(os.path.join(self.path, filename), "w")
+        f.write(filename.encode('utf-8'))
+        f.close()
+        if mtime is not None:
+            os.utime(os.path.join(self.path, filename), (mtime, mtime))
+
+
+    def count(self, scanner):
+        scanner.dbcur.execute("SELECT COUNT(*) FROM %s" % (scanner.table))
+        return scanner.dbcur.fetchone()[0]
+
+
+    def scan_tree(self, scanner):
+        report = {"created" : Set(), "deleted" : Set(), "modified" : Set()}
+        for path, result in scanner.scan_tree(self.path):
+            for key in report.keys():
+                report[key] = report[key].union(result[key])
+        return report
+
+
+    def testInitialScan(self):
+        scanner = PathScanner(self.dbcon)
+        self.assertEqual(True, scanner.initial_scan(self.path))
+        # 4 files and 3 directories.
+        self.assertEqual(7, self.count(scanner))
+        # There is data for this path now.
+        self.assertEqual(False, scanner.initial_scan(self.path))
+
+
+    def testResumedInitialScan(self):
+        scanner = PathScanner(self.dbcon)
+        scanned_dirs = []
+        def interrupt(path, files):
+            scanned_dirs.append(path)
+            if len(scanned_dirs) == 2:
+                raise Interrupted
+        self.assertRaises(Interrupted, scanner.initial_scan, self.path, interrupt)
+
+        # Meanwhile, files change in the directory that was completed.
+        self.touch(u"a/b/6.txt")
+        os.remove(os.path.join(self.path, u"a/b/3.txt"))
+
+        # Resume the initial scan: only the directories that were not yet
+        # completed should be scanned, the completed ones are scanned for
+        # changes.
+        resumed_dirs = []
+        report = {"created" : Set(), "deleted" : Set(), "modified" : Set()}
+        def changes(path, result):
+            for key in report.keys():
+                report[key] = report[key].union(result[key])
+        scanner = PathScanner(self.dbcon)
+        self.assertEqual(True, scanner.initial_scan(self.path, lambda path, files: resumed_dirs.append(path), changes))
+        self.assertEqual(7, self.count(scanner))
+        self.assertEqual(1, len(Set(scanned_dirs).intersection(Set(resumed_dirs))), "Only the interrupted directory is scanned again.")
+        self.assertEqual(4, len(Set(scanned_dirs).union(Set(resumed_dirs))))
+        self.assertEqual(Set([os.path.join(self.path, u"a/b/6.txt")]), report["created"])
+        self.assertEqual(Set([os.path.join(self.path, u"a/b/3.txt")]), report["deleted"])
+        self.assertEqual({"created" : Set(), "deleted" : Set(), "modified" : Set()}, self.scan_tree(scanner))
+
+        # Once complete, the checkpoints are gone.
+        self.assertEqual(False, scanner.initial_scan(self.path))
+
+
+    def testScanTree(self):
+        scanner = PathScanner(self.dbcon)
+        scanner.initial_scan(self.path)
+        self.assertEqual({"created" : Set(), "deleted" : Set(), "modified" : Set()}, self.scan_tree(scanner))
+
+        self.touch(u"a/5.txt")
+        self.touch(u"c/4.txt", 1000000000)
+        shutil.rmtree(os.path.join(self.path, u"a/b"))
+        report = self.scan_tree(scanner)
+        self.assertEqual(Set([os.path.join(self.path, u"a/5.txt")]), report["created"])
+        self.assertEqual(Set([os.path.join(self.path, u"c/4.txt")]), report["modified"])
+        self.assertEqual(Set([os.path.join(self.path, u"a/b"), os.path.join(self.path, u"a/b/3.txt")]), report["deleted"])
+
+        # The changes have been stored.
+        self.assertEqual({"created" : Set(), "deleted" : Set(), "modified" : Set()}, self.scan_tree(scanner))
+
+
+    def testScanLargeDirectory(self):
+        # Filenames whose order differs depending on how they're compared.
+        filenames = [u"B.txt", u"a.txt", u"Z10.txt", u"z2.txt", u"~.txt"]
+        filenames += [u"file%d.txt" % (i) for i in range(500)]
+        # Non-ASCII filenames, if the file system encoding supports them.
+        try:
+            u"\xe0\xe9\u4e2d".encode(sys.getfilesystemencoding())
+            (created, modified, deleted) = (u"\xe0.txt", u"\xe9.txt", u"\u4e2d.txt")
+        except UnicodeEncodeError:
+            (created, modified, deleted) = (u"_.txt", u"~.txt", u"a.txt")
+        filenames += [modified, deleted]
+        for filename in filenames:
+            self.touch(filename)
+        scanner = PathScanner(self.dbcon)
+        scanner.initial_scan(self.path)
+        self.assertEqual({"created" : Set(), "deleted" : Set(), "modified" : Set()}, scanner.scan(self.path))
+
+        self.touch(modified, 1000000000)
+        self.touch(u"file250.txt", 1000000000)
+        self.touch(created)
+        os.remove(os.path.join(self.path, deleted))
+        os.remove(os.path.join(self.path, u"B.txt"))
+        result = scanner.scan(self.path)
+        self.assertEqual(Set([created]), result["created"])
+        self.assertEqual(Set([modified, u"file250.txt"]), result["modified"])
+        self.assertEqual(Set([deleted, u"B.txt"]), result["deleted"])
+        self.assertEqual({"created" : Set(), "deleted" : Set(), "modified" : Set()}, scanner.scan(self.path))
+
+
+    def testModificationFields(self):
+        scanner = PathScanner(self.dbcon)
+        scanner.initial_scan(self.path)
+
+        # A rewrite within the same second is detected.
+        self.touch(u"1.txt", 1000000000.25)
+        scanner.scan(self.path)
+        self.touch(u"1.txt", 1000000000.75)
+        self.assertEqual(Set([u"1.txt"]), scanner.scan(self.path)["modified"])
+
+        # Touching a file is ignored when the mtime does not count.
+        scanner = PathScanner(self.dbcon, modification_fields=("size", "inode"))
+        self.touch(u"1.txt", 1200000000)
+        self.assertEqual(Set(), scanner.scan(self.path)["modified"])
+        f = open(os.path.join(self.path, u"1.txt"), "a")
+        f.write("more")
+        f.close()
+        self.assertEqual(Set([u"1.txt"]), scanner.scan(self.path)["modified"])
+
+        self.assertRaises(InvalidModificationFieldError, PathScanner, self.dbcon, modification_fields=("md5", ))
+
+
+    def testUpgradedTable(self):
+        # A table as it was created by older versions, which only stored the
+        # mtime.
+        dbcur = self.dbcon.cursor()
+        dbcur.execute("CREATE TABLE pathscanner(path text, filename text, mtime integer)")
+        for filename in os.listdir(self.path):
+            st = os.stat(os.path.join(self.path, filename))
+            dbcur.execute("INSERT INTO pathscanner VALUES(?, ?, ?)", (self.path, filename, -1 if stat.S_ISDIR(st.st_mode) else st[stat.ST_MTIME]))
+        self.dbcon.commit()
+
+        # The missing metadata is added, without reporting modifications.
+        scanner = PathScanner(self.dbcon)
+        self.assertEqual({"created" : Set(), "deleted" : Set(), "modified" : Set()}, scanner.scan(self.path))
+        dbcur.execute("SELECT COUNT(*) FROM pathscanner WHERE mtime_ns IS NULL AND mtime != -1")
+        self.assertEqual(0, dbcur.fetchone()[0])
+        self.touch(u"1.txt", 1000000000)
+        self.assertEqual(Set([u"1.txt"]), scanner.scan(self.path)["modified"])
+
+
+if __name__ == "__main__":
+    unittest.main()
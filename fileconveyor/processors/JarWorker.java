@@ -0,0 +1,125 @@
+/**
+ * JarWorker: runs the main class of jar files in a single, long-lived JVM.
+ *
+ * Used by jvm_worker.py to avoid the JVM startup time for every file that is
+ * processed by a Java-based processor. Reads jobs from stdin, one per line:
+ * the path to the jar file followed by the arguments, separated by tabs and
+ * each URL-encoded (UTF-8). Several jobs may be sent at once; they're run in
+ * order. For each job, a line is written to stdout: the exit status, the
+ * URL-encoded stdout and the URL-encoded stderr, separated by tabs.
+ *
+ * Calls to System.exit() by the jar's main class are trapped, so they only
+ * end the job. That requires a security manager, which Java 24 and later
+ * don't support. Once it's ready to run jobs, "ready" is written to stdout;
+ * if it can't be, the reason is written instead and JarWorker exits.
+ */
+
+import java.io.BufferedReader;
+import java.io.ByteArrayOutputStream;
+import java.io.File;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.net.URL;
+import java.net.URLClassLoader;
+import java.net.URLDecoder;
+import java.net.URLEncoder;
+import java.security.Permission;
+import java.util.HashMap;
+import java.util.Map;
+import java.util.jar.Attributes;
+import java.util.jar.JarFile;
+
+public class JarWorker {
+    static class ExitTrappedException extends SecurityException {
+        final int status;
+
+        ExitTrappedException(int status) {
+            super("System.exit(" + status + ") trapped");
+            this.status = status;
+        }
+    }
+
+    static Map<String, Method> mainMethods = new HashMap<String, Method>();
+
+    static Method getMainMethod(String jar) throws Exception {
+        Method mainMethod = mainMethods.get(jar);
+        if (mainMethod == null) {
+            JarFile jarFile = new JarFile(jar);
+            String mainClass = jarFile.getManifest().getMainAttributes().getValue(Attributes.Name.MAIN_CLASS);
+            jarFile.close();
+            URLClassLoader loader = new URLClassLoader(new URL[] { new File(jar).toURI().toURL() }, JarWorker.class.getClassLoader());
+            mainMethod = loader.loadClass(mainClass).getMethod("main", String[].class);
+            mainMethods.put(jar, mainMethod);
+        }
+        return mainMethod;
+    }
+
+    static String encode(ByteArrayOutputStream stream) throws Exception {
+        return URLEncoder.encode(stream.toString("UTF-8"), "UTF-8");
+    }
+
+    public static void main(String[] args) throws Exception {
+        BufferedReader in = new BufferedReader(new InputStreamReader(System.in, "UTF-8"));
+        PrintStream out = new PrintStream(new FileOutputStream(FileDescriptor.out), true, "UTF-8");
+
+        try {
+            System.setSecurityManager(new SecurityManager() {
+                public void checkExit(int status) {
+                    throw new ExitTrappedException(status);
+                }
+
+                public void checkPermission(Permission permission) {
+                }
+
+                public void checkPermission(Permission permission, Object context) {
+                }
+            });
+        } catch (UnsupportedOperationException e) {
+            out.println("Cannot trap System.exit(): " + e.getMessage());
+            Runtime.getRuntime().halt(1);
+        } catch (SecurityException e) {
+            out.println("Cannot trap System.exit(): " + e.getMessage());
+            Runtime.getRuntime().halt(1);
+        }
+        out.println("ready");
+
+        String line;
+        while ((line = in.readLine()) != null) {
+            String[] fields = line.split("\t", -1);
+            String[] jobArgs = new String[fields.length - 1];
+            for (int i = 1; i < fields.length; i++) {
+                jobArgs[i - 1] = URLDecoder.decode(fields[i], "UTF-8");
+            }
+
+            ByteArrayOutputStream jobOut = new ByteArrayOutputStream();
+            ByteArrayOutputStream jobErr = new ByteArrayOutputStream();
+            System.setOut(new PrintStream(jobOut, true, "UTF-8"));
+            System.setErr(new PrintStream(jobErr, true, "UTF-8"));
+            int status = 0;
+            try {
+                getMainMethod(URLDecoder.decode(fields[0], "UTF-8")).invoke(null, (Object) jobArgs);
+            } catch (InvocationTargetException e) {
+                Throwable cause = e.getCause();
+                if (cause instanceof ExitTrappedException) {
+                    status = ((ExitTrappedException) cause).status;
+                } else {
+                    cause.printStackTrace();
+                    status = 1;
+                }
+            } catch (Exception e) {
+                e.printStackTrace();
+                status = 1;
+            }
+            System.out.flush();
+            System.err.flush();
+            out.println(status + "\t" + encode(jobOut) + "\t" + encode(jobErr));
+        }
+
+        // Don't wait for threads that were started by the jars' main classes.
+        Runtime.getRuntime().halt(0);
+    }
+}
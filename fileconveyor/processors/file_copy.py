@@ -0,0 +1,131 @@
+"""file_copy.py Copies files without copying their data, if possible
+
+Tries, in order:
+1. a reflink (FICLONE), which shares the data blocks copy-on-write (Btrfs,
+   XFS, ...);
+2. copy_file_range(), which copies the data in the kernel (and on some file
+   systems, such as NFS, on the server);
+3. a regular copy.
+Methods that are not supported for a combination of file systems are
+remembered, so they're not tried again.
+
+Hardlinks are never used: the copy would share its inode with the original,
+so writing to the copy (as processors do with their output files) would
+modify the original.
+"""
+
+
+__author__ = "Wim Leers (work@wimleers.com)"
+__version__ = "$Rev$"
+__date__ = "$Date$"
+__license__ = "GPL"
+
+
+import ctypes
+import errno
+import fcntl
+import os
+import os.path
+import shutil
+import threading
+
+
+# Copy methods.
+REFLINK         = "reflink"
+COPY_FILE_RANGE = "copy_file_range"
+COPY            = "copy"
+METHODS = (REFLINK, COPY_FILE_RANGE, COPY)
+
+# The FICLONE ioctl request (_IOW(0x94, 9, int)).
+FICLONE = 0x40049409
+
+# Errors that indicate that a method is not supported (as opposed to an error
+# for this particular file).
+UNSUPPORTED_ERRNOS = (errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.ENOSYS, errno.EPERM)
+
+try:
+    _libc = ctypes.CDLL(None, use_errno=True)
+    _copy_file_range = _libc.copy_file_range
+    _copy_file_range.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t, ctypes.c_uint]
+    _copy_file_range.restype = ctypes.c_ssize_t
+except (OSError, AttributeError):
+    _copy_file_range = None
+
+# The unsupported methods per (source device, destination device).
+_unsupported = {}
+_unsupported_lock = threading.Lock()
+
+
+def copy_file(src, dst, methods=METHODS):
+    """copy src to dst with the first method that works, returns that method
+
+    dst is overwritten if it exists.
+    """
+    if os.path.abspath(src) == os.path.abspath(dst):
+        return None
+    devices = (os.stat(src).st_dev, os.stat(os.path.dirname(os.path.abspath(dst))).st_dev)
+    for method in methods:
+        if method in _unsupported.get(devices, ()):
+            continue
+        if os.path.lexists(dst):
+            os.remove(dst)
+        try:
+            if method == REFLINK:
+                _reflink(src, dst)
+            elif method == COPY_FILE_RANGE:
+                _copy_file_range_into(src, dst)
+            else:
+                shutil.copyfile(src, dst)
+        except (IOError, OSError), e:
+            if method == COPY or e.errno not in UNSUPPORTED_ERRNOS:
+                raise
+            _unsupported_lock.acquire()
+            _unsupported.setdefault(devices, set()).add(method)
+            _unsupported_lock.release()
+        else:
+            return method
+    raise OSError(errno.EOPNOTSUPP, "None of the copy methods is supported: %s" % (", ".join(methods)))
+
+
+def _reflink(src, dst):
+    fsrc = open(src, "rb")
+    try:
+        fdst = open(dst, "wb")
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        finally:
+            fdst.close()
+    except:
+        fsrc.close()
+        if os.path.exists(dst):
+            os.remove(dst)
+        raise
+    fsrc.close()
+
+
+def _copy_file_range_into(src, dst):
+    if _copy_file_range is None:
+        raise OSError(errno.ENOSYS, "copy_file_range() is not available")
+    fsrc = open(src, "rb")
+    try:
+        fdst = open(dst, "wb")
+        try:
+            remaining = os.fstat(fsrc.fileno()).st_size
+            while remaining > 0:
+                copied = _copy_file_range(fsrc.fileno(), None, fdst.fileno(), None, min(remaining, 1024 * 1024 * 1024), 0)
+                if copied < 0:
+                    e = ctypes.get_errno()
+                    raise OSError(e, os.strerror(e))
+                # Some file systems (e.g. procfs and FUSE) report no data at
+                # all: never end up with a truncated copy.
+                if copied == 0:
+                    raise OSError(errno.EOPNOTSUPP, "copy_file_range() stopped %d bytes before the end" % (remaining))
+                remaining -= copied
+        finally:
+            fdst.close()
+    except:
+        fsrc.close()
+        if os.path.exists(dst):
+            os.remove(dst)
+        raise
+    fsrc.close()
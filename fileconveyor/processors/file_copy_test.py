@@ -0,0 +1,86 @@
+"""Unit test for file_copy.py"""
+
+
+__author__ = "Wim Leers (work@wimleers.com)"
+__version__ = "$Rev$"
+__date__ = "$Date$"
+__license__ = "GPL"
+
+
+from file_copy import *
+import file_copy
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+
+class TestConditions(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.src = os.path.join(self.path, "a.txt")
+        self.dst = os.path.join(self.path, "b.txt")
+        f = open(self.src, "wb")
+        f.write("foo" * 1000)
+        f.close()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        file_copy._unsupported.clear()
+
+
+    def read(self, filename):
+        return open(filename, "rb").read()
+
+
+    def testMethods(self):
+        for method in (COPY_FILE_RANGE, COPY):
+            self.assertEqual(method, copy_file(self.src, self.dst, (method, )))
+            self.assertEqual("foo" * 1000, self.read(self.dst))
+            self.assertNotEqual(os.stat(self.src).st_ino, os.stat(self.dst).st_ino)
+
+        # Whichever method is used, the destination has the same contents and
+        # is overwritten.
+        self.assertTrue(copy_file(self.src, self.dst) in METHODS)
+        self.assertEqual("foo" * 1000, self.read(self.dst))
+
+        # Copying a file onto itself leaves it alone.
+        self.assertEqual(None, copy_file(self.src, self.src))
+        self.assertEqual("foo" * 1000, self.read(self.src))
+
+
+    def testUnsupported(self):
+        # Methods that are known to be unsupported for the file systems
+        # involved are skipped.
+        device = os.stat(self.path).st_dev
+        file_copy._unsupported[(device, device)] = set([REFLINK])
+        self.assertEqual(COPY_FILE_RANGE, copy_file(self.src, self.dst))
+        self.assertEqual("foo" * 1000, self.read(self.dst))
+
+        # Errors for a particular file are not about the method.
+        os.chmod(self.path, 0500)
+        try:
+            if os.access(self.path, os.W_OK):
+                return # Running as root.
+            self.assertRaises(IOError, copy_file, self.src, os.path.join(self.path, "c.txt"), (COPY_FILE_RANGE, COPY))
+            self.assertEqual(set([REFLINK]), file_copy._unsupported[(device, device)])
+        finally:
+            os.chmod(self.path, 0700)
+
+
+    def testCopyFileRangeStops(self):
+        # When copy_file_range() copies nothing before the end of the file,
+        # a regular copy is made instead.
+        copy_file_range = file_copy._copy_file_range
+        file_copy._copy_file_range = lambda fd_in, off_in, fd_out, off_out, size, flags: 0
+        try:
+            self.assertEqual(COPY, copy_file(self.src, self.dst, (COPY_FILE_RANGE, COPY)))
+        finally:
+            file_copy._copy_file_range = copy_file_range
+        self.assertEqual("foo" * 1000, self.read(self.dst))
+
+
+if __name__ == "__main__":
+    unittest.main()
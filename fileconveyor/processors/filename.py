@@ -6,7 +6,6 @@ __license__ = "GPL"
 
 from processor import *
 import os.path
-import shutil
 import hashlib
 
 
@@ -15,6 +14,7 @@ class Base(Processor):
 
 
     valid_extensions = () # Any extension is valid.
+    rename_only = True
 
 
     def __init__(self, input_file, original_file, document_root, base_path, process_for_server, parent_logger, working_dir="/tmp", search=[], replace=[]):
@@ -36,7 +36,7 @@ class Base(Processor):
         self.set_output_file_basename(new_filename)
 
         # Copy the file.
-        shutil.copyfile(self.input_file, self.output_file)
+        self.copy_input_to_output()
 
         return self.output_file
 
@@ -14,6 +14,8 @@ class GoogleClosureCompiler(Processor):
 
 
     valid_extensions = (".js")
+    resource_class = RESOURCE_CLASS_JVM
+    cost = 2 # Its optimizations need considerably more CPU and memory.
 
 
     def run(self):
@@ -21,7 +23,7 @@ class GoogleClosureCompiler(Processor):
 
         # Run Google Closure Compiler on the file.
         compiler_path = os.path.join(self.processors_path, "compiler.jar")
-        (stdout, stderr) = self.run_command("java -jar %s --js %s --js_output_file %s" % (compiler_path, self.input_file, self.output_file))
+        (stdout, stderr) = self.run_jar(compiler_path, ["--js", self.input_file, "--js_output_file", self.output_file])
 
         # Raise an exception if an error occurred.
         if not stderr == "":
@@ -0,0 +1,186 @@
+"""hashing.py Fast file hashing with a persistent cache of digests
+
+Files are read in large chunks, or memory-mapped when they're large. Besides
+the algorithms in hashlib, BLAKE2 (built-in in newer Pythons, through the
+pyblake2 module otherwise) and xxHash (through the xxhash module) are
+supported.
+
+Digests are cached in an sqlite database, keyed by the file's device, inode,
+size and mtime (in nanoseconds). Hence an unchanged file is never hashed
+again, not even after a restart. Every thread (and process) uses its own
+database connection. Many file systems store mtimes in (1 or 2) seconds, so a
+file that is rewritten in place right after it was modified may keep all of
+its metadata: the digests of recently modified files are never cached.
+
+Call configure() to set the default algorithm and to enable the cache.
+"""
+
+
+__author__ = "Wim Leers (work@wimleers.com)"
+__version__ = "$Rev$"
+__date__ = "$Date$"
+__license__ = "GPL"
+
+
+import hashlib
+import mmap
+import os
+import sqlite3
+import threading
+import time
+try:
+    import pyblake2
+except ImportError:
+    pyblake2 = None
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+# Define exceptions.
+class HashingError(Exception): pass
+class UnsupportedHashAlgorithmError(HashingError): pass
+
+
+CHUNK_SIZE = 1024 * 1024
+MMAP_THRESHOLD = 16 * 1024 * 1024
+# The coarsest mtime granularity of the supported file systems (FAT), in
+# seconds.
+MTIME_GRANULARITY = 2
+
+# The default algorithm and the cache of digests, see configure().
+default_algorithm = "sha1"
+cache = None
+
+
+def new(algorithm):
+    """get a new hash object for an algorithm"""
+    if algorithm in ("blake2b", "blake2s"):
+        if hasattr(hashlib, algorithm):
+            return getattr(hashlib, algorithm)()
+        if pyblake2 is not None:
+            return getattr(pyblake2, algorithm)()
+    elif algorithm in ("xxh32", "xxh64"):
+        if xxhash is not None:
+            return getattr(xxhash, algorithm)()
+    else:
+        try:
+            return hashlib.new(algorithm)
+        except ValueError:
+            pass
+    raise UnsupportedHashAlgorithmError("The hash algorithm '%s' is not supported (or the module that provides it is not installed)." % (algorithm))
+
+
+def hash_file(filename, algorithm):
+    """calculate the hex digest of a file, without using the cache"""
+    h = new(algorithm)
+    try:
+        f = open(filename, "rb")
+    except IOError:
+        raise HashingError("Unable to open the file in readmode: %s" % (filename))
+    try:
+        size = os.fstat(f.fileno()).st_size
+        if size >= MMAP_THRESHOLD:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                h.update(m)
+            finally:
+                m.close()
+        else:
+            data = f.read(CHUNK_SIZE)
+            while data:
+                h.update(data)
+                data = f.read(CHUNK_SIZE)
+    finally:
+        f.close()
+    return h.hexdigest()
+
+
+def get_mtime_ns(st):
+    """get the mtime of a stat() result in nanoseconds, as precise as the
+    platform allows
+    """
+    mtime_ns = getattr(st, "st_mtime_ns", None)
+    if mtime_ns is None:
+        mtime_ns = long(round(st.st_mtime * 1000000000))
+    return mtime_ns
+
+
+def get_digest(filename, algorithm=None):
+    """get the hex digest of a file, from the cache if possible"""
+    if algorithm is None:
+        algorithm = default_algorithm
+    if cache is None:
+        return hash_file(filename, algorithm)
+    return cache.get_digest(filename, algorithm)
+
+
+def configure(algorithm, cache_dbfile=None):
+    """set the default algorithm and the database in which digests are
+    cached (None disables the cache)
+    """
+    global default_algorithm, cache
+    new(algorithm) # Verify that the algorithm is supported.
+    default_algorithm = algorithm
+    if cache_dbfile is None:
+        cache = None
+    else:
+        cache = HashCache(cache_dbfile)
+
+
+class HashCache(object):
+    """persistent cache of file digests, keyed by their stat() metadata"""
+
+
+    def __init__(self, dbfile, max_entries=1000000):
+        self.dbfile      = dbfile
+        self.max_entries = max_entries
+        self.local       = threading.local()
+        self.inserts     = 0
+        dbcon = self.__get_connection()
+        dbcon.execute("CREATE TABLE IF NOT EXISTS hash_cache(dev integer, inode integer, size integer, mtime_ns integer, algorithm text, digest text, created real, PRIMARY KEY (dev, inode, size, mtime_ns, algorithm))")
+        dbcon.execute("CREATE INDEX IF NOT EXISTS hash_cache_created ON hash_cache (created)")
+        dbcon.commit()
+
+
+    def __get_connection(self):
+        """get the database connection of this thread (and process)"""
+        pid = os.getpid()
+        if getattr(self.local, "pid", None) != pid:
+            self.local.dbcon = sqlite3.connect(self.dbfile, timeout=30)
+            self.local.dbcon.text_factory = unicode # This is the default, but we set it explicitly, just to be sure.
+            self.local.pid = pid
+        return self.local.dbcon
+
+
+    def __get_key(self, st, algorithm):
+        return (st.st_dev, st.st_ino, st.st_size, get_mtime_ns(st), algorithm)
+
+
+    def get_digest(self, filename, algorithm):
+        """get the hex digest of a file, hash it only if it's not cached"""
+        st = os.stat(filename)
+        key = self.__get_key(st, algorithm)
+        dbcon = self.__get_connection()
+        row = dbcon.execute("SELECT digest FROM hash_cache WHERE dev=? AND inode=? AND size=? AND mtime_ns=? AND algorithm=?", key).fetchone()
+        if row is not None:
+            return row[0]
+
+        digest = hash_file(filename, algorithm)
+        # Don't cache the digest of a file that may still be modified without
+        # changing its metadata, nor of a file that was modified while it was
+        # being hashed.
+        if time.time() - st.st_mtime < MTIME_GRANULARITY:
+            return digest
+        if self.__get_key(os.stat(filename), algorithm) != key:
+            return digest
+        dbcon.execute("INSERT OR REPLACE INTO hash_cache VALUES(?, ?, ?, ?, ?, ?, ?)", key + (digest, time.time()))
+        dbcon.commit()
+
+        # Every once in a while, forget the oldest digests.
+        self.inserts += 1
+        if self.inserts % 1000 == 0:
+            dbcon.execute("DELETE FROM hash_cache WHERE created <= (SELECT created FROM hash_cache ORDER BY created DESC LIMIT 1 OFFSET ?)", (self.max_entries, ))
+            dbcon.commit()
+        return digest
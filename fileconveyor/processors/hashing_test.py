@@ -0,0 +1,80 @@
+"""Unit test for hashing.py"""
+
+
+__author__ = "Wim Leers (work@wimleers.com)"
+__version__ = "$Rev$"
+__date__ = "$Date$"
+__license__ = "GPL"
+
+
+from hashing import *
+import hashlib
+import os
+import os.path
+import shutil
+import tempfile
+import time
+import unittest
+
+
+class TestConditions(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.filename = os.path.join(self.path, "a.txt")
+        self.write("foo" * 100000)
+        self.cache = HashCache(os.path.join(self.path, "hash_cache.db"))
+
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+
+    def write(self, data, mtime=None):
+        f = open(self.filename, "wb")
+        f.write(data)
+        f.close()
+        if mtime is not None:
+            os.utime(self.filename, (mtime, mtime))
+
+
+    def testHashFile(self):
+        self.assertEqual(hashlib.md5("foo" * 100000).hexdigest(), hash_file(self.filename, "md5"))
+        self.assertEqual(hashlib.sha1("foo" * 100000).hexdigest(), hash_file(self.filename, "sha1"))
+        self.assertRaises(UnsupportedHashAlgorithmError, hash_file, self.filename, "foo")
+
+
+    def testCache(self):
+        self.write("foo" * 100000, time.time() - 60)
+        digest = self.cache.get_digest(self.filename, "md5")
+        self.assertEqual(hashlib.md5("foo" * 100000).hexdigest(), digest)
+        # Pretend the cached digest is stale: as long as the stat() metadata
+        # doesn't change, the cached digest is used, also after a restart.
+        self.cache._HashCache__get_connection().execute("UPDATE hash_cache SET digest='stale'")
+        self.cache._HashCache__get_connection().commit()
+        self.assertEqual("stale", HashCache(self.cache.dbfile).get_digest(self.filename, "md5"))
+        # Digests are cached per algorithm.
+        self.assertEqual(hashlib.sha1("foo" * 100000).hexdigest(), self.cache.get_digest(self.filename, "sha1"))
+        # A modified file is hashed again.
+        self.write("bar")
+        self.assertEqual(hashlib.md5("bar").hexdigest(), self.cache.get_digest(self.filename, "md5"))
+
+
+    def testRecentlyModified(self):
+        # On file systems with timestamps in seconds, a file that is
+        # rewritten in place right after it was written keeps its size and
+        # mtime: its digest must not have been cached.
+        mtime = int(time.time())
+        self.write("foo", mtime)
+        self.assertEqual(hashlib.md5("foo").hexdigest(), self.cache.get_digest(self.filename, "md5"))
+        self.write("bar", mtime)
+        self.assertEqual(hashlib.md5("bar").hexdigest(), self.cache.get_digest(self.filename, "md5"))
+        # Once the mtime is old enough, the digest is cached, and used for as
+        # long as the metadata doesn't change.
+        self.write("baz", mtime - 60)
+        self.assertEqual(hashlib.md5("baz").hexdigest(), self.cache.get_digest(self.filename, "md5"))
+        self.write("qux", mtime - 60)
+        self.assertEqual(hashlib.md5("baz").hexdigest(), self.cache.get_digest(self.filename, "md5"))
+
+
+if __name__ == "__main__":
+    unittest.main()
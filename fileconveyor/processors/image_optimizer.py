@@ -5,14 +5,69 @@ __license__ = "GPL"
 
 
 from processor import *
+import logging
 import os
 import stat
+try:
+    from PIL import Image
+except ImportError:
+    try:
+        import Image
+    except ImportError:
+        Image = None
 
 
 COPY_METADATA_NONE = "none"
 COPY_METADATA_ALL  = "all"
 FILENAME_MUTABLE   = True
 FILENAME_IMMUTABLE = False
+FORMAT_GIF          = "GIF"
+FORMAT_ANIMATED_GIF = "ANIMATED_GIF"
+FORMAT_PNG          = "PNG"
+FORMAT_JPEG         = "JPEG"
+
+
+def count_GIF_frames(filename, stop_at=2):
+    """count the frames in a GIF image (up to stop_at)"""
+    f = open(filename, "rb")
+    try:
+        # Header and logical screen descriptor, followed by the optional
+        # global color table.
+        header = f.read(13)
+        if len(header) < 13:
+            return 0
+        packed = ord(header[10])
+        if packed & 0x80:
+            f.seek(3 * (2 << (packed & 0x07)), 1)
+
+        frames = 0
+        while frames < stop_at:
+            block = f.read(1)
+            if block == "\x2c":
+                # Image descriptor, followed by the optional local color table
+                # and the LZW minimum code size.
+                frames += 1
+                descriptor = f.read(9)
+                if len(descriptor) < 9:
+                    break
+                packed = ord(descriptor[8])
+                if packed & 0x80:
+                    f.seek(3 * (2 << (packed & 0x07)), 1)
+                f.seek(1, 1)
+            elif block == "\x21":
+                # Extension: skip its label.
+                f.seek(1, 1)
+            else:
+                # Trailer, or a corrupt file.
+                break
+            # Skip the data sub-blocks.
+            size = f.read(1)
+            while size not in ("", "\x00"):
+                f.seek(ord(size), 1)
+                size = f.read(1)
+        return frames
+    finally:
+        f.close()
 
 
 class Base(Processor):
@@ -20,6 +75,8 @@ class Base(Processor):
 
 
     valid_extensions = (".gif", ".png", ".jpg", ".jpeg")
+    resource_class = RESOURCE_CLASS_CPU_HEAVY
+    version = 2 # Only keeps the optimized file if it's smaller.
 
 
     def __init__(self, input_file, original_file, document_root, base_path, process_for_server, parent_logger, working_dir="/tmp", copy_metadata=COPY_METADATA_NONE, filename_mutable=FILENAME_MUTABLE):
@@ -35,7 +92,7 @@ class Base(Processor):
 
         format = self.identify_format(self.input_file)
 
-        if format == "GIF":
+        if format == FORMAT_GIF:
             if self.filename_mutable == FILENAME_MUTABLE:
                 tmp_file = os.path.join(self.working_dir, path, name + ".tmp.png")
                 self.set_output_file_basename(name + ".png")
@@ -44,14 +101,13 @@ class Base(Processor):
                 # Don't do any processing at all: return the input file.
                 self.set_output_file_basename(self.input_file)
 
-        elif format == "PNG":
+        elif format == FORMAT_PNG:
             self.optimize_PNG(self.input_file, self.output_file)
 
-        elif format == "JPEG":
+        elif format == FORMAT_JPEG:
             self.optimize_JPEG(self.input_file, self.output_file, self.copy_metadata)
 
-        # Animated GIF
-        elif len(format) >= 6 and format[0:6] == "GIFGIF":
+        elif format == FORMAT_ANIMATED_GIF:
             self.optimize_animated_GIF(self.input_file, self.output_file)
 
         else:
@@ -59,7 +115,15 @@ class Base(Processor):
             # that matches one of the supported file types, but is in fact not such
             # an image, we return the input file to ensure the chain can continue.
             self.set_output_file_basename(self.input_file)
-        
+
+        # Only keep the optimized file if it's actually smaller.
+        if self.output_file != self.input_file:
+            if not os.path.exists(self.output_file):
+                self.set_output_file_basename(self.input_file)
+            elif os.stat(self.output_file)[stat.ST_SIZE] >= os.stat(self.input_file)[stat.ST_SIZE]:
+                os.remove(self.output_file)
+                self.set_output_file_basename(self.input_file)
+
         # Clean up things.
         self.devnull.close()
 
@@ -67,21 +131,44 @@ class Base(Processor):
 
 
     def identify_format(self, filename):
-        (stdout, stderr) = self.run_command("identify -format %%m \"%s\"" % (filename))
-        return stdout
+        """identify the image format by its magic bytes"""
+        f = open(filename, "rb")
+        header = f.read(8)
+        f.close()
+        if header.startswith("\x89PNG\r\n\x1a\n"):
+            return FORMAT_PNG
+        elif header.startswith("\xff\xd8\xff"):
+            return FORMAT_JPEG
+        elif header[:6] in ("GIF87a", "GIF89a"):
+            if count_GIF_frames(filename) > 1:
+                return FORMAT_ANIMATED_GIF
+            return FORMAT_GIF
+        return None
 
 
     def optimize_GIF(self, input_file, tmp_file, output_file):
-        # Convert to temporary PNG.
-        self.run_command("convert %s %s" % (input_file, tmp_file))
+        # Convert to temporary PNG, in-process if PIL is available. PIL raises
+        # all kinds of exceptions for corrupt images: then there's no
+        # optimized file, so the input file is kept, like convert does.
+        if Image is not None:
+            try:
+                Image.open(input_file).save(tmp_file, "PNG")
+            except Exception, e:
+                logging.getLogger(".".join([self.parent_logger, "ImageOptimizer"])).warning("Could not convert the GIF image '%s' to PNG, keeping it as it is. Exception class: %s. Message: %s." % (input_file, e.__class__, e))
+                if os.path.exists(tmp_file):
+                    os.remove(tmp_file)
+                return
+        else:
+            self.run_command(["convert", input_file, tmp_file])
         # Optimize temporary PNG.
-        self.run_command("pngcrush -rem alla -reduce \"%s\" \"%s\"" % (tmp_file, output_file))
-        # Remove temporary PNG.
-        os.remove(tmp_file)
+        if os.path.exists(tmp_file):
+            self.run_command(["pngcrush", "-rem", "alla", "-reduce", tmp_file, output_file])
+            # Remove temporary PNG.
+            os.remove(tmp_file)
 
 
     def optimize_PNG(self, input_file, output_file):
-        self.run_command("pngcrush -rem alla -reduce \"%s\" \"%s\"" % (input_file, output_file))
+        self.run_command(["pngcrush", "-rem", "alla", "-reduce", input_file, output_file])
 
 
     def optimize_JPEG(self, input_file, output_file, copy_metadata):
@@ -89,13 +176,13 @@ class Base(Processor):
         # If the file is 10 KB or larger, JPEG's progressive mode
         # typically results in a higher compression ratio.
         if filesize < 10 * 1024:
-            self.run_command("jpegtran -copy %s -optimize \"%s\" > \"%s\"" % (copy_metadata, input_file, output_file))
+            self.run_command(["jpegtran", "-copy", copy_metadata, "-optimize", "-outfile", output_file, input_file])
         else:
-            self.run_command("jpegtran -copy %s -progressive -optimize \"%s\" > \"%s\"" % (copy_metadata, input_file, output_file))
+            self.run_command(["jpegtran", "-copy", copy_metadata, "-progressive", "-optimize", "-outfile", output_file, input_file])
 
 
     def optimize_animated_GIF(self, input_file, output_file):
-        self.run_command("gifsicle -O2 \"%s\" > \"%s\"" % (input_file, output_file))
+        self.run_command(["gifsicle", "-O2", "-o", output_file, input_file])
 
 
 class Max(Base):
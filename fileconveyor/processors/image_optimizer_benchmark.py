@@ -0,0 +1,147 @@
+"""image_optimizer_benchmark.py Benchmark for the image_optimizer processors
+
+Runs image_optimizer.Max on a mixed image corpus and reports, per format, the
+time spent on format detection (in-process, compared to ImageMagick's
+identify, as used before) and on optimization, plus the bytes saved.
+
+By default, a corpus of PNG images and (animated) GIF images is generated.
+Use --corpus to benchmark a directory of real images (e.g. including JPEGs).
+
+Usage: python image_optimizer_benchmark.py [--files=1000] [--corpus=DIR]
+"""
+
+
+__author__ = "Wim Leers (work@wimleers.com)"
+__version__ = "$Rev$"
+__date__ = "$Date$"
+__license__ = "GPL"
+
+
+from image_optimizer import *
+from processor_benchmark import write_png
+import optparse
+import shutil
+import struct
+import subprocess
+import tempfile
+import time
+
+
+def write_gif(filename, width, height, seed, frames=1):
+    """write a GIF image (with a 256 color grayscale palette)
+
+    Uses uncompressed LZW data: a clear code is emitted before the code table
+    would grow, so every code is 9 bits.
+    """
+    def lzw_codes(pixels):
+        for i in range(len(pixels)):
+            if i % 254 == 0:
+                yield 256 # Clear code.
+            yield pixels[i]
+        yield 257 # End of information code.
+
+    def sub_blocks(data):
+        blocks = []
+        for i in range(0, len(data), 255):
+            blocks.append(chr(len(data[i:i + 255])) + data[i:i + 255])
+        return "".join(blocks) + "\x00"
+
+    f = open(filename, "wb")
+    f.write("GIF89a" + struct.pack("<HHBBB", width, height, 0xf7, 0, 0))
+    f.write("".join([chr(i) * 3 for i in range(256)]))
+    for frame in range(frames):
+        if frames > 1:
+            # Graphic control extension: 10/100 s delay.
+            f.write("\x21\xf9\x04\x00\x0a\x00\x00\x00")
+        f.write("\x2c" + struct.pack("<HHHHB", 0, 0, width, height, 0))
+        pixels = [(x * seed + y * (frame + 3)) % 256 for y in range(height) for x in range(width)]
+        (bits, num_bits, data) = (0, 0, [])
+        for code in lzw_codes(pixels):
+            bits |= code << num_bits
+            num_bits += 9
+            while num_bits >= 8:
+                data.append(chr(bits & 0xff))
+                bits >>= 8
+                num_bits -= 8
+        if num_bits > 0:
+            data.append(chr(bits & 0xff))
+        f.write("\x08" + sub_blocks("".join(data)))
+    f.write("\x3b")
+    f.close()
+
+
+def generate_corpus(corpus_dir, num_files):
+    files = []
+    for i in range(num_files):
+        if i % 3 == 0:
+            filename = os.path.join(corpus_dir, "image%d.png" % (i))
+            write_png(filename, 64, 64, i)
+        elif i % 3 == 1:
+            filename = os.path.join(corpus_dir, "image%d.gif" % (i))
+            write_gif(filename, 64, 64, i)
+        else:
+            filename = os.path.join(corpus_dir, "animated%d.gif" % (i))
+            write_gif(filename, 32, 32, i, 3)
+        files.append(filename)
+    return files
+
+
+def identify_with_imagemagick(filename):
+    try:
+        p = subprocess.Popen(["identify", "-format", "%m", filename], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError:
+        return None
+    return p.communicate()[0]
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option("--files", type="int", default=1000, help="number of images in the generated corpus")
+    parser.add_option("--corpus", default=None, help="directory with images to use instead")
+    (options, args) = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        if options.corpus is None:
+            corpus_dir = os.path.join(tmp_dir, "corpus")
+            os.makedirs(corpus_dir)
+            files = generate_corpus(corpus_dir, options.files)
+        else:
+            files = [os.path.join(options.corpus, f) for f in os.listdir(options.corpus) if Base.would_process_input_file(f)]
+        working_dir = os.path.join(tmp_dir, "working")
+
+        stats = {}
+        for filename in files:
+            processor = Max(filename, filename, None, None, None, "ImageOptimizerBenchmark", working_dir)
+
+            start = time.time()
+            format = processor.identify_format(filename)
+            detection_time = time.time() - start
+            start = time.time()
+            identify_with_imagemagick(filename)
+            identify_time = time.time() - start
+            start = time.time()
+            output_file = processor.run()
+            optimization_time = time.time() - start
+
+            if format not in stats:
+                stats[format] = {"files" : 0, "detection" : 0.0, "identify" : 0.0, "optimization" : 0.0, "bytes_in" : 0, "bytes_out" : 0, "optimized" : 0}
+            s = stats[format]
+            s["files"] += 1
+            s["detection"] += detection_time
+            s["identify"] += identify_time
+            s["optimization"] += optimization_time
+            s["bytes_in"] += os.stat(filename).st_size
+            s["bytes_out"] += os.stat(output_file).st_size
+            if output_file != filename:
+                s["optimized"] += 1
+                os.remove(output_file)
+
+        print "%-13s %6s %15s %15s %15s %12s %10s" % ("format", "files", "detection (ms)", "identify (ms)", "optimize (ms)", "saved (B)", "optimized")
+        for format in sorted(stats.keys()):
+            s = stats[format]
+            print "%-13s %6d %15.3f %15.3f %15.3f %12d %10d" % (format, s["files"], 1000 * s["detection"] / s["files"], 1000 * s["identify"] / s["files"], 1000 * s["optimization"] / s["files"], s["bytes_in"] - s["bytes_out"], s["optimized"])
+        print "Detection and optimization times are averages per file."
+    finally:
+        shutil.rmtree(tmp_dir)
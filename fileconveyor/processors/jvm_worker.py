@@ -0,0 +1,287 @@
+"""jvm_worker.py Runs jar files in long-lived JVMs
+
+Starting a JVM takes 0.5 to 2 seconds, which is much longer than it takes the
+YUI Compressor or the Google Closure Compiler to process a typical CSS or JS
+file. Hence jar files are run by JarWorker (see JarWorker.java), of which the
+JVM is started once and then reused.
+
+JarWorker.java is compiled (with javac) when it's first needed. JVM workers
+are started on demand; one per thread that runs a jar file simultaneously. A
+JVM worker that crashes or times out is discarded, and the job is retried
+once with a new JVM worker.
+
+JarWorker traps System.exit() with a security manager. Java 12 to 23 only
+allow that with -Djava.security.manager=allow (which Java 8 to 11 refuse to
+start with), Java 24 and later don't allow it at all. If JVM workers can't be
+used, e.g. on Java 24, that's only found out once: jar files are then run
+with a new JVM each time, by the caller.
+"""
+
+
+__author__ = "Wim Leers (work@wimleers.com)"
+__version__ = "$Rev$"
+__date__ = "$Date$"
+__license__ = "GPL"
+
+
+import os
+import os.path
+import re
+import select
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import urllib
+
+
+# Define exceptions.
+class JVMWorkerError(Exception): pass
+
+
+class JVMWorker(object):
+    """a JVM that runs the main class of jar files"""
+
+
+    def __init__(self, class_dir, options, timeout):
+        self.timeout = timeout
+        self.buffer  = ""
+        self.devnull = open(os.devnull, "w")
+        try:
+            self.process = subprocess.Popen(["java"] + options + ["-cp", class_dir, "JarWorker"], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=self.devnull)
+        except OSError, e:
+            self.devnull.close()
+            raise JVMWorkerError("Could not start the JVM worker: %s" % (e))
+
+        # Wait until JarWorker is ready to run jobs.
+        try:
+            line = self.__readline(time.time() + self.timeout)
+        except JVMWorkerError, e:
+            self.stop()
+            raise JVMWorkerError("Could not start the JVM worker: %s" % (e))
+        if line != "ready":
+            self.stop()
+            raise JVMWorkerError("Could not start the JVM worker: %s" % (line))
+
+
+    def run_batch(self, jobs):
+        """run a batch of (jar, args) jobs, returns (status, stdout, stderr)
+        for each of them
+        """
+        lines = []
+        for (jar, args) in jobs:
+            fields = [jar] + list(args)
+            for i in range(len(fields)):
+                if isinstance(fields[i], unicode):
+                    fields[i] = fields[i].encode("utf-8")
+                fields[i] = urllib.quote(fields[i], safe="")
+            lines.append("\t".join(fields) + "\n")
+        try:
+            self.process.stdin.write("".join(lines))
+            self.process.stdin.flush()
+        except IOError, e:
+            raise JVMWorkerError("The JVM worker has exited: %s" % (e))
+
+        results = []
+        deadline = time.time() + self.timeout * len(jobs)
+        for job in jobs:
+            (status, stdout, stderr) = self.__readline(deadline).split("\t")
+            (stdout, stderr) = (urllib.unquote_plus(stdout).rstrip(), urllib.unquote_plus(stderr).rstrip())
+            results.append((int(status), stdout, stderr))
+        return results
+
+
+    def __readline(self, deadline):
+        fd = self.process.stdout.fileno()
+        while "\n" not in self.buffer:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise JVMWorkerError("The JVM worker has timed out.")
+            (readable, writable, exceptional) = select.select([fd], [], [], remaining)
+            if len(readable):
+                data = os.read(fd, 65536)
+                if not data:
+                    raise JVMWorkerError("The JVM worker has exited with status %s." % (self.process.wait()))
+                self.buffer += data
+        (line, self.buffer) = self.buffer.split("\n", 1)
+        return line
+
+
+    def stop(self):
+        """stop the JVM worker"""
+        try:
+            self.process.stdin.close()
+        except IOError:
+            pass
+        if self.process.poll() is None:
+            try:
+                self.process.kill()
+            except OSError:
+                pass
+        self.process.wait()
+        self.devnull.close()
+
+
+class JVMWorkerPool(object):
+    """starts, reuses and restarts JVM workers"""
+
+
+    def __init__(self, timeout=300):
+        self.timeout   = timeout
+        self.lock      = threading.Lock()
+        self.idle      = []
+        self.class_dir = None
+        self.options   = None
+        self.started   = False
+        self.error     = None
+        self.pid       = os.getpid()
+
+
+    def run_batch(self, jobs):
+        """run a batch of (jar, args) jobs in a JVM worker, see JVMWorker"""
+        for attempt in range(2):
+            worker = self.__acquire()
+            try:
+                results = worker.run_batch(jobs)
+            except JVMWorkerError:
+                # Discard the crashed JVM worker, retry once with a new one.
+                worker.stop()
+                if attempt == 1:
+                    raise
+            else:
+                self.lock.acquire()
+                self.idle.append(worker)
+                self.lock.release()
+                return results
+
+
+    def __acquire(self):
+        self.lock.acquire()
+        try:
+            if len(self.idle):
+                return self.idle.pop()
+            # Don't try to set up or start JVM workers again if that has
+            # failed.
+            if self.error is not None:
+                raise JVMWorkerError(self.error)
+            if self.class_dir is None:
+                try:
+                    self.options = get_jvm_options(get_java_version())
+                    self.class_dir = compile_jar_worker()
+                except JVMWorkerError, e:
+                    self.error = str(e)
+                    raise
+        finally:
+            self.lock.release()
+
+        try:
+            worker = JVMWorker(self.class_dir, self.options, self.timeout)
+        except JVMWorkerError, e:
+            # If no JVM worker has ever started, none will.
+            self.lock.acquire()
+            if not self.started:
+                self.error = str(e)
+            self.lock.release()
+            raise
+        self.started = True
+        return worker
+
+
+    def stop(self):
+        """stop all idle JVM workers"""
+        self.lock.acquire()
+        for worker in self.idle:
+            worker.stop()
+        self.idle = []
+        self.lock.release()
+
+
+def get_java_version():
+    """get the major version of Java, e.g. 8 for Java 1.8"""
+    try:
+        p = subprocess.Popen(["java", "-version"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        (output, dummy) = p.communicate()
+    except OSError, e:
+        raise JVMWorkerError("Could not run java: %s" % (e))
+    # E.g. 'java version "1.8.0_292"' or 'openjdk version "21" 2023-09-19'.
+    match = re.search(r'version "(\d+)(?:\.(\d+))?', output)
+    if p.returncode != 0 or match is None:
+        raise JVMWorkerError("Could not determine the version of Java: %s" % (output.rstrip()))
+    version = int(match.group(1))
+    if version == 1 and match.group(2) is not None:
+        version = int(match.group(2))
+    return version
+
+
+def get_jvm_options(java_version):
+    """get the options for a JVM worker, which must be allowed to install a
+    security manager
+    """
+    if java_version >= 24:
+        raise JVMWorkerError("Java %d doesn't support security managers, which are required to trap System.exit()." % (java_version))
+    elif java_version >= 12:
+        return ["-Djava.security.manager=allow"]
+    else:
+        return []
+
+
+def compile_jar_worker():
+    """compile JarWorker.java (if it hasn't been compiled yet), returns the
+    directory that contains JarWorker.class
+    """
+    source = os.path.join(os.path.dirname(os.path.realpath(__file__)), "JarWorker.java")
+    class_dir = os.path.join(tempfile.gettempdir(), "fileconveyor-jarworker-%d-%d" % (os.getuid(), os.stat(source).st_mtime))
+    if os.path.exists(os.path.join(class_dir, "JarWorker.class")):
+        return class_dir
+
+    # Compile in a temporary directory first, so that other processes never
+    # see a partially compiled JarWorker.
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        p = subprocess.Popen(["javac", "-nowarn", "-d", tmp_dir, source], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        (stdout, stderr) = p.communicate()
+    except OSError, e:
+        shutil.rmtree(tmp_dir)
+        raise JVMWorkerError("Could not compile JarWorker.java: %s" % (e))
+    if p.returncode != 0:
+        shutil.rmtree(tmp_dir)
+        raise JVMWorkerError("Could not compile JarWorker.java: %s" % (stderr.rstrip()))
+    try:
+        os.rename(tmp_dir, class_dir)
+    except OSError:
+        # Another process has compiled it simultaneously.
+        shutil.rmtree(tmp_dir)
+    return class_dir
+
+
+# The JVM worker pool of this process.
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def run_jar(jar, args):
+    """run the main class of a jar file, returns (status, stdout, stderr)"""
+    return run_jar_batch([(jar, args)])[0]
+
+
+def run_jar_batch(jobs):
+    """run the main classes of a batch of (jar, args) jobs, returns (status,
+    stdout, stderr) for each of them
+    """
+    global _pool
+    _pool_lock.acquire()
+    # A forked process can't use the JVM workers of its parent.
+    if _pool is None or _pool.pid != os.getpid():
+        _pool = JVMWorkerPool()
+    pool = _pool
+    _pool_lock.release()
+    return pool.run_batch(jobs)
+
+
+def stop():
+    """stop the idle JVM workers of this process"""
+    _pool_lock.acquire()
+    if _pool is not None and _pool.pid == os.getpid():
+        _pool.stop()
+    _pool_lock.release()
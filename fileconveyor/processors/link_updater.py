@@ -14,9 +14,9 @@ from cssutils import replaceUrls
 
 import logging
 import sys
-import sqlite3
 from urlparse import urljoin
 from settings import SYNCED_FILES_DB
+import synced_files
 
 
 class CSSURLUpdater(Processor):
@@ -24,10 +24,14 @@ class CSSURLUpdater(Processor):
 
 
     different_per_server = True
+    cpu_bound = True
+    resource_class = RESOURCE_CLASS_CPU_HEAVY
+    cacheable = False # The output depends on the synced files DB.
+    accepts_buffer = True
     valid_extensions = (".css")
 
 
-    def run(self):
+    def process(self, data):
         # Step 0: ensure that the document_root and base_path variables are
         # set. If the file that's being processed was inside a source that has
         # either one or both not set, then this processor can't run.
@@ -37,7 +41,7 @@ class CSSURLUpdater(Processor):
         # We don't rename the file, so we can use the default output file.
 
         parser = CSSParser(log=None, loglevel=logging.CRITICAL)
-        sheet = parser.parseFile(self.input_file)
+        sheet = parser.parseString(data)
 
         # Step 1: ensure the file has URLs. If it doesn't, we can stop the
         # processing.
@@ -46,18 +50,15 @@ class CSSURLUpdater(Processor):
             url_count +=1
             break
         if url_count == 0:
-            return self.input_file
+            return None
 
         # Step 2: resolve the relative URLs to absolute paths.
         replaceUrls(sheet, self.resolveToAbsolutePath)
 
-        # Step 3: verify that each of these files has been synced.
-        synced_files_db = urljoin(sys.path[0] + os.sep, SYNCED_FILES_DB)
-        self.dbcon = sqlite3.connect(synced_files_db)
-        self.dbcon.text_factory = unicode # This is the default, but we set it explicitly, just to be sure.
-        self.dbcur = self.dbcon.cursor()
-        all_synced = True
-        for urlstring in getUrls(sheet):
+        # Step 3: verify that each of these files has been synced, by
+        # looking up all of their CDN URLs at once.
+        paths = []
+        for urlstring in set(getUrls(sheet)):
             # Skip absolute URLs.
             if urlstring.startswith("http://") or urlstring.startswith("https://"):
                 continue
@@ -67,24 +68,18 @@ class CSSURLUpdater(Processor):
             if not os.path.exists(urlstring):
                 continue
 
-            # Get the CDN URL for the given absolute path.
-            self.dbcur.execute("SELECT url FROM synced_files WHERE input_file=?", (urlstring, ))
-            result = self.dbcur.fetchone()
-
-            if result == None:
-                raise RequestToRequeueException("The file '%s' has not yet been synced to the server '%s'" % (urlstring, self.process_for_server))
-            else:
-                cdn_url = result[0]
+            paths.append(urlstring)
+        synced_files_db = urljoin(sys.path[0] + os.sep, SYNCED_FILES_DB)
+        self.cdn_urls = synced_files.get_lookup(synced_files_db).get_urls(paths, self.process_for_server)
+        unsynced_paths = [path for path in paths if path not in self.cdn_urls]
+        if len(unsynced_paths):
+            raise RequestToRequeueException("%d files have not yet been synced to the server '%s', e.g. '%s'" % (len(unsynced_paths), self.process_for_server, unsynced_paths[0]), unsynced_paths)
 
         # Step 4: resolve the absolute paths to CDN URLs.
         replaceUrls(sheet, self.resolveToCDNURL)
 
-        # Step 5: write the updated CSS to the output file.
-        f = open(self.output_file, 'w')
-        f.write(sheet.cssText)
-        f.close()
-
-        return self.output_file
+        # Step 5: return the updated CSS.
+        return sheet.cssText
 
 
     def resolveToAbsolutePath(self, urlstring):
@@ -123,12 +118,7 @@ class CSSURLUpdater(Processor):
 
     def resolveToCDNURL(self, urlstring):
         """rewrite absolute paths to CDN URLs"""
-        
-        # Skip broken references in the CSS file. This would otherwise
-        # prevent this CSS file from ever passing through this processor.
-        if not os.path.exists(urlstring):
-            return urlstring
 
-        # Get the CDN URL for the given absolute file path.
-        self.dbcur.execute("SELECT url FROM synced_files WHERE input_file=? AND server=?", (urlstring, self.process_for_server))
-        return self.dbcur.fetchone()[0]
+        # Absolute URLs and broken references in the CSS file (see step 3)
+        # are returned unchanged.
+        return self.cdn_urls.get(urlstring, urlstring)
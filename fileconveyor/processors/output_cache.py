@@ -0,0 +1,192 @@
+"""output_cache.py Content-addressed cache of processor chain output files
+
+A processor chain's output only depends on the input file's contents, its
+name, the processors (and their versions) and the server it's processed for.
+Hence when a file is touched, reverted or copied, its output can be retrieved
+from this cache instead of running the processor chain again.
+
+The cached output files are stored in a directory, an sqlite database in that
+directory keeps track of them. When the total size of the cached files exceeds
+the maximum size, the least recently used ones are evicted. Every operation
+uses its own database connection, so that a single cache can be used from
+multiple threads and processes simultaneously.
+"""
+
+
+__author__ = "Wim Leers (work@wimleers.com)"
+__version__ = "$Rev$"
+__date__ = "$Date$"
+__license__ = "GPL"
+
+
+import file_copy
+import hashing
+import hashlib
+import logging
+import os
+import os.path
+import sqlite3
+import time
+
+
+# Define exceptions.
+class OutputCacheError(Exception): pass
+
+
+class OutputCache(object):
+    """content-addressed, size-limited cache of processor chain output"""
+
+
+    def __init__(self, cache_dir, max_size, parent_logger):
+        self.cache_dir     = os.path.abspath(cache_dir)
+        self.dbfile        = os.path.join(self.cache_dir, "output_cache.db")
+        self.max_size      = max_size
+        self.parent_logger = parent_logger
+        self.logger        = logging.getLogger(".".join([parent_logger, "OutputCache"]))
+
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        dbcon = self.__connect()
+        dbcon.execute("CREATE TABLE IF NOT EXISTS output_cache(key text PRIMARY KEY, output_basename text, size integer, last_used real)")
+        dbcon.execute("CREATE INDEX IF NOT EXISTS output_cache_lru ON output_cache (last_used)")
+        dbcon.execute("CREATE TABLE IF NOT EXISTS output_cache_stats(name text PRIMARY KEY, value integer)")
+        for name in ("hits", "misses", "bytes_saved"):
+            dbcon.execute("INSERT OR IGNORE INTO output_cache_stats VALUES(?, 0)", (name, ))
+        dbcon.commit()
+        dbcon.close()
+
+
+    def __getstate__(self):
+        # Loggers can't be pickled, which is necessary to pass the cache to
+        # a worker process.
+        state = self.__dict__.copy()
+        del state["logger"]
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.logger = logging.getLogger(".".join([self.parent_logger, "OutputCache"]))
+
+
+    def __connect(self):
+        dbcon = sqlite3.connect(self.dbfile, timeout=30)
+        dbcon.text_factory = unicode # This is the default, but we set it explicitly, just to be sure.
+        return dbcon
+
+
+    def __path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+
+    def get_key(self, input_file, processor_classes, document_root, base_path, process_for_server):
+        """calculate the key of a processor chain's output for an input file"""
+        try:
+            content_hash = hashing.get_digest(input_file)
+        except (hashing.HashingError, OSError):
+            raise OutputCacheError("Unable to open the file in readmode: %s" % (input_file))
+
+        key = hashlib.sha1()
+        key.update(repr((hashing.default_algorithm, content_hash)))
+        key.update(repr(os.path.basename(input_file)))
+        for processor_class in processor_classes:
+            key.update(repr((processor_class.__module__, processor_class.__name__, getattr(processor_class, "version", 1))))
+        key.update(repr((document_root, base_path, process_for_server)))
+        return key.hexdigest()
+
+
+    def get(self, key, input_file, output_dir):
+        """get the cached output for a key
+
+        The cached output file is copied into output_dir. Returns the path to
+        the output file, which is input_file itself if the processor chain
+        did not change it, or None if it's not in the cache.
+        """
+        dbcon = self.__connect()
+        row = dbcon.execute("SELECT output_basename FROM output_cache WHERE key=?", (key, )).fetchone()
+        output_file = None
+        if row is not None:
+            output_basename = row[0]
+            if output_basename is None:
+                output_file = input_file
+            else:
+                output_file = os.path.join(output_dir, output_basename)
+                if not os.path.exists(output_dir):
+                    os.makedirs(output_dir)
+                try:
+                    file_copy.copy_file(self.__path(key), output_file)
+                except (IOError, OSError):
+                    # The cached file has disappeared.
+                    dbcon.execute("DELETE FROM output_cache WHERE key=?", (key, ))
+                    output_file = None
+
+        if output_file is None:
+            dbcon.execute("UPDATE output_cache_stats SET value=value+1 WHERE name='misses'")
+        else:
+            dbcon.execute("UPDATE output_cache SET last_used=? WHERE key=?", (time.time(), key))
+            dbcon.execute("UPDATE output_cache_stats SET value=value+1 WHERE name='hits'")
+            # The input bytes that did not have to be processed.
+            dbcon.execute("UPDATE output_cache_stats SET value=value+? WHERE name='bytes_saved'", (os.stat(input_file).st_size, ))
+        dbcon.commit()
+        dbcon.close()
+        return output_file
+
+
+    def put(self, key, input_file, output_file):
+        """store the output of a processor chain"""
+        if output_file == input_file:
+            # The processor chain did not change the file: there's no need to
+            # store a copy.
+            (output_basename, size) = (None, 0)
+        else:
+            output_basename = os.path.basename(output_file)
+            size = os.stat(output_file).st_size
+            if size > self.max_size:
+                return
+            # Copy to a temporary file first, so other threads and processes
+            # never see a partially written file.
+            path = self.__path(key)
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            tmp_path = "%s.%d.tmp" % (path, os.getpid())
+            file_copy.copy_file(output_file, tmp_path)
+            os.rename(tmp_path, path)
+
+        dbcon = self.__connect()
+        dbcon.execute("INSERT OR REPLACE INTO output_cache VALUES(?, ?, ?, ?)", (key, output_basename, size, time.time()))
+        dbcon.commit()
+        self.__evict(dbcon)
+        dbcon.close()
+
+
+    def __evict(self, dbcon):
+        """evict the least recently used output files until the cache fits"""
+        total_size = dbcon.execute("SELECT SUM(size) FROM output_cache").fetchone()[0] or 0
+        if total_size <= self.max_size:
+            return
+        evicted = []
+        for (key, size) in dbcon.execute("SELECT key, size FROM output_cache ORDER BY last_used ASC").fetchall():
+            if total_size <= self.max_size:
+                break
+            evicted.append((key, ))
+            total_size -= size
+        dbcon.executemany("DELETE FROM output_cache WHERE key=?", evicted)
+        dbcon.commit()
+        for (key, ) in evicted:
+            if os.path.exists(self.__path(key)):
+                os.remove(self.__path(key))
+        self.logger.debug("Evicted %d output files from the cache." % (len(evicted)))
+
+
+    def get_stats(self):
+        """get the number of hits and misses and the input bytes saved"""
+        dbcon = self.__connect()
+        stats = dict(dbcon.execute("SELECT name, value FROM output_cache_stats").fetchall())
+        (stats["files"], stats["size"]) = dbcon.execute("SELECT COUNT(*), SUM(size) FROM output_cache").fetchone()
+        dbcon.close()
+        stats["size"] = stats["size"] or 0
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = 0.0
+        if lookups > 0:
+            stats["hit_rate"] = 100.0 * stats["hits"] / lookups
+        return stats
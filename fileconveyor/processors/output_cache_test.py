@@ -0,0 +1,99 @@
+"""Unit test for output_cache.py"""
+
+
+__author__ = "Wim Leers (work@wimleers.com)"
+__version__ = "$Rev$"
+__date__ = "$Date$"
+__license__ = "GPL"
+
+
+from output_cache import *
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+
+class FakeProcessor(object): pass
+
+
+class TestConditions(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.path, "cache")
+        self.output_dir = os.path.join(self.path, "output")
+        self.cache = OutputCache(self.cache_dir, 100, "test")
+
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+
+    def write(self, filename, data):
+        filename = os.path.join(self.path, filename)
+        f = open(filename, "wb")
+        f.write(data)
+        f.close()
+        return filename
+
+
+    def key(self, filename, processor_classes=[FakeProcessor], server=None):
+        return self.cache.get_key(filename, processor_classes, None, None, server)
+
+
+    def testKey(self):
+        input_file = self.write("a.css", "body {}")
+        key = self.key(input_file)
+        # The same contents and name, elsewhere.
+        os.mkdir(os.path.join(self.path, "copy"))
+        self.assertEqual(key, self.key(self.write("copy/a.css", "body {}")))
+        # Different contents, name, processors or server.
+        self.assertNotEqual(key, self.key(self.write("b.css", "body {}")))
+        self.assertNotEqual(key, self.key(self.write("a.css", "p {}")))
+        self.assertNotEqual(key, self.key(input_file, []))
+        self.assertNotEqual(key, self.key(input_file, server="cdn"))
+        FakeProcessor.version = 2
+        self.assertNotEqual(key, self.key(input_file))
+        del FakeProcessor.version
+
+
+    def testGetAndPut(self):
+        input_file = self.write("a.css", "body {}")
+        key = self.key(input_file)
+        self.assertEqual(None, self.cache.get(key, input_file, self.output_dir))
+
+        output_file = self.write("a_1234.css", "body{}")
+        self.cache.put(key, input_file, output_file)
+        cached_output_file = self.cache.get(key, input_file, self.output_dir)
+        self.assertEqual(os.path.join(self.output_dir, "a_1234.css"), cached_output_file)
+        self.assertEqual("body{}", open(cached_output_file).read())
+
+        # Unchanged output is not copied.
+        unchanged_file = self.write("b.css", "p {}")
+        self.cache.put(self.key(unchanged_file), unchanged_file, unchanged_file)
+        self.assertEqual(unchanged_file, self.cache.get(self.key(unchanged_file), unchanged_file, self.output_dir))
+
+        stats = self.cache.get_stats()
+        self.assertEqual((2, 1, 11), (stats["hits"], stats["misses"], stats["bytes_saved"]))
+
+
+    def testEviction(self):
+        keys = []
+        for i in range(4):
+            input_file = self.write("%d.txt" % (i), str(i))
+            keys.append(self.key(input_file))
+            self.cache.put(keys[i], input_file, self.write("%d.out" % (i), str(i) * 40))
+            if i == 1:
+                # Use the first file, so the second one is least recently used.
+                self.cache.get(keys[0], input_file, self.output_dir)
+
+        # At most 100 bytes: only 2 of the 40 byte output files fit.
+        stats = self.cache.get_stats()
+        self.assertEqual((2, 80), (stats["files"], stats["size"]))
+        self.assertEqual(None, self.cache.get(keys[1], input_file, self.output_dir))
+        self.assertNotEqual(None, self.cache.get(keys[3], input_file, self.output_dir))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -8,7 +8,11 @@ __license__ = "GPL"
 class ProcessorError(Exception): pass
 class InvalidCallbackError(ProcessorError): pass
 class FileIOError(ProcessorError): pass
-class RequestToRequeueException(ProcessorError): pass
+class RequestToRequeueException(ProcessorError):
+    def __init__(self, message="", dependencies=[]):
+        ProcessorError.__init__(self, message)
+        # The files that must be synced before the file can be processed.
+        self.dependencies = dependencies
 class DocumentRootAndBasePathRequiredException(ProcessorError): pass
 
 
@@ -18,12 +22,59 @@ import os.path
 import logging
 import copy
 import subprocess
+import multiprocessing
+import signal
+import Queue
+import collections
+import errno
+import select
+import jvm_worker
+import file_copy
+
+
+# Resource classes of processors, from the lightest to the heaviest.
+RESOURCE_CLASS_IO_LIGHT  = "io-light"
+RESOURCE_CLASS_CPU_HEAVY = "cpu-heavy"
+RESOURCE_CLASS_JVM       = "jvm"
+RESOURCE_CLASSES = (RESOURCE_CLASS_IO_LIGHT, RESOURCE_CLASS_CPU_HEAVY, RESOURCE_CLASS_JVM)
 
 
 class Processor(object):
     """base class for file processors"""
 
 
+    # Processors that keep the CPU busy themselves (as opposed to waiting for
+    # the commands they run) should set this to True, so that the chains
+    # they're in are run in a worker process. See ProcessorChainPool.
+    cpu_bound = False
+
+    # The resource that this processor mostly uses (one of RESOURCE_CLASSES)
+    # and how expensive it is relative to other processors of that resource
+    # class. See ProcessorChainPool.
+    resource_class = RESOURCE_CLASS_IO_LIGHT
+    cost           = 1
+
+    # Whether the output only depends on the input file's contents and name,
+    # which allows it to be cached (see OutputCache). Increase the version
+    # whenever a change to a processor changes its output.
+    cacheable = True
+    version   = 1
+
+    # Processors that only change the file's base name, not its contents,
+    # should set this to True and call copy_input_to_output(). When all
+    # processors in a chain only rename, the output file is not created at
+    # all: the input file is transported under the output file's name. See
+    # ProcessorChain.
+    rename_only = False
+
+    # Processors that transform the file's contents in memory should set this
+    # to True and implement process() instead of run(). A chain passes the
+    # contents from one such processor to the next in memory and only writes
+    # them to a file at the end or when the next processor needs a file. See
+    # ProcessorChain.
+    accepts_buffer = False
+
+
     def __init__(self, input_file, original_file, document_root, base_path, process_for_server, parent_logger, working_dir="/tmp"):
         self.input_file         = input_file
         self.original_file      = original_file
@@ -32,6 +83,8 @@ class Processor(object):
         self.process_for_server = process_for_server
         self.working_dir        = working_dir
         self.parent_logger      = parent_logger
+        self.virtual_output     = False
+        self.input_data         = None
 
         # Get the parts of the input file.
         (path, basename, name, extension) = self.get_path_parts(self.original_file)
@@ -52,9 +105,34 @@ class Processor(object):
 
 
     def run(self):
+        # Processors that accept buffers can process files as well.
+        data = self.process(self.read_input_file())
+        if data is None:
+            return self.input_file
+        f = open(self.output_file, "wb")
+        f.write(data)
+        f.close()
+        return self.output_file
+
+
+    def process(self, data):
+        """process the contents of the input file in memory, returns the new
+        contents (and may set the output file's base name), or None if the
+        contents are unchanged
+        """
         raise NotImplemented
 
 
+    def read_input_file(self):
+        """get the contents of the input file, which may only be in memory"""
+        if self.input_data is not None:
+            return self.input_data
+        f = open(self.input_file, "rb")
+        data = f.read()
+        f.close()
+        return data
+
+
     def get_path_parts(self, path):
         """get the different parts of the file's path"""
 
@@ -94,7 +172,7 @@ class Processor(object):
     def validate_settings(self):
         """validate the input file and its extensions"""
 
-        if not os.path.exists(self.input_file):
+        if self.input_data is None and not os.path.exists(self.input_file):
             return False
         if not self.__class__.would_process_input_file(self.input_file):
             return False
@@ -102,14 +180,49 @@ class Processor(object):
 
 
     def run_command(self, command):
-        """run a command and get (stdout, stderr) back"""
+        """run a command and get (stdout, stderr) back
 
-        p = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        The command is either a string, which is run by the shell, or a list
+        of arguments, which is run directly.
+        """
+
+        try:
+            p = subprocess.Popen(command, shell=isinstance(command, basestring), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except OSError, e:
+            # Like the shell does, report that the command couldn't be run.
+            return ("", "%s: %s" % (command[0], e.strerror))
         (stdout, stderr) = p.communicate()
         (stdout, stderr) = (stdout.rstrip(), stderr.rstrip())
         return (stdout, stderr)
 
 
+    def run_jar(self, jar, args):
+        """run a jar file and get (stdout, stderr) back
+
+        The jar file is run in a long-lived JVM (see jvm_worker.py), which
+        avoids the JVM's startup time. If that's not possible, a new JVM is
+        started instead.
+        """
+
+        try:
+            (status, stdout, stderr) = jvm_worker.run_jar(jar, args)
+        except jvm_worker.JVMWorkerError, e:
+            logging.getLogger(".".join([self.parent_logger, "Processor"])).debug("Could not use a JVM worker to run '%s', starting a new JVM instead. Reason: %s." % (jar, e))
+            return self.run_command(["java", "-jar", jar] + list(args))
+        return (stdout, stderr)
+
+
+    def copy_input_to_output(self):
+        """copy the input file to the output file, without copying the data
+        if possible (see file_copy.py), or not at all if the output file is
+        virtual (see ProcessorChain)
+        """
+
+        if self.virtual_output:
+            return
+        file_copy.copy_file(self.input_file, self.output_file)
+
+
     def set_output_file_basename(self, output_file_basename):
         """set the output file's basename (changing the path is not allowed)"""
 
@@ -123,7 +236,7 @@ class ProcessorChain(threading.Thread):
     """chains the given file processors (runs them in sequence)"""
 
 
-    def __init__(self, processors, input_file, document_root, base_path, process_for_server, callback, error_callback, parent_logger, working_dir="/tmp"):
+    def __init__(self, processors, input_file, document_root, base_path, process_for_server, callback, error_callback, parent_logger, working_dir="/tmp", cache=None):
         if not callable(callback):
             raise InvalidCallbackError("callback function is not callable")
         if not callable(error_callback):
@@ -138,6 +251,8 @@ class ProcessorChain(threading.Thread):
         self.callback           = callback
         self.error_callback     = error_callback
         self.working_dir        = working_dir
+        self.parent_logger      = parent_logger
+        self.cache              = cache
         self.logger             = logging.getLogger(".".join([parent_logger, "ProcessorChain"]))
 
         self.parent_logger_for_processor = ".".join([parent_logger, "ProcessorChain"]);
@@ -148,20 +263,55 @@ class ProcessorChain(threading.Thread):
     def run(self):
         self.output_file = self.input_file
 
+        # When all processors in this chain only rename the file, the output
+        # file is virtual: it's never created, the input file is transported
+        # under its name instead. Hence there's nothing to cache either.
+        virtual_output = ProcessorChain.has_virtual_output(self.processors)
+
+        # Retrieve the output from the cache if this processor chain has
+        # processed a file with the same name and contents before.
+        cache_key = None
+        if not virtual_output:
+            cache_key = self.__get_cache_key()
+        if cache_key is not None:
+            try:
+                output_file = self.cache.get(cache_key, self.input_file, self.__get_output_dir())
+            except Exception, e:
+                self.logger.warning("Could not retrieve the output for the file '%s' from the cache. Exception class: %s. Message: %s." % (self.input_file, e.__class__, e))
+                output_file = None
+            if output_file is not None:
+                self.logger.debug("Retrieved the output file '%s' for the file '%s' from the cache." % (output_file, self.input_file))
+                self.output_file = output_file
+                self.callback(self.input_file, self.output_file)
+                return
+
+        # The contents of the output file, while they're only in memory (see
+        # Processor.accepts_buffer).
+        data = None
+
         # Run all processors in the chain.
         while len(self.processors):
             # Get next processor.
             processor_classname = self.processors.pop(0)
 
             # Get a reference to that class.
-            (modulename, classname) = processor_classname.rsplit(".", 1)
-            module = __import__(modulename, globals(), locals(), [classname])
-            processor_class = getattr(module, classname)
+            processor_class = ProcessorChain.import_processor(processor_classname)
+
+            # Write the contents to the output file if this processor needs
+            # a file, i.e. if it doesn't accept a buffer and doesn't merely
+            # rename the file.
+            if data is not None and not getattr(processor_class, "accepts_buffer", False) and not getattr(processor_class, "rename_only", False):
+                self.__write_output_file(data)
+                data = None
 
             # Run the processor.
             old_output_file = self.output_file
+            old_output_file_exists = data is None
+            processor_input_file = self.output_file
+            if virtual_output:
+                processor_input_file = self.input_file
             processor = processor_class(            
-                input_file         = self.output_file,
+                input_file         = processor_input_file,
                 original_file      = self.input_file,
                 document_root      = self.document_root,
                 base_path          = self.base_path,
@@ -169,13 +319,23 @@ class ProcessorChain(threading.Thread):
                 parent_logger      = self.parent_logger_for_processor,
                 working_dir        = self.working_dir,
             )
+            processor.virtual_output = virtual_output or data is not None
+            processor.input_data = data
             if processor.validate_settings():
                 self.logger.debug("Running the processor '%s' on the file '%s'." % (processor_classname, self.output_file))
                 try:
-                    self.output_file = processor.run()
+                    if getattr(processor_class, "accepts_buffer", False):
+                        processed_data = processor.process(processor.read_input_file())
+                        if processed_data is not None:
+                            (data, self.output_file) = (processed_data, processor.output_file)
+                    else:
+                        self.output_file = processor.run()
                 except RequestToRequeueException, e:
                     self.logger.warning("The processor '%s' has requested to requeue the file '%s'. Message: %s." % (processor_classname, self.input_file, e))
-                    self.error_callback(self.input_file)
+                    if len(e.dependencies):
+                        self.error_callback(self.input_file, dependencies=e.dependencies)
+                    else:
+                        self.error_callback(self.input_file)
                     return
                 except DocumentRootAndBasePathRequiredException, e:
                     self.logger.warning("The processor '%s' has skipped processing the file '%s' because the document root and/or base path are not set for the source associated with the file." % (processor_classname, self.input_file))
@@ -188,21 +348,424 @@ class ProcessorChain(threading.Thread):
 
             # Delete the old output file if applicable. But never ever remove
             # the input file!
-            if old_output_file != self.output_file and old_output_file != self.input_file:
+            if old_output_file_exists and not virtual_output and old_output_file != self.output_file and old_output_file != self.input_file:
                 os.remove(old_output_file)
 
+        # Write the contents to the output file if they're only in memory.
+        if data is not None:
+            self.__write_output_file(data)
+
+        # Store the output in the cache.
+        if cache_key is not None:
+            try:
+                self.cache.put(cache_key, self.input_file, self.output_file)
+            except Exception, e:
+                self.logger.warning("Could not store the output file '%s' for the file '%s' in the cache. Exception class: %s. Message: %s." % (self.output_file, self.input_file, e.__class__, e))
+
         # All done, call the callback!
         self.callback(self.input_file, self.output_file)
 
 
+    def __write_output_file(self, data):
+        f = open(self.output_file, "wb")
+        f.write(data)
+        f.close()
+
+
+    def __get_cache_key(self):
+        """get the cache key for this chain's output, if it can be cached"""
+        if self.cache is None:
+            return None
+        processor_classes = [ProcessorChain.import_processor(processor_classname) for processor_classname in self.processors]
+        for processor_class in processor_classes:
+            if not getattr(processor_class, "cacheable", True):
+                return None
+        try:
+            return self.cache.get_key(self.input_file, processor_classes, self.document_root, self.base_path, self.process_for_server)
+        except Exception, e:
+            self.logger.warning("Could not calculate the cache key for the file '%s'. Exception class: %s. Message: %s." % (self.input_file, e.__class__, e))
+            return None
+
+
+    def __get_output_dir(self):
+        """get the directory in the working directory for the output file"""
+        path = os.path.dirname(self.input_file)
+        if path.startswith(self.working_dir):
+            path = path[len(self.working_dir):]
+        return os.path.join(self.working_dir, path.lstrip(os.sep))
+
+
+    @staticmethod
+    def import_processor(processor_classname):
+        """get a reference to a processor class"""
+        (modulename, classname) = processor_classname.rsplit(".", 1)
+        module = __import__(modulename, globals(), locals(), [classname])
+        return getattr(module, classname)
+
+
+    @staticmethod
+    def has_virtual_output(processors):
+        """check if a chain of processors only renames the file, in which
+        case its output file is virtual (see run())
+        """
+        if not len(processors):
+            return False
+        for processor_classname in processors:
+            if not getattr(ProcessorChain.import_processor(processor_classname), "rename_only", False):
+                return False
+        return True
+
+
+    def get_resource_usage(self):
+        """get the resource class and cost of this chain
+
+        A chain belongs to the heaviest resource class of its processors and
+        costs as much as its processors of that resource class combined.
+        """
+        resource_class = RESOURCE_CLASS_IO_LIGHT
+        cost = 0
+        for processor_classname in self.processors:
+            processor_class = ProcessorChain.import_processor(processor_classname)
+            processor_resource_class = getattr(processor_class, "resource_class", RESOURCE_CLASS_IO_LIGHT)
+            processor_cost = getattr(processor_class, "cost", 1)
+            if RESOURCE_CLASSES.index(processor_resource_class) > RESOURCE_CLASSES.index(resource_class):
+                (resource_class, cost) = (processor_resource_class, processor_cost)
+            elif processor_resource_class == resource_class:
+                cost += processor_cost
+        return (resource_class, max(cost, 1))
+
+
+    def is_cpu_bound(self):
+        """check if any of the processors in this chain is CPU-bound"""
+        for processor_classname in self.processors:
+            if getattr(ProcessorChain.import_processor(processor_classname), "cpu_bound", False):
+                return True
+        return False
+
+
+def _worker_process_main(connection):
+    """run the processor chains that the parent process sends over the
+    connection, until it sends None
+    """
+    # Signals are handled by the parent process, which stops the pool.
+    signal.signal(signal.SIGINT,  signal.SIG_IGN)
+    signal.signal(signal.SIGTSTP, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    while True:
+        try:
+            task = connection.recv()
+        except (EOFError, IOError):
+            break
+        if task is None:
+            break
+        (task_id, args) = task
+        connection.send((task_id, _run_chain_in_worker_process(*args)))
+
+
+def _run_chain_in_worker_process(processors, input_file, document_root, base_path, process_for_server, parent_logger, working_dir, cache):
+    """run a processor chain, returns the output file (None on failure) and
+    the files it depends on if it has requested to be requeued
+    """
+    result = {"output_file" : None, "dependencies" : []}
+    def callback(input_file, output_file):
+        result["output_file"] = output_file
+    def error_callback(input_file, dependencies=[]):
+        result["dependencies"] = dependencies
+    try:
+        chain = ProcessorChain(processors, input_file, document_root, base_path, process_for_server, callback, error_callback, parent_logger, working_dir, cache)
+        chain.run()
+    except Exception, e:
+        logging.getLogger(".".join([parent_logger, "ProcessorChainPool"])).error("The processor chain for the file '%s' has failed in a worker process. Exception class: %s. Message: %s." % (input_file, e.__class__, e))
+    return (result["output_file"], result["dependencies"])
+
+
+class ProcessorChainWorkerProcess(object):
+    """a worker process of a ProcessorChainPool, which runs one processor
+    chain at a time
+    """
+
+
+    def __init__(self):
+        (self.connection, child_connection) = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_worker_process_main, args=(child_connection, ), name="ProcessorChainWorkerProcess")
+        self.process.daemon = True
+        self.process.start()
+        child_connection.close()
+        # The chain that has been sent to this worker process, if any.
+        self.task_id = None
+
+
+    def send(self, task):
+        """send a task (or None, to stop), returns whether it was sent"""
+        try:
+            self.connection.send(task)
+            return True
+        except (IOError, OSError):
+            # The worker process has died.
+            return False
+
+
+class ProcessorChainWorker(threading.Thread):
+    """runs the processor chains in a ProcessorChainPool's queue, and calls
+    the callbacks of those that have run in a worker process
+    """
+
+
+    def __init__(self, queue, finished_callback, logger, name):
+        self.queue             = queue
+        self.finished_callback = finished_callback
+        self.logger            = logger
+        threading.Thread.__init__(self, name=name)
+
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            (chain, resource_class, cost, result) = item
+            try:
+                if result is None:
+                    chain.run()
+                else:
+                    (output_file, dependencies) = result
+                    if output_file is None and len(dependencies):
+                        chain.error_callback(chain.input_file, dependencies=dependencies)
+                    elif output_file is None:
+                        chain.error_callback(chain.input_file)
+                    else:
+                        chain.callback(chain.input_file, output_file)
+            except Exception, e:
+                self.logger.error("The processor chain for the file '%s' has failed. Exception class: %s. Message: %s." % (chain.input_file, e.__class__, e))
+                chain.error_callback(chain.input_file)
+            self.finished_callback(resource_class, cost)
+
+
+class ProcessorChainPool(object):
+    """runs ProcessorChain objects on a fixed set of workers
+
+    Each resource class has its own concurrency limit: the total cost of the
+    chains of a resource class that are running simultaneously may not exceed
+    it (but a single chain is always allowed to run). Chains wait for a free
+    slot in their own resource class only, so cheap chains are never blocked
+    by expensive ones.
+
+    Chains with a CPU-bound processor run in worker processes, so they can
+    use all cores. All other chains mostly wait for the commands they run, so
+    they run in worker threads. All workers are created once and live as long
+    as the ProcessorChainPool does. The chain's callbacks are always called
+    in the parent process, in a worker thread.
+
+    The worker processes are forked when the pool is created, which should
+    happen before any other threads are started and before any connections
+    are opened. A chain is assigned to a worker process when it's sent to it.
+    When a worker process dies (e.g. it's killed because it runs out of
+    memory), it's replaced, and the error callback of its chain (if any) is
+    called, so its file is retried.
+    """
+
+
+    def __init__(self, limits, parent_logger, processes=True):
+        # A single limit applies to every resource class.
+        if not isinstance(limits, dict):
+            limits = dict([(resource_class, limits) for resource_class in RESOURCE_CLASSES])
+        self.limits = {}
+        for resource_class in RESOURCE_CLASSES:
+            limit = limits.get(resource_class, 0)
+            if limit <= 0:
+                limit = multiprocessing.cpu_count()
+            self.limits[resource_class] = limit
+        self.logger = logging.getLogger(".".join([parent_logger, "ProcessorChainPool"]))
+
+        # Fork the worker processes before this pool starts any threads.
+        self.processes = []
+        if processes:
+            for i in range(max(self.limits.values())):
+                self.processes.append(ProcessorChainWorkerProcess())
+
+        self.lock         = threading.Lock()
+        self.pending      = {}
+        self.running_cost = {}
+        self.queues       = {}
+        self.threads      = []
+        for resource_class in RESOURCE_CLASSES:
+            self.pending[resource_class]      = collections.deque()
+            self.running_cost[resource_class] = 0
+            self.queues[resource_class]       = Queue.Queue()
+            # Since every chain costs at least 1, there can't be more running
+            # chains than the limit.
+            for i in range(self.limits[resource_class]):
+                name = "ProcessorChainWorkerThread-%s-%d" % (resource_class, i)
+                worker = ProcessorChainWorker(self.queues[resource_class], self.__finished, self.logger, name)
+                worker.setDaemon(True)
+                worker.start()
+                self.threads.append(worker)
+
+        # The chains that run in worker processes, by task id, and those that
+        # wait for a free worker process.
+        self.tasks         = {}
+        self.waiting_tasks = collections.deque()
+        self.tasks_done    = threading.Condition(self.lock)
+        self.next_task_id  = 0
+        self.stopping      = False
+        if self.processes:
+            self.collector = threading.Thread(target=self.__collect, name="ProcessorChainCollectorThread")
+            self.collector.setDaemon(True)
+            self.collector.start()
+
+
+    def submit(self, chain):
+        """run a ProcessorChain as soon as its resource class has a free slot"""
+        (resource_class, cost) = chain.get_resource_usage()
+        self.lock.acquire()
+        self.pending[resource_class].append((chain, cost))
+        self.__dispatch(resource_class)
+        self.lock.release()
+
+
+    def __dispatch(self, resource_class):
+        """start pending chains while the resource class' limit allows it
+
+        Must be called with self.lock acquired.
+        """
+        pending = self.pending[resource_class]
+        while len(pending) > 0:
+            (chain, cost) = pending[0]
+            running_cost = self.running_cost[resource_class]
+            if running_cost > 0 and running_cost + cost > self.limits[resource_class]:
+                break
+            pending.popleft()
+            self.running_cost[resource_class] += cost
+
+            if self.processes and chain.is_cpu_bound():
+                task_id = self.next_task_id
+                self.next_task_id += 1
+                self.tasks[task_id] = (chain, resource_class, cost)
+                self.waiting_tasks.append(task_id)
+                self.__assign_tasks()
+            else:
+                self.queues[resource_class].put((chain, resource_class, cost, None))
+
+
+    def __assign_tasks(self):
+        """send waiting chains to idle worker processes
+
+        Must be called with self.lock acquired.
+        """
+        for worker in self.processes:
+            if len(self.waiting_tasks) == 0:
+                break
+            if worker.task_id is not None:
+                continue
+            task_id = self.waiting_tasks.popleft()
+            (chain, resource_class, cost) = self.tasks[task_id]
+            args = (chain.processors, chain.input_file, chain.document_root, chain.base_path, chain.process_for_server, chain.parent_logger, chain.working_dir, chain.cache)
+            # If the worker process has died, the chain fails along with it.
+            worker.task_id = task_id
+            worker.send((task_id, args))
+
+
+    def __finished(self, resource_class, cost):
+        """free the slots of a finished chain"""
+        self.lock.acquire()
+        self.running_cost[resource_class] -= cost
+        self.__dispatch(resource_class)
+        self.lock.release()
+
+
+    def __collect(self):
+        """collect the results of the chains that run in worker processes,
+        replace the worker processes that have died; the callbacks are called
+        in the worker threads, so a slow callback never holds up the results
+        of other chains
+        """
+        while True:
+            connections = [worker.connection for worker in self.processes]
+            try:
+                (readable, writable, exceptional) = select.select(connections, [], [], 1)
+            except select.error, e:
+                if e[0] != errno.EINTR:
+                    raise
+                readable = []
+
+            results = []
+            for connection in readable:
+                try:
+                    results.append(connection.recv())
+                except (EOFError, IOError):
+                    # The worker process has died, see below.
+                    pass
+
+            finished = []
+            self.lock.acquire()
+            for (task_id, result) in results:
+                for worker in self.processes:
+                    if worker.task_id == task_id:
+                        worker.task_id = None
+                task = self.tasks.pop(task_id, None)
+                if task is not None:
+                    finished.append(task + (result, ))
+            for (i, worker) in enumerate(self.processes):
+                if worker.process.is_alive():
+                    continue
+                worker.process.join()
+                worker.connection.close()
+                task = self.tasks.pop(worker.task_id, None)
+                if task is not None:
+                    self.logger.error("The worker process running the processor chain for the file '%s' has died." % (task[0].input_file))
+                    finished.append(task + ((None, []), ))
+                if not self.stopping:
+                    self.processes[i] = ProcessorChainWorkerProcess()
+            if not self.stopping:
+                self.__assign_tasks()
+            if len(self.tasks) == 0:
+                self.tasks_done.notifyAll()
+            done = self.stopping and len(self.tasks) == 0
+            self.lock.release()
+
+            for (chain, resource_class, cost, result) in finished:
+                self.queues[resource_class].put((chain, resource_class, cost, result))
+            if done:
+                break
+
+
+    def stop(self):
+        """stop all workers, after they've finished the chains they're running
+
+        Chains that are still waiting for a free slot are not run.
+        """
+        self.lock.acquire()
+        for resource_class in RESOURCE_CLASSES:
+            self.pending[resource_class].clear()
+        self.lock.release()
+        if self.processes:
+            # Wait for the chains in the worker processes (their callbacks are
+            # queued for the worker threads), then stop the worker processes.
+            self.lock.acquire()
+            while len(self.tasks) > 0:
+                self.tasks_done.wait(1)
+            self.stopping = True
+            for worker in self.processes:
+                worker.send(None)
+            self.lock.release()
+            self.collector.join()
+            for worker in self.processes:
+                worker.process.join()
+        for worker in self.threads:
+            worker.queue.put(None)
+        for worker in self.threads:
+            worker.join()
+
+
 class ProcessorChainFactory(object):
     """produces ProcessorChain objects whenever requested"""
 
 
-    def __init__(self, parent_logger, working_dir="/tmp"):
+    def __init__(self, parent_logger, working_dir="/tmp", cache=None):
         self.parent_logger = parent_logger
         self.working_dir   = working_dir
+        self.cache         = cache
 
 
     def make_chain_for(self, input_file, processors, document_root, base_path, process_for_server, callback, error_callback):
-        return ProcessorChain(copy.copy(processors), input_file, document_root, base_path, process_for_server, callback, error_callback, self.parent_logger, self.working_dir)
+        return ProcessorChain(copy.copy(processors), input_file, document_root, base_path, process_for_server, callback, error_callback, self.parent_logger, self.working_dir, self.cache)
@@ -0,0 +1,132 @@
+"""processor_benchmark.py Throughput benchmark for ProcessorChainPool
+
+Generates a corpus of PNG images and runs a processor chain on each of them:
+once the way File Conveyor used to (a new thread per file, at most one at a
+time) and once through a ProcessorChainPool.
+
+Usage: python processor_benchmark.py [--files=10000] [--workers=0]
+           [--chain=image_optimizer.Max] [--legacy-concurrency=1]
+"""
+
+
+__author__ = "Wim Leers (work@wimleers.com)"
+__version__ = "$Rev$"
+__date__ = "$Date$"
+__license__ = "GPL"
+
+
+from processor import *
+import optparse
+import shutil
+import struct
+import tempfile
+import time
+import zlib
+
+
+class ChainTracker(object):
+    """keeps track of the number of finished processor chains"""
+
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.finished  = 0
+        self.failed    = 0
+
+
+    def callback(self, input_file, output_file):
+        self.condition.acquire()
+        self.finished += 1
+        self.condition.notify()
+        self.condition.release()
+
+
+    def error_callback(self, input_file):
+        self.condition.acquire()
+        self.finished += 1
+        self.failed += 1
+        self.condition.notify()
+        self.condition.release()
+
+
+    def wait_until_finished(self, num_chains):
+        self.condition.acquire()
+        while self.finished < num_chains:
+            self.condition.wait(1)
+        self.condition.release()
+
+
+def write_png(filename, width, height, seed):
+    """write an RGB PNG image with a pattern that depends on seed"""
+    def chunk(chunk_type, data):
+        return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data) & 0xffffffff)
+
+    rows = []
+    for y in range(height):
+        rows.append("\x00" + "".join([chr((x * seed + y * 7) % 256) * 3 for x in range(width)]))
+    f = open(filename, "wb")
+    f.write("\x89PNG\r\n\x1a\n")
+    f.write(chunk("IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+    f.write(chunk("IDAT", zlib.compress("".join(rows), 1)))
+    f.write(chunk("IEND", ""))
+    f.close()
+
+
+def make_chain(processors, input_file, tracker, working_dir):
+    return ProcessorChain(copy.copy(processors), input_file, None, None, None, tracker.callback, tracker.error_callback, "ProcessorBenchmark", working_dir)
+
+
+def benchmark_thread_per_file(processors, files, working_dir, concurrency):
+    """start a new ProcessorChain thread per file"""
+    tracker = ChainTracker()
+    start = time.time()
+    for i in range(len(files)):
+        tracker.wait_until_finished(i - concurrency + 1)
+        make_chain(processors, files[i], tracker, working_dir).start()
+    tracker.wait_until_finished(len(files))
+    return (time.time() - start, tracker.failed)
+
+
+def benchmark_pool(processors, files, working_dir, workers):
+    """submit a ProcessorChain per file to a ProcessorChainPool"""
+    tracker = ChainTracker()
+    processes = make_chain(processors, files[0], tracker, working_dir).is_cpu_bound()
+    pool = ProcessorChainPool(workers, "ProcessorBenchmark", processes)
+    start = time.time()
+    for i in range(len(files)):
+        pool.submit(make_chain(processors, files[i], tracker, working_dir))
+    tracker.wait_until_finished(len(files))
+    duration = time.time() - start
+    pool.stop()
+    return (duration, tracker.failed)
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option("--files", type="int", default=10000, help="number of images in the corpus")
+    parser.add_option("--workers", type="int", default=0, help="simultaneous chains per resource class (0: number of cores)")
+    parser.add_option("--chain", default="image_optimizer.Max", help="processors, separated by commas")
+    parser.add_option("--legacy-concurrency", type="int", default=1, help="simultaneous threads in thread-per-file mode")
+    (options, args) = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    processors = options.chain.split(",")
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        corpus_dir = os.path.join(tmp_dir, "corpus")
+        os.makedirs(corpus_dir)
+        files = []
+        for i in range(options.files):
+            filename = os.path.join(corpus_dir, "image%d.png" % (i))
+            write_png(filename, 32, 32, i)
+            files.append(filename)
+        print "Generated a corpus of %d images." % (len(files))
+
+        results = [
+            ("thread per file (%d at a time)" % (options.legacy_concurrency), benchmark_thread_per_file(processors, files, os.path.join(tmp_dir, "legacy"), options.legacy_concurrency)),
+            ("ProcessorChainPool", benchmark_pool(processors, files, os.path.join(tmp_dir, "pool"), options.workers)),
+        ]
+        for (name, (duration, failed)) in results:
+            print "%-35s %8.2f s %10.1f files/s (%d failed)" % (name, duration, len(files) / duration, failed)
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -0,0 +1,127 @@
+"""Unit test for processor.py"""
+
+
+__author__ = "Wim Leers (work@wimleers.com)"
+__version__ = "$Rev$"
+__date__ = "$Date$"
+__license__ = "GPL"
+
+
+from processor import *
+import os
+import os.path
+import shutil
+import signal
+import tempfile
+import threading
+import unittest
+
+
+class Crash(Processor):
+    """kills the worker process that runs it"""
+
+
+    cpu_bound = True
+    resource_class = RESOURCE_CLASS_CPU_HEAVY
+
+
+    def run(self):
+        os._exit(1)
+
+
+class Copy(Processor):
+    cpu_bound = True
+    resource_class = RESOURCE_CLASS_CPU_HEAVY
+
+
+    def run(self):
+        self.copy_input_to_output()
+        return self.output_file
+
+
+class Uppercase(Processor):
+    """writes its output file in place, like most processors do"""
+
+
+    def process(self, data):
+        return data.upper()
+
+
+class TestConditions(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.input_file = os.path.join(self.path, "test.css")
+        f = open(self.input_file, "wb")
+        f.write("body { color: red; }")
+        f.close()
+        self.done = threading.Semaphore(0)
+        self.results = []
+
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+
+    def callback(self, input_file, output_file):
+        self.results.append(("callback", input_file))
+        self.output_file = output_file
+        self.done.release()
+
+
+    def error_callback(self, input_file, dependencies=[]):
+        self.results.append(("error_callback", input_file))
+        self.done.release()
+
+
+    def read(self, filename):
+        return open(filename, "rb").read()
+
+
+    def make_chain(self, processors):
+        return ProcessorChain(processors, self.input_file, self.path, "/", None, self.callback, self.error_callback, "test", os.path.join(self.path, "working_dir"))
+
+
+    def testDeadWorkerProcess(self):
+        pool = ProcessorChainPool(1, "test")
+        try:
+            pool.submit(self.make_chain(["processor_test.Crash"]))
+            # The chain's slot is freed, so the next chain can run.
+            pool.submit(self.make_chain(["processor_test.Copy"]))
+            self.done.acquire()
+            self.done.acquire()
+        finally:
+            pool.stop()
+        self.assertEqual([("error_callback", self.input_file), ("callback", self.input_file)], self.results)
+        self.assertEqual(0, pool.running_cost[RESOURCE_CLASS_CPU_HEAVY])
+
+
+    def testKilledIdleWorkerProcess(self):
+        # A worker process that dies before it gets a chain (or just when it
+        # gets one) is replaced, and no chain is lost.
+        pool = ProcessorChainPool(1, "test")
+        try:
+            os.kill(pool.processes[0].process.pid, signal.SIGKILL)
+            pool.submit(self.make_chain(["processor_test.Copy"]))
+            self.done.acquire()
+            pool.submit(self.make_chain(["processor_test.Copy"]))
+            self.done.acquire()
+        finally:
+            pool.stop()
+        self.assertEqual(2, len(self.results))
+        self.assertEqual(("callback", self.input_file), self.results[1])
+        self.assertEqual(0, pool.running_cost[RESOURCE_CLASS_CPU_HEAVY])
+
+
+    def testMixedChain(self):
+        # The next processor writes to the output file of the processor that
+        # has renamed the file (to the same name), which must not change the
+        # input file.
+        self.make_chain(["filename.SpacesToUnderscores", "processor_test.Uppercase"]).run()
+        self.assertEqual([("callback", self.input_file)], self.results)
+        self.assertNotEqual(self.input_file, self.output_file)
+        self.assertEqual("BODY { COLOR: RED; }", self.read(self.output_file))
+        self.assertEqual("body { color: red; }", self.read(self.input_file))
+
+
+if __name__ == "__main__":
+    unittest.main()
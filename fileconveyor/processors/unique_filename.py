@@ -6,8 +6,7 @@ __license__ = "GPL"
 
 from processor import *
 import stat
-import shutil
-import hashlib
+import hashing
 
 
 class Mtime(Processor):
@@ -15,6 +14,8 @@ class Mtime(Processor):
 
 
     valid_extensions = () # Any extension is valid.
+    cacheable = False # The output depends on the file's mtime.
+    rename_only = True
 
 
     def run(self):
@@ -28,7 +29,7 @@ class Mtime(Processor):
         self.set_output_file_basename(name + "_" + str(mtime) + extension)
 
         # Copy the input file to the output file.
-        shutil.copyfile(self.input_file, self.output_file)
+        self.copy_input_to_output()
 
         return self.output_file
 
@@ -38,6 +39,7 @@ class MD5(Processor):
 
 
     valid_extensions = () # Any extension is valid.
+    rename_only = True
 
 
     def run(self):
@@ -51,26 +53,18 @@ class MD5(Processor):
         self.set_output_file_basename(name + "_" + md5 + extension)
 
         # Copy the input file to the output file.
-        shutil.copyfile(self.input_file, self.output_file)
+        self.copy_input_to_output()
 
         return self.output_file
 
 
     def md5(self, filename):
         """compute the md5 hash of the specified file"""
-        m = hashlib.md5()
         try:
-            f = open(filename, "rb")
-        except IOError:
+            return hashing.get_digest(filename, "md5")
+        except (hashing.HashingError, OSError):
             raise FileIOError("Unable to open the file in readmode: %s" % (filename))
 
-        line = f.readline()
-        while line:
-            m.update(line)
-            line = f.readline()
-        f.close()
-        return m.hexdigest()
-
 
 if __name__ == "__main__":
     import time
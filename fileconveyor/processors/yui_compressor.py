@@ -15,6 +15,7 @@ class YUICompressor(Processor):
 
 
     valid_extensions = (".css", ".js")
+    resource_class = RESOURCE_CLASS_JVM
 
 
     def run(self):
@@ -29,7 +30,7 @@ class YUICompressor(Processor):
 
         # Run YUI Compressor on the file.
         yuicompressor_path = os.path.join(self.processors_path, "yuicompressor.jar")
-        (stdout, stderr) = self.run_command("java -jar %s %s -o %s" % (yuicompressor_path, self.input_file, tmp_file))
+        (stdout, stderr) = self.run_jar(yuicompressor_path, [self.input_file, "-o", tmp_file])
 
         # Copy the temporary output file to the final output file and remove
         # the temporary output file.
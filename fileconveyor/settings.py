@@ -15,11 +15,26 @@ PERSISTENT_DATA_DB = './persistent_data.db'
 SYNCED_FILES_DB = './synced_files.db'
 WORKING_DIR = '/tmp/fileconveyor'
 MAX_FILES_IN_PIPELINE = 50
-MAX_SIMULTANEOUS_PROCESSORCHAINS = 1
+MAX_SIMULTANEOUS_PROCESSORCHAINS = {'io-light' : 0, 'cpu-heavy' : 0, 'jvm' : 2}
+PROCESSOR_CACHE_DIR = './processor_cache'
+PROCESSOR_CACHE_MAX_SIZE = 512 * 1024 * 1024
+HASH_ALGORITHM = 'sha1'
+HASH_CACHE_DB = './hash_cache.db'
 MAX_SIMULTANEOUS_TRANSPORTERS = 10
 MAX_TRANSPORTER_QUEUE_SIZE = 1
+TRANSPORTER_IDLE_TIMEOUT = 300
+TRANSPORTER_KEEPALIVE_INTERVAL = 60
+TRANSPORTER_ADAPTIVE_CONCURRENCY = True
 QUEUE_PROCESS_BATCH_SIZE = 20
 CALLBACKS_CONSOLE_OUTPUT = False
 CONSOLE_LOGGER_LEVEL = logging.WARNING
 FILE_LOGGER_LEVEL = logging.INFO
 RETRY_INTERVAL = 30
+INITIAL_SCAN_MAX_FILES_PER_SECOND = 0
+PATHSCANNER_MODIFICATION_FIELDS = ('mtime_ns', 'size', 'inode')
+POLLING_INTERVAL = 10
+POLLING_MIN_INTERVAL = 1
+POLLING_MAX_INTERVAL = 320
+POLLING_STATS_PER_CYCLE = 10000
+FSMONITOR_BURST_THRESHOLD = 1000
+FSMONITOR_BURST_SETTLE_TIME = 2
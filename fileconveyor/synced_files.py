@@ -0,0 +1,134 @@
+"""synced_files.py Cached, read-only lookups in the synced files DB
+
+Processors that need the URLs of synced files (such as CSSURLUpdater) share a
+single connection per process and look up all URLs they need in batches.
+URLs that were found are kept in an LRU cache. Since a URL only changes when
+its row is updated or deleted, the DB writer (the Arbitrator) logs those
+changes in the synced_files_changes table (see log_change()). Every lookup
+first evicts the URLs that have changed since the previous lookup, so the
+cache also works across processes.
+"""
+
+
+__author__ = "Wim Leers (work@wimleers.com)"
+__version__ = "$Rev$"
+__date__ = "$Date$"
+__license__ = "GPL"
+
+
+import collections
+import os
+import sqlite3
+import threading
+
+
+# The maximum number of variables in an SQLite query.
+BATCH_SIZE = 500
+
+# The number of changes to keep in the synced_files_changes table.
+MAX_CHANGES = 10000
+
+
+def create_tables(dbcur):
+    """create the table in which the DB writer logs changes"""
+    dbcur.execute("CREATE TABLE IF NOT EXISTS synced_files_changes(id integer PRIMARY KEY AUTOINCREMENT, input_file text, server text)")
+
+
+def log_change(dbcur, input_file, server):
+    """log that the row for an input file and server has been updated or
+    deleted, must be called by the DB writer in the same transaction
+    """
+    dbcur.execute("INSERT INTO synced_files_changes (input_file, server) VALUES(?, ?)", (input_file, server))
+    change_id = dbcur.lastrowid
+    if change_id % 1000 == 0:
+        dbcur.execute("DELETE FROM synced_files_changes WHERE id <= ?", (change_id - MAX_CHANGES, ))
+
+
+class SyncedFilesLookup(object):
+    """looks up the URLs of synced files, with an LRU cache"""
+
+
+    def __init__(self, dbfile, cache_size=10000):
+        self.dbfile      = dbfile
+        self.cache_size  = cache_size
+        self.lock        = threading.Lock()
+        self.cache       = collections.OrderedDict()
+        self.last_change = None
+        self.hits        = 0
+        self.misses      = 0
+        self.pid         = os.getpid()
+        self.dbcon = sqlite3.connect(self.dbfile, timeout=30, check_same_thread=False)
+        self.dbcon.text_factory = unicode # This is the default, but we set it explicitly, just to be sure.
+
+
+    def get_urls(self, input_files, server):
+        """get the URLs of the input files that have been synced to a server,
+        as a dictionary
+        """
+        self.lock.acquire()
+        try:
+            self.__evict_changes()
+            urls = {}
+            missing = []
+            for input_file in set(input_files):
+                key = (input_file, server)
+                if key in self.cache:
+                    # Mark as most recently used.
+                    urls[input_file] = self.cache.pop(key)
+                    self.cache[key] = urls[input_file]
+                else:
+                    missing.append(input_file)
+            self.hits += len(urls)
+            self.misses += len(missing)
+
+            for i in range(0, len(missing), BATCH_SIZE):
+                batch = missing[i:i + BATCH_SIZE]
+                query = "SELECT input_file, url FROM synced_files WHERE server=? AND input_file IN (%s)" % (", ".join(["?"] * len(batch)))
+                for (input_file, url) in self.dbcon.execute(query, [server] + batch):
+                    urls[input_file] = url
+                    self.cache[(input_file, server)] = url
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            return urls
+        finally:
+            self.lock.release()
+
+
+    def __evict_changes(self):
+        """evict the URLs that the DB writer has changed since the last call"""
+        try:
+            if self.last_change is None:
+                self.last_change = self.dbcon.execute("SELECT COALESCE(MAX(id), 0) FROM synced_files_changes").fetchone()[0]
+                return
+            changes = self.dbcon.execute("SELECT id, input_file, server FROM synced_files_changes WHERE id > ? ORDER BY id", (self.last_change, )).fetchall()
+        except sqlite3.OperationalError:
+            # The DB writer has not created the table (yet): don't cache.
+            self.cache.clear()
+            return
+        if len(changes) and changes[0][0] != self.last_change + 1:
+            # Some changes have been pruned already.
+            self.cache.clear()
+        for (change_id, input_file, server) in changes:
+            self.cache.pop((input_file, server), None)
+            self.last_change = change_id
+
+
+    def close(self):
+        self.dbcon.close()
+
+
+# The lookup of this process, see get_lookup().
+_lookup = None
+_lookup_lock = threading.Lock()
+
+
+def get_lookup(dbfile):
+    """get the shared SyncedFilesLookup of this process"""
+    global _lookup
+    _lookup_lock.acquire()
+    # A forked process can't use the connection of its parent.
+    if _lookup is None or _lookup.dbfile != dbfile or _lookup.pid != os.getpid():
+        _lookup = SyncedFilesLookup(dbfile)
+    lookup = _lookup
+    _lookup_lock.release()
+    return lookup
@@ -0,0 +1,124 @@
+"""synced_files_benchmark.py Benchmark for the synced files lookups
+
+Generates a theme: a stylesheet with 2,000 url() references to images, which
+have all been synced. Then compares the URL lookups as CSSURLUpdater used to
+do them (a new connection per stylesheet, two queries and two file existence
+checks per reference) to SyncedFilesLookup, without and with a warm cache.
+If cssutils is installed, CSSURLUpdater itself is benchmarked as well.
+
+Usage: python synced_files_benchmark.py [--references=2000] [--images=1000]
+    [--stylesheets=10]
+"""
+
+
+__author__ = "Wim Leers (work@wimleers.com)"
+__version__ = "$Rev$"
+__date__ = "$Date$"
+__license__ = "GPL"
+
+
+from synced_files import *
+import logging
+import optparse
+import os
+import os.path
+import shutil
+import sqlite3
+import tempfile
+import time
+
+
+def generate_theme(theme_dir, dbfile, num_references, num_images):
+    """generate a stylesheet and its images, and mark the images as synced"""
+    os.makedirs(os.path.join(theme_dir, "images"))
+    dbcon = sqlite3.connect(dbfile)
+    dbcon.execute("CREATE TABLE synced_files(input_file text, transported_file_basename text, url text, server text)")
+    dbcon.execute("CREATE UNIQUE INDEX file_unique_per_server ON synced_files (input_file, server)")
+    create_tables(dbcon.cursor())
+    paths = []
+    for i in range(num_images):
+        path = os.path.join(theme_dir, "images", "image%d.png" % (i))
+        open(path, "wb").close()
+        dbcon.execute("INSERT INTO synced_files VALUES(?, ?, ?, ?)", (path, os.path.basename(path), "http://cdn.example.com/images/image%d.png" % (i), "cdn"))
+        paths.append(path)
+    dbcon.commit()
+    dbcon.close()
+
+    rules = []
+    for i in range(num_references):
+        rules.append(".rule%d { background: url(images/image%d.png); }" % (i, i % num_images))
+    stylesheet = os.path.join(theme_dir, "style.css")
+    f = open(stylesheet, "w")
+    f.write("\n".join(rules))
+    f.close()
+    return (stylesheet, [paths[i % num_images] for i in range(num_references)])
+
+
+def lookup_per_reference(dbfile, references):
+    """the lookups as CSSURLUpdater used to do them"""
+    dbcon = sqlite3.connect(dbfile)
+    dbcur = dbcon.cursor()
+    for path in references:
+        if os.path.exists(path):
+            dbcur.execute("SELECT url FROM synced_files WHERE input_file=?", (path, ))
+            dbcur.fetchone()
+    for path in references:
+        if os.path.exists(path):
+            dbcur.execute("SELECT url FROM synced_files WHERE input_file=? AND server=?", (path, "cdn"))
+            dbcur.fetchone()[0]
+    dbcon.close()
+
+
+def lookup_batched(lookup, references):
+    """the lookups as CSSURLUpdater does them now"""
+    paths = [path for path in set(references) if os.path.exists(path)]
+    lookup.get_urls(paths, "cdn")
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option("--references", type="int", default=2000, help="number of url() references in the stylesheet")
+    parser.add_option("--images", type="int", default=1000, help="number of distinct images that are referenced")
+    parser.add_option("--stylesheets", type="int", default=10, help="number of times the stylesheet is processed")
+    (options, args) = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        dbfile = os.path.join(tmp_dir, "synced_files.db")
+        (stylesheet, references) = generate_theme(os.path.join(tmp_dir, "theme"), dbfile, options.references, options.images)
+
+        results = []
+        start = time.time()
+        for i in range(options.stylesheets):
+            lookup_per_reference(dbfile, references)
+        results.append(("per reference (before)", time.time() - start))
+
+        lookup = SyncedFilesLookup(dbfile)
+        start = time.time()
+        lookup_batched(lookup, references)
+        results.append(("batched, cold cache", (time.time() - start) * options.stylesheets))
+        start = time.time()
+        for i in range(options.stylesheets):
+            lookup_batched(lookup, references)
+        results.append(("batched, warm cache", time.time() - start))
+
+        try:
+            import processors.link_updater as link_updater
+        except ImportError:
+            link_updater = None
+        if link_updater is not None:
+            link_updater.SYNCED_FILES_DB = dbfile
+            logging.basicConfig(level=logging.CRITICAL)
+            start = time.time()
+            for i in range(options.stylesheets):
+                processor = link_updater.CSSURLUpdater(stylesheet, stylesheet, tmp_dir, "/", "cdn", "SyncedFilesBenchmark", os.path.join(tmp_dir, "working"))
+                processor.run()
+            results.append(("CSSURLUpdater", time.time() - start))
+
+        print "%d url() references to %d images, %d stylesheets:" % (options.references, options.images, options.stylesheets)
+        for (name, duration) in results:
+            print "%-25s %10.1f ms per stylesheet" % (name, 1000 * duration / options.stylesheets)
+        if link_updater is None:
+            print "Install cssutils to benchmark CSSURLUpdater as well."
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -0,0 +1,80 @@
+"""Unit test for synced_files.py"""
+
+
+__author__ = "Wim Leers (work@wimleers.com)"
+__version__ = "$Rev$"
+__date__ = "$Date$"
+__license__ = "GPL"
+
+
+from synced_files import *
+import synced_files
+import os
+import os.path
+import sqlite3
+import unittest
+
+
+class TestConditions(unittest.TestCase):
+    def setUp(self):
+        self.db = "synced_files_test.db"
+        if os.path.exists(self.db):
+            os.remove(self.db)
+        # The DB writer.
+        self.dbcon = sqlite3.connect(self.db)
+        self.dbcur = self.dbcon.cursor()
+        self.dbcur.execute("CREATE TABLE synced_files(input_file text, transported_file_basename text, url text, server text)")
+        create_tables(self.dbcur)
+        for i in range(1000):
+            self.dbcur.execute("INSERT INTO synced_files VALUES(?, ?, ?, ?)", ("/%d.png" % (i), "%d.png" % (i), "http://cdn/%d.png" % (i), "cdn"))
+        self.dbcon.commit()
+
+
+    def tearDown(self):
+        self.dbcon.close()
+        if os.path.exists(self.db):
+            os.remove(self.db)
+
+
+    def testBatches(self):
+        lookup = SyncedFilesLookup(self.db, 100)
+        urls = lookup.get_urls(["/%d.png" % (i) for i in range(1200)], "cdn")
+        self.assertEqual(1000, len(urls))
+        self.assertEqual("http://cdn/999.png", urls["/999.png"])
+        self.assertEqual({}, lookup.get_urls(["/1.png"], "other"))
+        # Only the 100 most recently used URLs are cached.
+        self.assertEqual(100, len(lookup.cache))
+
+
+    def testInvalidation(self):
+        lookup = SyncedFilesLookup(self.db)
+        self.assertEqual({"/1.png" : "http://cdn/1.png", "/2.png" : "http://cdn/2.png"}, lookup.get_urls(["/1.png", "/2.png", "/5000.png"], "cdn"))
+        (hits, misses) = (lookup.hits, lookup.misses)
+        self.assertEqual({"/1.png" : "http://cdn/1.png"}, lookup.get_urls(["/1.png"], "cdn"))
+        self.assertEqual((hits + 1, misses), (lookup.hits, lookup.misses))
+
+        # Updates and deletions by the DB writer are picked up.
+        self.dbcur.execute("UPDATE synced_files SET url=? WHERE input_file=?", ("http://cdn/1_new.png", "/1.png"))
+        log_change(self.dbcur, "/1.png", "cdn")
+        self.dbcur.execute("DELETE FROM synced_files WHERE input_file=?", ("/2.png", ))
+        log_change(self.dbcur, "/2.png", "cdn")
+        self.dbcon.commit()
+        self.assertEqual({"/1.png" : "http://cdn/1_new.png"}, lookup.get_urls(["/1.png", "/2.png"], "cdn"))
+
+        # If changes have been pruned before they were seen, the cache is
+        # cleared.
+        lookup.get_urls(["/3.png"], "cdn")
+        self.dbcur.execute("UPDATE synced_files SET url=? WHERE input_file=?", ("http://cdn/3_new.png", "/3.png"))
+        log_change(self.dbcur, "/3.png", "cdn")
+        log_change(self.dbcur, "/4.png", "cdn")
+        self.dbcur.execute("DELETE FROM synced_files_changes WHERE input_file=?", ("/3.png", ))
+        self.dbcon.commit()
+        self.assertEqual({"/3.png" : "http://cdn/3_new.png"}, lookup.get_urls(["/3.png"], "cdn"))
+
+
+    def testGetLookup(self):
+        self.assertTrue(get_lookup(self.db) is get_lookup(self.db))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+"""concurrency.py Adaptive concurrency of the transports to a server
+
+AIMDController adapts the number of simultaneous transports (the window) to a
+server, like TCP adapts its congestion window: additive increase,
+multiplicative decrease. Transporters record how long every transport took
+(without waiting for rate limits), how large it was and whether it
+succeeded. Large transports are bound by the bandwidth rather than the
+latency, so they count towards the throughput, but not the latency. After
+each round (at least as many transports as
+the window and at least round_time seconds), the window:
+- grows by one if the throughput grew and the latency is stable;
+- is halved if the latency spiked, i.e. exceeded the lowest latency seen by
+  latency_spike_factor;
+- stays the same otherwise.
+An error halves the window immediately (at most once per round_time).
+"""
+
+
+__author__ = "Wim Leers (work@wimleers.com)"
+__version__ = "$Rev$"
+__date__ = "$Date$"
+__license__ = "GPL"
+
+
+import logging
+import threading
+import time
+
+
+class AIMDController(object):
+    """additive increase, multiplicative decrease of the number of
+    simultaneous transports to a server
+    """
+
+
+    def __init__(self, name, max_window, parent_logger=None, min_window=1, round_time=1.0, latency_spike_factor=2.0, decrease_factor=0.5, growth_threshold=1.05, max_latency_size=1024 * 1024, clock=time.time):
+        self.name                 = name
+        self.max_window           = max(max_window, min_window)
+        self.min_window           = min_window
+        self.round_time           = round_time
+        self.latency_spike_factor = latency_spike_factor
+        self.decrease_factor      = decrease_factor
+        self.growth_threshold     = growth_threshold
+        self.max_latency_size     = max_latency_size
+        self.clock                = clock
+        self.lock                 = threading.Lock()
+        if parent_logger is None:
+            self.logger = logging.getLogger("AIMDController")
+        else:
+            self.logger = logging.getLogger(".".join([parent_logger, "AIMDController"]))
+
+        self.window        = self.min_window
+        self.throughput    = 0.0
+        self.latency       = None
+        self.min_latency   = None
+        self.increases     = 0
+        self.decreases     = 0
+        self.errors        = 0
+        self.last_decrease = None
+        self.__start_round()
+
+
+    def __start_round(self):
+        self.round_start       = self.clock()
+        self.round_completions = 0
+        self.round_measured    = 0
+        self.round_duration    = 0.0
+
+
+    def record(self, success, duration, size=0):
+        """record the result of a transport, how long it took and how many
+        bytes it transported
+        """
+        self.lock.acquire()
+        try:
+            now = self.clock()
+            if not success:
+                self.errors += 1
+                # Back off only once for a burst of errors.
+                if self.last_decrease is None or now - self.last_decrease >= self.round_time:
+                    self.__decrease("an error")
+                return
+
+            self.round_completions += 1
+            if size <= self.max_latency_size:
+                self.round_measured += 1
+                self.round_duration += duration
+            elapsed = now - self.round_start
+            if self.round_completions < self.window or elapsed < self.round_time:
+                return
+
+            throughput = self.round_completions / elapsed
+            latency = None
+            if self.round_measured > 0:
+                latency = self.round_duration / self.round_measured
+                # Let the lowest latency rise slowly, so a server that became
+                # slower for good doesn't seem to have spiking latencies
+                # forever.
+                if self.min_latency is None:
+                    self.min_latency = latency
+                else:
+                    self.min_latency = min(latency, self.min_latency * 1.05)
+
+            if latency is not None and latency > self.min_latency * self.latency_spike_factor:
+                self.__decrease("a latency spike (%.3f s)" % (latency))
+            else:
+                if throughput >= self.throughput * self.growth_threshold and self.window < self.max_window:
+                    self.window += 1
+                    self.increases += 1
+                    self.logger.info("Window for server '%s' increased to %d (throughput: %.1f transports/s)." % (self.name, self.window, throughput))
+                self.throughput = throughput
+                self.__start_round()
+            if latency is not None:
+                self.latency = latency
+        finally:
+            self.lock.release()
+
+
+    def __decrease(self, reason):
+        """decrease the window multiplicatively and start a new round"""
+        self.last_decrease = self.clock()
+        window = max(self.min_window, int(self.window * self.decrease_factor))
+        if window < self.window:
+            self.window = window
+            self.decreases += 1
+            self.logger.info("Window for server '%s' decreased to %d because of %s." % (self.name, self.window, reason))
+        # Throughput will be lower with a smaller window: start over.
+        self.throughput = 0.0
+        self.__start_round()
+
+
+    def get_stats(self):
+        self.lock.acquire()
+        stats = {
+            "window"     : self.window,
+            "max_window" : self.max_window,
+            "throughput" : self.throughput,
+            "latency"    : self.latency,
+            "increases"  : self.increases,
+            "decreases"  : self.decreases,
+            "errors"     : self.errors,
+        }
+        self.lock.release()
+        return stats
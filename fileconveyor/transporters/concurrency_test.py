@@ -0,0 +1,93 @@
+"""Unit test for concurrency.py"""
+
+
+__author__ = "Wim Leers (work@wimleers.com)"
+__version__ = "$Rev$"
+__date__ = "$Date$"
+__license__ = "GPL"
+
+
+from concurrency import *
+import unittest
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+
+    def __call__(self):
+        return self.now
+
+
+class TestConditions(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.controller = AIMDController("cdn", 8, clock=self.clock)
+
+
+    def round(self, throughput, latency, errors=0, size=0):
+        """complete a round of one second with the given throughput"""
+        transports = max(int(throughput), self.controller.window)
+        start = self.clock.now
+        for i in range(transports):
+            self.clock.now = start + float(i + 1) / transports
+            self.controller.record(True, latency, size)
+        for i in range(errors):
+            self.controller.record(False, latency)
+
+
+    def testIncrease(self):
+        self.assertEqual(1, self.controller.window)
+        # The window grows while the throughput grows.
+        for throughput in (2, 4, 6, 8):
+            self.round(throughput, 0.1)
+        self.assertEqual(5, self.controller.window)
+        # But not when the throughput doesn't grow.
+        self.round(8, 0.1)
+        self.assertEqual(5, self.controller.window)
+        # And never beyond the maximum.
+        for throughput in range(10, 50, 5):
+            self.round(throughput, 0.1)
+        self.assertEqual(8, self.controller.window)
+        self.assertEqual(8, self.controller.get_stats()["window"])
+
+
+    def testLatencySpike(self):
+        for throughput in (2, 4, 6, 8):
+            self.round(throughput, 0.1)
+        self.assertEqual(5, self.controller.window)
+        self.round(10, 0.5)
+        self.assertEqual(2, self.controller.window)
+        self.assertEqual(1, self.controller.get_stats()["decreases"])
+
+
+    def testLargeTransports(self):
+        for throughput in (2, 4, 6, 8):
+            self.round(throughput, 0.1)
+        # Large files take longer because of their size, not the latency.
+        self.round(10, 5.0, size=100 * 1024 * 1024)
+        self.assertEqual(6, self.controller.window)
+        self.assertEqual(0, self.controller.get_stats()["decreases"])
+        self.assertAlmostEqual(0.1, self.controller.get_stats()["latency"])
+
+
+    def testError(self):
+        for throughput in (2, 4, 6, 8):
+            self.round(throughput, 0.1)
+        # Several errors in a round only halve the window once.
+        self.round(8, 0.1, errors=3)
+        self.assertEqual(2, self.controller.window)
+        self.assertEqual(3, self.controller.get_stats()["errors"])
+        # Never below the minimum.
+        for i in range(3):
+            self.clock.now += 2
+            self.controller.record(False, 0.1)
+        self.assertEqual(1, self.controller.window)
+        # After backing off, the window grows again.
+        self.round(2, 0.1)
+        self.assertEqual(2, self.controller.window)
+
+
+if __name__ == "__main__":
+    unittest.main()
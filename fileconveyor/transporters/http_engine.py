@@ -0,0 +1,461 @@
+"""http_engine.py Event-driven HTTP client for transporters
+
+HTTPEngine runs many HTTP requests in a single thread, over a small pool of
+persistent (keep-alive) connections, on an asyncore event loop. Requests wait
+for a free connection; connections send their request (streaming the body
+from a file) and parse the response without ever blocking, so many uploads
+to a destination with a high latency can be in flight without a thread for
+each of them.
+
+The owner of the engine calls poll() in a loop. The callback of a request is
+called from poll() once the request has completed or failed, with the
+response and an error message (one of both is None). A request that fails on
+a reused connection before any response was received (i.e. the server closed
+the idle connection) is retried once on another connection.
+
+The engine may be given a RateLimiter (see ratelimit.py). It never waits for
+it: a request that may not be sent yet stays pending, and a connection that
+may not send more of a body yet stops writing, until their turn has come.
+"""
+
+
+__author__ = "Wim Leers (work@wimleers.com)"
+__version__ = "$Rev$"
+__date__ = "$Date$"
+__license__ = "GPL"
+
+
+import asyncore
+import collections
+import logging
+import socket
+import sys
+import time
+
+
+# Define exceptions.
+class HTTPEngineError(Exception): pass
+
+
+BUFFER_SIZE = 64 * 1024
+
+
+class Request(object):
+    """an HTTP request, whose body is a string or a file of size bytes"""
+
+
+    def __init__(self, method, path, headers=None, body=None, size=None, callback=None):
+        self.method   = method
+        self.path     = path
+        self.headers  = headers or {}
+        self.body     = body
+        self.size     = size
+        self.callback = callback
+        self.attempts = 0
+        self.send_at  = None
+        if body is None:
+            self.size = 0
+        elif isinstance(body, str):
+            self.size = len(body)
+
+
+class Response(object):
+    def __init__(self, status, reason, headers, body):
+        self.status  = status
+        self.reason  = reason
+        self.headers = headers
+        self.body    = body
+
+
+class ResponseParser(object):
+    """parses an HTTP response from the data it is fed"""
+
+
+    def __init__(self, method):
+        self.method    = method
+        self.state     = "head"
+        self.buffer    = ""
+        self.version   = None
+        self.status    = None
+        self.reason    = None
+        self.headers   = {}
+        self.body      = []
+        self.remaining = 0
+        self.done      = False
+
+
+    def feed(self, data):
+        self.buffer += data
+        while not self.done:
+            if self.state == "head":
+                end = self.buffer.find("\r\n\r\n")
+                if end == -1:
+                    return
+                lines = self.buffer[:end].split("\r\n")
+                self.buffer = self.buffer[end + 4:]
+                self.__parse_head(lines)
+            elif self.state in ("body", "chunk"):
+                data = self.buffer[:self.remaining]
+                self.buffer = self.buffer[len(data):]
+                self.body.append(data)
+                self.remaining -= len(data)
+                if self.remaining > 0:
+                    return
+                if self.state == "body":
+                    self.done = True
+                else:
+                    self.state = "chunk end"
+            elif self.state == "chunk end":
+                if len(self.buffer) < 2:
+                    return
+                self.buffer = self.buffer[2:]
+                self.state = "chunk size"
+            elif self.state in ("chunk size", "trailers"):
+                end = self.buffer.find("\r\n")
+                if end == -1:
+                    return
+                line = self.buffer[:end]
+                self.buffer = self.buffer[end + 2:]
+                if self.state == "trailers":
+                    self.done = line == ""
+                else:
+                    try:
+                        self.remaining = int(line.split(";")[0].strip(), 16)
+                    except ValueError:
+                        raise HTTPEngineError("Invalid chunk size: '%s'." % (line))
+                    if self.remaining == 0:
+                        self.state = "trailers"
+                    else:
+                        self.state = "chunk"
+            elif self.state == "until close":
+                self.body.append(self.buffer)
+                self.buffer = ""
+                return
+
+
+    def __parse_head(self, lines):
+        parts = lines[0].split(" ", 2)
+        try:
+            if not parts[0].startswith("HTTP/"):
+                raise ValueError
+            status = int(parts[1])
+        except (ValueError, IndexError):
+            raise HTTPEngineError("Invalid status line: '%s'." % (lines[0]))
+        # Skip interim responses, e.g. "100 Continue".
+        if 100 <= status < 200:
+            return
+        self.version = parts[0]
+        self.status  = status
+        self.reason  = len(parts) > 2 and parts[2] or ""
+        for line in lines[1:]:
+            (name, value) = (line.split(":", 1) + [""])[:2]
+            self.headers[name.strip().lower()] = value.strip()
+
+        if self.method == "HEAD" or self.status in (204, 304):
+            self.done = True
+        elif self.headers.get("transfer-encoding", "").lower() == "chunked":
+            self.state = "chunk size"
+        elif self.headers.has_key("content-length"):
+            self.remaining = int(self.headers["content-length"])
+            self.state = "body"
+            self.done = self.remaining == 0
+        else:
+            self.state = "until close"
+
+
+    def close(self):
+        """the connection was closed, returns whether the response is
+        complete
+        """
+        if self.state == "until close":
+            self.done = True
+        return self.done
+
+
+    def keep_alive(self):
+        """whether the connection may be used for another request"""
+        connection = self.headers.get("connection", "").lower()
+        if self.state == "until close" or connection == "close":
+            return False
+        if self.version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return True
+
+
+    def get_response(self):
+        return Response(self.status, self.reason, self.headers, "".join(self.body))
+
+
+class Connection(asyncore.dispatcher):
+    """a persistent HTTP connection, which sends one request at a time"""
+
+
+    def __init__(self, engine):
+        asyncore.dispatcher.__init__(self, map=engine.map)
+        self.engine        = engine
+        self.request       = None
+        self.requests      = 0
+        self.closed        = False
+        self.out           = ""
+        self.body          = None
+        self.body_left     = 0
+        self.received      = False
+        self.parser        = None
+        self.last_activity = time.time()
+        self.resume_at     = 0
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Data is always sent in large buffers, so don't delay the last
+        # packet of a request until the previous ones have been acknowledged.
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            self.connect((engine.host, engine.port))
+        except socket.error:
+            self.close()
+            raise
+
+
+    def start(self, request):
+        """send a request"""
+        request.attempts += 1
+        self.request       = request
+        self.requests     += 1
+        self.received      = False
+        self.parser        = ResponseParser(request.method)
+        self.last_activity = time.time()
+
+        headers = {
+            "Host"           : self.engine.host_header,
+            "User-Agent"     : "File Conveyor",
+            "Content-Length" : str(request.size),
+        }
+        headers.update(request.headers)
+        lines = ["%s %s HTTP/1.1" % (request.method, request.path)]
+        lines.extend(["%s: %s" % (name, value) for (name, value) in headers.items()])
+        self.out = "\r\n".join(lines) + "\r\n\r\n"
+        self.body = None
+        self.body_left = 0
+        if isinstance(request.body, str):
+            self.out += request.body
+        elif request.body is not None:
+            request.body.seek(0)
+            self.body = request.body
+            self.body_left = request.size
+
+
+    def readable(self):
+        return True
+
+
+    def writable(self):
+        if self.resume_at > 0:
+            if time.time() < self.resume_at:
+                return False
+            self.resume_at = 0
+        return self.connecting or len(self.out) > 0 or self.body_left > 0
+
+
+    def handle_connect(self):
+        pass
+
+
+    def handle_write(self):
+        # Send the head of a request with the start of its body.
+        if len(self.out) < BUFFER_SIZE and self.body_left > 0:
+            data = self.body.read(min(BUFFER_SIZE, self.body_left))
+            if not data:
+                raise HTTPEngineError("The body ended %d bytes early." % (self.body_left))
+            self.body_left -= len(data)
+            self.out += data
+            # Hold the data back until the rate limiter allows it. Waiting
+            # isn't inactivity of the server.
+            if self.engine.limiter is not None:
+                wait = self.engine.limiter.reserve_transfer(len(data))
+                if wait > 0:
+                    self.resume_at = time.time() + wait
+                    self.last_activity = self.resume_at
+                    return
+        sent = self.send(self.out)
+        self.out = self.out[sent:]
+        self.last_activity = time.time()
+
+
+    def handle_read(self):
+        data = self.recv(BUFFER_SIZE)
+        if not data or self.closed:
+            # recv() has called handle_close() already.
+            return
+        self.last_activity = time.time()
+        if self.request is None:
+            self.fail("Unexpected data on an idle connection.")
+            return
+        self.received = True
+        self.parser.feed(data)
+        if self.parser.done:
+            self.finish()
+
+
+    def handle_close(self):
+        if self.request is not None and self.parser.close():
+            self.finish()
+        elif not self.closed:
+            self.fail("The connection was closed by the server.")
+
+
+    def handle_error(self):
+        error = sys.exc_info()[1]
+        self.fail("%s: %s" % (error.__class__.__name__, error))
+
+
+    def close(self):
+        self.closed = True
+        asyncore.dispatcher.close(self)
+
+
+    def finish(self):
+        """the response has been received completely"""
+        (request, self.request) = (self.request, None)
+        # The server may respond before it has received the whole body, e.g.
+        # to refuse it.
+        if not self.parser.keep_alive() or self.out or self.body_left > 0:
+            self.close()
+        self.engine.finished(self, request, self.parser.get_response(), None)
+
+
+    def fail(self, error):
+        (request, self.request) = (self.request, None)
+        self.out = ""
+        self.body_left = 0
+        self.close()
+        self.engine.finished(self, request, None, error)
+
+
+class HTTPEngine(object):
+    """runs HTTP requests to a host over at most max_connections
+    connections, in a single thread
+    """
+
+
+    def __init__(self, host, port=80, max_connections=8, timeout=60, parent_logger=None, limiter=None):
+        self.host            = host
+        self.port            = port
+        self.max_connections = max_connections
+        self.timeout         = timeout
+        self.limiter         = limiter
+        self.host_header     = host
+        if port != 80:
+            self.host_header = "%s:%d" % (host, port)
+        if parent_logger is None:
+            self.logger = logging.getLogger("HTTPEngine")
+        else:
+            self.logger = logging.getLogger(".".join([parent_logger, "HTTPEngine"]))
+
+        # Connections are kept by their id(): comparing dispatchers is slow.
+        self.map         = {}
+        self.connections = {}
+        self.idle        = []
+        self.pending     = collections.deque()
+        self.completed   = []
+        self.opened      = 0
+
+
+    def submit(self, request):
+        """queue a request, it's sent as soon as a connection is free"""
+        self.pending.append(request)
+        self.__dispatch()
+
+
+    def in_flight(self):
+        """the number of requests that have not completed yet"""
+        return len(self.pending) + len(self.connections) - len(self.idle)
+
+
+    def free_slots(self):
+        """the number of requests that could be sent right away"""
+        return max(0, self.max_connections - self.in_flight())
+
+
+    def poll(self, timeout=0.05):
+        """wait for I/O for at most timeout seconds, handle it, then call the
+        callbacks of the requests that have completed
+        """
+        if self.map:
+            asyncore.poll(timeout, self.map)
+        else:
+            # asyncore returns right away without connections, e.g. while
+            # the rate limiter holds back all requests.
+            time.sleep(timeout)
+
+        now = time.time()
+        for connection in self.connections.values():
+            if connection.request is not None and now - connection.last_activity > self.timeout:
+                connection.fail("The request timed out after %d seconds." % (self.timeout))
+
+        # Call the callbacks after the I/O has been handled, so they may
+        # submit new requests.
+        (completed, self.completed) = (self.completed, [])
+        for (request, response, error) in completed:
+            if request.callback is not None:
+                request.callback(response, error)
+        self.__dispatch()
+
+
+    def finished(self, connection, request, response, error):
+        """called by a connection when it's done with a request"""
+        if connection.closed:
+            if self.connections.pop(id(connection), None) is not None:
+                self.idle = [idle for idle in self.idle if idle is not connection]
+        else:
+            self.idle.append(connection)
+        if request is None:
+            return
+        # The server may close an idle connection just when a new request is
+        # sent over it: try again once.
+        if error is not None and connection.requests > 1 and not connection.received and request.attempts < 2:
+            self.logger.debug("Retrying %s %s on a new connection: %s" % (request.method, request.path, error))
+            self.pending.appendleft(request)
+        else:
+            self.completed.append((request, response, error))
+
+
+    def __dispatch(self):
+        """send pending requests over idle or new connections"""
+        while len(self.pending) > 0:
+            # Requests are sent in order: the first one waits for the rate
+            # limiter, the others for the first one.
+            request = self.pending[0]
+            if self.limiter is not None:
+                if request.send_at is None:
+                    request.send_at = time.time() + self.limiter.reserve_request()
+                if time.time() < request.send_at:
+                    break
+            if len(self.idle) > 0:
+                connection = self.idle.pop()
+            elif len(self.connections) < self.max_connections:
+                try:
+                    connection = Connection(self)
+                except socket.error, e:
+                    request = self.pending.popleft()
+                    self.completed.append((request, None, "Could not connect to %s: %s" % (self.host_header, e)))
+                    continue
+                self.connections[id(connection)] = connection
+                self.opened += 1
+            else:
+                break
+            connection.start(self.pending.popleft())
+
+
+    def close(self):
+        """close all connections, requests that haven't completed fail"""
+        for connection in self.connections.values():
+            if connection.request is not None:
+                connection.fail("The engine was closed.")
+            else:
+                connection.close()
+        self.connections = {}
+        self.idle = []
+        while len(self.pending) > 0:
+            self.completed.append((self.pending.popleft(), None, "The engine was closed."))
+        (completed, self.completed) = (self.completed, [])
+        for (request, response, error) in completed:
+            if request.callback is not None:
+                request.callback(response, error)
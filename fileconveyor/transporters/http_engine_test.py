@@ -0,0 +1,262 @@
+"""Unit test for http_engine.py"""
+
+
+__author__ = "Wim Leers (work@wimleers.com)"
+__version__ = "$Rev$"
+__date__ = "$Date$"
+__license__ = "GPL"
+
+
+from http_engine import *
+from ratelimit import RateLimiter
+import BaseHTTPServer
+import socket
+import SocketServer
+import StringIO
+import threading
+import time
+import unittest
+
+
+class WebDAVStandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """handles PUT, DELETE and MKCOL requests like a WebDAV server does"""
+
+
+    protocol_version = "HTTP/1.1"
+    # Send every response at once.
+    wbufsize = -1
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+    def respond(self, status, body="", headers={}):
+        self.send_response(status)
+        for (name, value) in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def handle_one_request(self):
+        self.server.enter()
+        try:
+            BaseHTTPServer.BaseHTTPRequestHandler.handle_one_request(self)
+        finally:
+            self.server.leave()
+        if self.server.close_connections:
+            self.close_connection = 1
+
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.server.latency)
+        parent = self.path[:self.path.rfind("/") + 1]
+        if not parent in self.server.collections:
+            return self.respond(409)
+        self.server.objects[self.path] = body
+        self.respond(201)
+
+
+    def do_MKCOL(self):
+        if self.path in self.server.collections:
+            return self.respond(405)
+        self.server.collections.add(self.path)
+        self.respond(201)
+
+
+    def do_DELETE(self):
+        if self.server.objects.pop(self.path, None) is None:
+            return self.respond(404)
+        self.respond(204)
+
+
+    def do_GET(self):
+        if self.path == "/chunked":
+            self.send_response(200)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            self.wfile.write("5\r\nhello\r\n7;ext=1\r\n, world\r\n0\r\n\r\n")
+        elif self.path == "/until-close":
+            self.send_response(200)
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.wfile.write("hello, world")
+            self.close_connection = 1
+        else:
+            self.respond(500, "Internal Server Error")
+
+
+class WebDAVStandIn(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+    def __init__(self, latency=0):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0), WebDAVStandInHandler)
+        self.latency           = latency
+        self.close_connections = False
+        self.collections       = set(["/"])
+        self.objects           = {}
+        self.lock              = threading.Lock()
+        self.active            = 0
+        self.max_active        = 0
+
+
+    def enter(self):
+        self.lock.acquire()
+        self.active += 1
+        self.max_active = max(self.active, self.max_active)
+        self.lock.release()
+
+
+    def leave(self):
+        self.lock.acquire()
+        self.active -= 1
+        self.lock.release()
+
+
+class TestConditions(unittest.TestCase):
+    def setUp(self):
+        self.server = WebDAVStandIn()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.engine = HTTPEngine("127.0.0.1", self.server.server_address[1], 3, timeout=5)
+        self.results = {}
+
+
+    def tearDown(self):
+        self.engine.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+    def submit(self, method, path, body=None, size=None):
+        def callback(response, error):
+            self.results[(method, path)] = (response, error)
+        self.engine.submit(Request(method, path, body=body, size=size, callback=callback))
+
+
+    def run_engine(self):
+        deadline = time.time() + 10
+        while self.engine.in_flight() > 0 or self.engine.completed:
+            self.assertTrue(time.time() < deadline)
+            self.engine.poll(0.01)
+
+
+    def testParser(self):
+        # Feed the response byte by byte.
+        parser = ResponseParser("GET")
+        response = "HTTP/1.1 100 Continue\r\n\r\nHTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n3\r\nabc\r\n0\r\nX-Trailer: 1\r\n\r\n"
+        for c in response:
+            self.assertFalse(parser.done)
+            parser.feed(c)
+        self.assertTrue(parser.done)
+        self.assertEqual("abc", parser.get_response().body)
+        self.assertEqual(200, parser.get_response().status)
+        self.assertTrue(parser.keep_alive())
+        parser = ResponseParser("GET")
+        parser.feed("HTTP/1.0 200 OK\r\n\r\nabc")
+        self.assertFalse(parser.done)
+        self.assertTrue(parser.close())
+        self.assertFalse(parser.keep_alive())
+        self.assertRaises(HTTPEngineError, ResponseParser("GET").feed, "SSH-2.0\r\n\r\n")
+
+
+    def testRequests(self):
+        self.server.latency = 0.05
+        for i in range(20):
+            self.submit("PUT", "/file%d.txt" % (i), "file %d" % (i))
+        self.assertEqual(20, self.engine.in_flight())
+        self.assertEqual(0, self.engine.free_slots())
+        self.run_engine()
+        for i in range(20):
+            (response, error) = self.results[("PUT", "/file%d.txt" % (i))]
+            self.assertEqual(None, error)
+            self.assertEqual(201, response.status)
+            self.assertEqual("file %d" % (i), self.server.objects["/file%d.txt" % (i)])
+        # At most 3 requests were in flight, over 3 persistent connections.
+        self.assertEqual(3, self.server.max_active)
+        self.assertEqual(3, self.engine.opened)
+
+
+    def testResponses(self):
+        self.submit("GET", "/chunked")
+        self.submit("GET", "/until-close")
+        self.submit("GET", "/error")
+        self.submit("DELETE", "/missing.txt")
+        self.submit("MKCOL", "/")
+        self.run_engine()
+        self.assertEqual("hello, world", self.results[("GET", "/chunked")][0].body)
+        self.assertEqual("hello, world", self.results[("GET", "/until-close")][0].body)
+        self.assertEqual(500, self.results[("GET", "/error")][0].status)
+        self.assertEqual(404, self.results[("DELETE", "/missing.txt")][0].status)
+        self.assertEqual(405, self.results[("MKCOL", "/")][0].status)
+
+
+    def testClosedConnection(self):
+        # The server closes connections without saying so: the request that
+        # reuses a closed connection is retried.
+        self.server.close_connections = True
+        self.engine.max_connections = 1
+        def callback(response, error):
+            self.results["first"] = (response, error)
+            self.submit("PUT", "/second.txt", "second")
+        self.engine.submit(Request("PUT", "/first.txt", body="first", callback=callback))
+        self.run_engine()
+        self.assertEqual(201, self.results["first"][0].status)
+        (response, error) = self.results[("PUT", "/second.txt")]
+        self.assertEqual(None, error)
+        self.assertEqual(201, response.status)
+        self.assertEqual("second", self.server.objects["/second.txt"])
+
+
+    def testRateLimits(self):
+        # The limits are applied without ever blocking the event loop, so
+        # waiting requests don't time out.
+        def sleep(seconds):
+            self.fail("The engine waited for the rate limiter.")
+        self.engine.limiter = RateLimiter("test", 100 * 1024, 20, sleep=sleep)
+        self.engine.timeout = 0.5
+        body = "x" * 250 * 1024
+        self.submit("PUT", "/large.txt", StringIO.StringIO(body), len(body))
+        for i in range(29):
+            self.submit("PUT", "/file%d.txt" % (i), "file %d" % (i))
+        start = time.time()
+        longest_poll = 0
+        while self.engine.in_flight() > 0 or self.engine.completed:
+            self.assertTrue(time.time() < start + 10)
+            poll_start = time.time()
+            self.engine.poll(0.01)
+            longest_poll = max(longest_poll, time.time() - poll_start)
+        duration = time.time() - start
+        for (method, path) in [("PUT", "/large.txt")] + [("PUT", "/file%d.txt" % (i)) for i in range(29)]:
+            (response, error) = self.results[(method, path)]
+            self.assertEqual(None, error)
+            self.assertEqual(201, response.status)
+        self.assertEqual(body, self.server.objects["/large.txt"])
+        # 10 requests over the burst of 20 take 0.5 s, 150 KB over the burst
+        # of 100 KB take 1.5 s.
+        self.assertTrue(duration > 1.2)
+        self.assertTrue(longest_poll < 0.2)
+
+
+    def testConnectionRefused(self):
+        s = socket.socket()
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+        s.close()
+        self.engine = HTTPEngine("127.0.0.1", port, 3, timeout=5)
+        self.submit("PUT", "/file.txt", "file")
+        self.run_engine()
+        (response, error) = self.results[("PUT", "/file.txt")]
+        self.assertEqual(None, response)
+        self.assertTrue(error is not None)
+        self.assertEqual(0, len(self.engine.connections))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+"""multipart.py Parallel multipart uploads of large files
+
+A large file is split into parts, which are uploaded concurrently, each over
+its own connection. A part that fails is retried by itself, so a network
+hiccup doesn't restart the upload from zero. The upload is completed once all
+parts have been uploaded, and cancelled otherwise.
+
+upload_file() works with any upload that has upload_part(), complete() and
+cancel() methods. S3MultipartUpload is such an upload for Amazon S3 (and
+S3-compatible storages), through boto.
+"""
+
+
+__author__ = "Wim Leers (work@wimleers.com)"
+__version__ = "$Rev$"
+__date__ = "$Date$"
+__license__ = "GPL"
+
+
+import math
+import os
+import Queue
+import threading
+import time
+try:
+    from boto.s3.multipart import MultiPartUpload
+except ImportError:
+    MultiPartUpload = None
+
+
+# Define exceptions.
+class MultipartUploadError(Exception): pass
+
+
+# S3 requires parts of at least 5 MB (except for the last part) and allows at
+# most 10,000 parts.
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PARTS = 10000
+
+
+def split(size, part_size):
+    """split size bytes into parts, as (part number, offset, size) tuples
+
+    Parts are made larger than part_size if there would be too many.
+    """
+    part_size = max(part_size, int(math.ceil(float(size) / MAX_PARTS)), 1)
+    parts = []
+    for offset in range(0, size, part_size):
+        parts.append((len(parts) + 1, offset, min(part_size, size - offset)))
+    return parts
+
+
+def upload_file(filename, upload, part_size, connections=4, retries=3, retry_delay=1.0, limiter=None):
+    """upload a file in parts, over at most the given number of connections
+
+    Every part is tried retries + 1 times, with exponential backoff. Every
+    attempt is a request for the RateLimiter limiter, if any, and sends the
+    part no faster than it allows.
+    """
+    parts = Queue.Queue()
+    for part in split(os.path.getsize(filename), part_size):
+        parts.put(part)
+    errors = []
+
+    def upload_parts():
+        try:
+            f = open(filename, "rb")
+            try:
+                while not errors:
+                    try:
+                        (part_num, offset, size) = parts.get_nowait()
+                    except Queue.Empty:
+                        break
+                    attempt = 0
+                    while True:
+                        try:
+                            f.seek(offset)
+                            fp = f
+                            # Every attempt is charged, but only once, also if
+                            # the part is read twice.
+                            if limiter is not None:
+                                limiter.request()
+                                fp = limiter.wrap(f)
+                            upload.upload_part(fp, part_num, size)
+                            break
+                        except Exception, e:
+                            if attempt == retries or errors:
+                                raise MultipartUploadError("Part %d of '%s' could not be uploaded: %s" % (part_num, filename, e))
+                            time.sleep(retry_delay * 2 ** attempt)
+                            attempt += 1
+            finally:
+                f.close()
+        except Exception, e:
+            errors.append(e)
+
+    threads = []
+    for i in range(max(min(connections, parts.qsize()), 1)):
+        thread = threading.Thread(target=upload_parts, name="MultipartUploadThread")
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+    try:
+        if errors:
+            raise errors[0]
+        upload.complete()
+    except Exception, e:
+        upload.cancel()
+        if isinstance(e, MultipartUploadError):
+            raise
+        raise MultipartUploadError("The upload of '%s' could not be completed: %s" % (filename, e))
+
+
+class S3MultipartUpload(object):
+    """a multipart upload to S3 through boto, every thread uses its own
+    connection
+
+    connect is a callable that opens a new connection and returns the bucket.
+    """
+
+
+    def __init__(self, connect, key_name, headers=None, policy=None):
+        if MultiPartUpload is None:
+            raise MultipartUploadError("Multipart uploads to S3 require boto.")
+        self.connect = connect
+        self.local   = threading.local()
+        self.lock    = threading.Lock()
+        self.etags   = {}
+        self.mp = self.connect().initiate_multipart_upload(key_name, headers=headers, policy=policy)
+
+
+    def __get_upload(self):
+        """get the multipart upload for the connection of this thread"""
+        if not hasattr(self.local, "mp"):
+            mp = MultiPartUpload(self.connect())
+            mp.key_name = self.mp.key_name
+            mp.id = self.mp.id
+            self.local.mp = mp
+        return self.local.mp
+
+
+    def upload_part(self, fp, part_num, size):
+        key = self.__get_upload().upload_part_from_file(fp, part_num, size=size)
+        # Older versions of boto don't return the part.
+        self.lock.acquire()
+        self.etags[part_num] = getattr(key, "etag", None)
+        self.lock.release()
+
+
+    def complete(self):
+        # Let boto list the parts if their ETags are unknown.
+        if None in self.etags.values():
+            self.mp.complete_upload()
+            return
+        # Send the ETags that were collected instead of listing the parts,
+        # which takes another request per 1,000 parts.
+        parts = ["<Part><PartNumber>%d</PartNumber><ETag>%s</ETag></Part>" % (part_num, self.etags[part_num]) for part_num in sorted(self.etags.keys())]
+        xml = "<CompleteMultipartUpload>%s</CompleteMultipartUpload>" % ("".join(parts))
+        self.mp.bucket.complete_multipart_upload(self.mp.key_name, self.mp.id, xml)
+
+
+    def cancel(self):
+        self.mp.cancel_upload()
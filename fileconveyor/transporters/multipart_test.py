@@ -0,0 +1,237 @@
+"""Unit test for multipart.py"""
+
+
+__author__ = "Wim Leers (work@wimleers.com)"
+__version__ = "$Rev$"
+__date__ = "$Date$"
+__license__ = "GPL"
+
+
+from multipart import *
+from ratelimit import RateLimiter
+import BaseHTTPServer
+import hashlib
+import os
+import os.path
+import shutil
+import SocketServer
+import tempfile
+import threading
+import unittest
+import urlparse
+import xml.dom.minidom
+
+
+class FakeUpload(object):
+    """an in-memory upload, which fails a part a given number of times"""
+
+
+    def __init__(self, failures={}):
+        self.failures  = dict(failures)
+        self.parts     = {}
+        self.attempts  = {}
+        self.completed = False
+        self.cancelled = False
+        self.lock      = threading.Lock()
+
+
+    def upload_part(self, fp, part_num, size):
+        self.lock.acquire()
+        self.attempts[part_num] = self.attempts.get(part_num, 0) + 1
+        fail = self.failures.get(part_num, 0) > 0
+        if fail:
+            self.failures[part_num] -= 1
+        self.lock.release()
+        if fail:
+            raise IOError("Connection reset by peer")
+        # Read the part twice, like boto does to calculate its MD5 hash.
+        offset = fp.tell()
+        fp.read(size)
+        fp.seek(offset)
+        self.parts[part_num] = fp.read(size)
+
+
+    def complete(self):
+        self.completed = True
+
+
+    def cancel(self):
+        self.cancelled = True
+
+
+    def data(self):
+        return "".join([self.parts[part_num] for part_num in sorted(self.parts.keys())])
+
+
+class S3StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """handles the requests of a multipart upload like S3 does"""
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+    def respond(self, status, body="", headers={}):
+        self.send_response(status)
+        for (name, value) in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def do_POST(self):
+        (path, query) = urlparse.urlparse(self.path)[2:5:2]
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        (bucket, key) = path[1:].split("/", 1)
+        uploads = self.server.uploads
+        if query == "uploads":
+            upload_id = "upload%d" % (len(uploads))
+            uploads[upload_id] = {}
+            self.respond(200, "<InitiateMultipartUploadResult><Bucket>%s</Bucket><Key>%s</Key><UploadId>%s</UploadId></InitiateMultipartUploadResult>" % (bucket, key, upload_id))
+        else:
+            upload_id = urlparse.parse_qs(query)["uploadId"][0]
+            parts = uploads.pop(upload_id)
+            data = []
+            for part in xml.dom.minidom.parseString(body).getElementsByTagName("Part"):
+                part_num = int(part.getElementsByTagName("PartNumber")[0].firstChild.data)
+                etag = part.getElementsByTagName("ETag")[0].firstChild.data
+                if etag != '"%s"' % (hashlib.md5(parts[part_num]).hexdigest()):
+                    return self.respond(400, "<Error><Code>InvalidPart</Code></Error>")
+                data.append(parts[part_num])
+            self.server.objects[key] = "".join(data)
+            self.respond(200, "<CompleteMultipartUploadResult><Bucket>%s</Bucket><Key>%s</Key><ETag>\"etag\"</ETag></CompleteMultipartUploadResult>" % (bucket, key))
+
+
+    def do_GET(self):
+        # List the parts of an upload.
+        query = urlparse.parse_qs(urlparse.urlparse(self.path)[4])
+        parts = self.server.uploads[query["uploadId"][0]]
+        xml = ["<ListPartsResult><IsTruncated>false</IsTruncated>"]
+        for part_num in sorted(parts.keys()):
+            xml.append("<Part><PartNumber>%d</PartNumber><ETag>\"%s\"</ETag><Size>%d</Size></Part>" % (part_num, hashlib.md5(parts[part_num]).hexdigest(), len(parts[part_num])))
+        xml.append("</ListPartsResult>")
+        self.respond(200, "".join(xml))
+
+
+    def do_PUT(self):
+        (path, query) = urlparse.urlparse(self.path)[2:5:2]
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        query = urlparse.parse_qs(query)
+        self.server.uploads[query["uploadId"][0]][int(query["partNumber"][0])] = body
+        self.respond(200, headers={"ETag" : '"%s"' % (hashlib.md5(body).hexdigest())})
+
+
+    def do_DELETE(self):
+        query = urlparse.parse_qs(urlparse.urlparse(self.path)[4])
+        self.server.uploads.pop(query["uploadId"][0], None)
+        self.respond(204)
+
+
+class S3StandIn(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0), S3StandInHandler)
+        self.uploads = {}
+        self.objects = {}
+
+
+class TestConditions(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.filename = os.path.join(self.path, "video.mp4")
+        self.data = "".join([chr(i % 251) for i in range(100000)])
+        f = open(self.filename, "wb")
+        f.write(self.data)
+        f.close()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+
+    def testSplit(self):
+        self.assertEqual([(1, 0, 4), (2, 4, 4), (3, 8, 2)], split(10, 4))
+        self.assertEqual([(1, 0, 10)], split(10, 10))
+        # Never more than MAX_PARTS parts.
+        parts = split(MAX_PARTS * 10 + 1, 1)
+        self.assertTrue(len(parts) <= MAX_PARTS)
+        self.assertEqual(MAX_PARTS * 10 + 1, sum([size for (part_num, offset, size) in parts]))
+
+
+    def testUpload(self):
+        upload = FakeUpload()
+        upload_file(self.filename, upload, 7000, 4)
+        self.assertEqual(15, len(upload.parts))
+        self.assertEqual(self.data, upload.data())
+        self.assertTrue(upload.completed)
+        self.assertFalse(upload.cancelled)
+
+
+    def testRetryPart(self):
+        # Only the parts that failed are uploaded again.
+        upload = FakeUpload({3 : 2, 7 : 1})
+        upload_file(self.filename, upload, 7000, 4, retries=2, retry_delay=0)
+        self.assertEqual(self.data, upload.data())
+        self.assertEqual(3, upload.attempts[3])
+        self.assertEqual(2, upload.attempts[7])
+        self.assertEqual(13, len([part_num for part_num in upload.attempts.keys() if upload.attempts[part_num] == 1]))
+        self.assertTrue(upload.completed)
+
+
+    def testFailedPart(self):
+        upload = FakeUpload({3 : 3})
+        self.assertRaises(MultipartUploadError, upload_file, self.filename, upload, 7000, 4, 2, 0)
+        self.assertEqual(3, upload.attempts[3])
+        self.assertFalse(upload.completed)
+        self.assertTrue(upload.cancelled)
+
+
+    def testLimiter(self):
+        # Every attempt is a request and all data it sends passes through the
+        # limiter, once (the failed attempt didn't send anything).
+        limiter = RateLimiter("cdn", 50000, 5, sleep=lambda seconds: None, clock=lambda: 1000.0)
+        upload = FakeUpload({3 : 1})
+        upload_file(self.filename, upload, 7000, 4, retry_delay=0, limiter=limiter)
+        self.assertEqual(self.data, upload.data())
+        self.assertAlmostEqual(50000 - len(self.data), limiter.bytes.tokens)
+        self.assertAlmostEqual(5 - 16, limiter.requests.tokens)
+
+
+    @unittest.skipIf(MultiPartUpload is None, "boto is not installed")
+    def testS3(self):
+        from boto.s3.connection import S3Connection, OrdinaryCallingFormat
+
+        server = S3StandIn()
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            def connect():
+                connection = S3Connection("access key id", "secret access key", host="127.0.0.1", port=server.server_address[1], is_secure=False, calling_format=OrdinaryCallingFormat())
+                return connection.get_bucket("bucket", validate=False)
+            upload = S3MultipartUpload(connect, "videos/video.mp4")
+            upload_file(self.filename, upload, 7000, 4)
+            self.assertEqual(self.data, server.objects["videos/video.mp4"])
+            self.assertEqual({}, server.uploads)
+
+            # Older versions of boto don't return the uploaded parts, then
+            # the parts are listed to complete the upload.
+            upload_part_from_file = MultiPartUpload.upload_part_from_file
+            MultiPartUpload.upload_part_from_file = lambda *args, **kwargs: upload_part_from_file(*args, **kwargs) and None
+            try:
+                upload = S3MultipartUpload(connect, "videos/video2.mp4")
+                upload_file(self.filename, upload, 7000, 4)
+            finally:
+                MultiPartUpload.upload_part_from_file = upload_part_from_file
+            self.assertEqual(self.data, server.objects["videos/video2.mp4"])
+            self.assertEqual({}, server.uploads)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    unittest.main()
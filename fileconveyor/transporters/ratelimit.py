@@ -0,0 +1,259 @@
+"""ratelimit.py Rate limiting of the transports to a server
+
+A RateLimiter limits the bandwidth (bytes/s) and the request rate
+(requests/s) of all transporters of a server, so syncing doesn't saturate an
+uplink that is shared with live traffic. Both are token buckets, which allow
+bursts of up to one second's worth of tokens. When tokens run out, a
+transporter waits until enough tokens have been added again; transporters
+that wait get their turn in the order in which they asked.
+
+Optionally, the limits only apply outside of the "full speed" hours, e.g.
+22:00-06:00, so large backfills finish fast at night.
+
+Transporters that run many transports in a single thread (see http_engine.py)
+can't wait: they reserve requests and bytes instead and hold back what the
+limits don't allow yet.
+"""
+
+
+__author__ = "Wim Leers (work@wimleers.com)"
+__version__ = "$Rev$"
+__date__ = "$Date$"
+__license__ = "GPL"
+
+
+import logging
+import threading
+import time
+
+
+def parse_hours(hours):
+    """parse time ranges such as "22:00-06:00,12:00-13:00" into a list of
+    (start, end) tuples, in minutes since midnight
+
+    Raises ValueError for invalid time ranges.
+    """
+    ranges = []
+    for time_range in hours.split(","):
+        try:
+            (start, end) = time_range.strip().split("-")
+            ranges.append((parse_time(start), parse_time(end)))
+        except ValueError:
+            raise ValueError("'%s' is not a valid time range (e.g. 22:00-06:00)." % (time_range.strip()))
+    return ranges
+
+
+def parse_time(s):
+    """parse a time such as "22:00" into minutes since midnight"""
+    (hours, minutes) = s.strip().split(":")
+    (hours, minutes) = (int(hours), int(minutes))
+    if not (0 <= hours <= 24 and 0 <= minutes < 60) or hours * 60 + minutes > 24 * 60:
+        raise ValueError
+    return hours * 60 + minutes
+
+
+def in_hours(hours, minute):
+    """whether a minute since midnight is within the parsed time ranges"""
+    for (start, end) in hours:
+        if start <= end:
+            if start <= minute < end:
+                return True
+        # Ranges that span midnight.
+        elif minute >= start or minute < end:
+            return True
+    return False
+
+
+class TokenBucket(object):
+    """tokens are added at a rate per second, up to capacity"""
+
+
+    def __init__(self, rate, capacity=None, clock=time.time):
+        self.rate     = float(rate)
+        if capacity is None:
+            capacity = max(self.rate, 1.0)
+        self.capacity = float(capacity)
+        self.tokens   = self.capacity
+        self.clock    = clock
+        self.last     = self.clock()
+        self.lock     = threading.Lock()
+
+
+    def reserve(self, amount):
+        """take a number of tokens, returns the number of seconds to wait
+        before they may be used
+
+        The tokens may go into debt, which later callers have to wait for.
+        """
+        self.lock.acquire()
+        try:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+        finally:
+            self.lock.release()
+
+
+class RateLimiter(object):
+    """limits the bandwidth and the request rate of a server, except during
+    the full speed hours
+    """
+
+
+    def __init__(self, name, bytes_per_second=0, requests_per_second=0, full_speed_hours=None, parent_logger=None, clock=time.time, sleep=time.sleep):
+        self.name             = name
+        self.full_speed_hours = full_speed_hours
+        self.clock            = clock
+        self.sleep            = sleep
+        self.lock             = threading.Lock()
+        if parent_logger is None:
+            self.logger = logging.getLogger("RateLimiter")
+        else:
+            self.logger = logging.getLogger(".".join([parent_logger, "RateLimiter"]))
+
+        self.bytes = None
+        if bytes_per_second:
+            self.bytes = TokenBucket(bytes_per_second, clock=clock)
+        self.requests = None
+        if requests_per_second:
+            self.requests = TokenBucket(requests_per_second, clock=clock)
+
+        self.full_speed     = None
+        self.throttled_time = 0.0
+        self.local          = threading.local()
+
+
+    def is_full_speed(self):
+        """whether the limits don't apply right now"""
+        if not self.full_speed_hours:
+            return False
+        now = time.localtime(self.clock())
+        full_speed = in_hours(self.full_speed_hours, now.tm_hour * 60 + now.tm_min)
+        if full_speed != self.full_speed:
+            self.full_speed = full_speed
+            if full_speed:
+                self.logger.info("Transports to server '%s' are no longer rate limited (full speed hours)." % (self.name))
+            else:
+                self.logger.info("Transports to server '%s' are rate limited again." % (self.name))
+        return full_speed
+
+
+    def __reserve(self, bucket, amount):
+        if bucket is None or self.is_full_speed():
+            return 0.0
+        wait = bucket.reserve(amount)
+        if wait > 0:
+            self.lock.acquire()
+            self.throttled_time += wait
+            self.lock.release()
+        return wait
+
+
+    def request(self):
+        """wait until a request may be sent"""
+        wait = self.reserve_request()
+        if wait > 0:
+            self.__wait(wait)
+
+
+    def transfer(self, size):
+        """wait until size bytes may be transferred"""
+        wait = self.reserve_transfer(size)
+        if wait > 0:
+            self.__wait(wait)
+
+
+    def __wait(self, seconds):
+        self.local.waited = self.get_waited() + seconds
+        self.sleep(seconds)
+
+
+    def get_waited(self):
+        """the number of seconds the calling thread has waited for the
+        limits
+        """
+        return getattr(self.local, "waited", 0.0)
+
+
+    def reserve_request(self):
+        """reserve a request without waiting, returns the number of seconds
+        to wait before it may be sent
+        """
+        return self.__reserve(self.requests, 1)
+
+
+    def reserve_transfer(self, size):
+        """reserve size bytes without waiting, returns the number of seconds
+        to wait before they may be transferred
+        """
+        if size <= 0:
+            return 0.0
+        return self.__reserve(self.bytes, size)
+
+
+    def wrap(self, f):
+        """wrap a file so that reading from it is rate limited"""
+        if self.bytes is None:
+            return f
+        return ThrottledFile(f, self)
+
+
+    def get_stats(self):
+        self.lock.acquire()
+        stats = {
+            "throttled_time" : self.throttled_time,
+        }
+        self.lock.release()
+        return stats
+
+
+class ThrottledFile(object):
+    """a file whose reads are rate limited by a RateLimiter
+
+    Every byte is charged once, when it's read for the first time: storages
+    may read a file twice, e.g. boto reads it to calculate its MD5 hash, then
+    seeks back to send it.
+    """
+
+
+    def __init__(self, f, limiter):
+        self.file    = f
+        self.limiter = limiter
+        # The offset up to which the file has been charged.
+        self.charged = 0
+
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+    def __iter__(self):
+        return iter(self.readline, "")
+
+
+    def read(self, size=-1):
+        offset = self.file.tell()
+        data = self.file.read(size)
+        self.__charge(offset, len(data))
+        return data
+
+
+    def readline(self, size=-1):
+        offset = self.file.tell()
+        data = self.file.readline(size)
+        self.__charge(offset, len(data))
+        return data
+
+
+    def __charge(self, offset, size):
+        """charge the bytes that were read at offset, unless they have been
+        read before
+        """
+        end = offset + size
+        if end > self.charged:
+            self.limiter.transfer(end - max(offset, self.charged))
+            self.charged = end
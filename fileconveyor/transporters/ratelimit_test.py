@@ -0,0 +1,134 @@
+"""Unit test for ratelimit.py"""
+
+
+__author__ = "Wim Leers (work@wimleers.com)"
+__version__ = "$Rev$"
+__date__ = "$Date$"
+__license__ = "GPL"
+
+
+from ratelimit import *
+import StringIO
+import threading
+import time
+import unittest
+
+
+class FakeClock(object):
+    """a clock that only advances by sleeping"""
+
+
+    def __init__(self, now):
+        self.now = now
+
+
+    def __call__(self):
+        return self.now
+
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestConditions(unittest.TestCase):
+    def setUp(self):
+        # Noon, local time.
+        self.clock = FakeClock(time.mktime((2012, 10, 24, 12, 0, 0, 0, 0, -1)))
+
+
+    def testParseHours(self):
+        self.assertEqual([(22 * 60, 6 * 60)], parse_hours("22:00-06:00"))
+        self.assertEqual([(0, 7 * 60 + 30), (12 * 60, 13 * 60)], parse_hours("0:00-7:30, 12:00-13:00"))
+        self.assertEqual([(18 * 60, 24 * 60)], parse_hours("18:00-24:00"))
+        for hours in ("22:00", "22-06", "25:00-06:00", "22:00-06:60", "night"):
+            self.assertRaises(ValueError, parse_hours, hours)
+
+
+    def testInHours(self):
+        hours = parse_hours("22:00-06:00,12:00-13:00")
+        self.assertTrue(in_hours(hours, 23 * 60))
+        self.assertTrue(in_hours(hours, 5 * 60 + 59))
+        self.assertTrue(in_hours(hours, 12 * 60 + 30))
+        self.assertFalse(in_hours(hours, 6 * 60))
+        self.assertFalse(in_hours(hours, 13 * 60))
+
+
+    def testBandwidth(self):
+        limiter = RateLimiter("cdn", bytes_per_second=1000, clock=self.clock, sleep=self.clock.sleep)
+        f = limiter.wrap(StringIO.StringIO("x" * 10000))
+        start = self.clock.now
+        # A burst of one second's worth of bytes is allowed.
+        self.assertEqual(1000, len(f.read(1000)))
+        self.assertEqual(start, self.clock.now)
+        # After that, 1000 bytes per second.
+        while f.read(500):
+            pass
+        self.assertAlmostEqual(9.0, self.clock.now - start)
+        self.assertAlmostEqual(9.0, limiter.get_stats()["throttled_time"])
+
+
+    def testReadTwice(self):
+        # A file that is read, rewound and read again (e.g. by boto, to
+        # calculate its MD5 hash first) is only charged once.
+        limiter = RateLimiter("cdn", bytes_per_second=1000, clock=self.clock, sleep=self.clock.sleep)
+        f = limiter.wrap(StringIO.StringIO("x" * 10000))
+        start = self.clock.now
+        self.assertEqual(10000, len(f.read()))
+        f.seek(0)
+        while f.read(500):
+            pass
+        f.seek(5000)
+        self.assertEqual(5000, len(f.readline()))
+        self.assertAlmostEqual(9.0, self.clock.now - start)
+        self.assertAlmostEqual(9.0, limiter.get_stats()["throttled_time"])
+
+
+    def testRequests(self):
+        limiter = RateLimiter("cdn", requests_per_second=10, clock=self.clock, sleep=self.clock.sleep)
+        start = self.clock.now
+        for i in range(30):
+            limiter.request()
+        self.assertAlmostEqual(2.0, self.clock.now - start)
+        # Every thread knows how long it has waited.
+        self.assertAlmostEqual(2.0, limiter.get_waited())
+        waited = []
+        thread = threading.Thread(target=lambda: waited.append(limiter.get_waited()))
+        thread.start()
+        thread.join()
+        self.assertEqual([0.0], waited)
+        # Without a bandwidth limit, files are not wrapped.
+        f = StringIO.StringIO("x")
+        self.assertTrue(limiter.wrap(f) is f)
+
+
+    def testReserve(self):
+        # Reserving never waits, it says how long to wait.
+        limiter = RateLimiter("cdn", 1000, 10, clock=self.clock, sleep=self.clock.sleep)
+        start = self.clock.now
+        for i in range(10):
+            self.assertEqual(0.0, limiter.reserve_request())
+        self.assertAlmostEqual(0.1, limiter.reserve_request())
+        self.assertAlmostEqual(0.2, limiter.reserve_request())
+        self.assertEqual(0.0, limiter.reserve_transfer(1000))
+        self.assertAlmostEqual(0.5, limiter.reserve_transfer(500))
+        self.assertEqual(start, self.clock.now)
+        self.assertAlmostEqual(0.8, limiter.get_stats()["throttled_time"])
+
+
+    def testFullSpeedHours(self):
+        limiter = RateLimiter("cdn", 1000, 10, parse_hours("11:00-13:00"), clock=self.clock, sleep=self.clock.sleep)
+        start = self.clock.now
+        for i in range(30):
+            limiter.request()
+            limiter.transfer(1000)
+        self.assertEqual(start, self.clock.now)
+        # Limited again after the full speed hours.
+        self.clock.now += 2 * 3600
+        start = self.clock.now
+        for i in range(3):
+            limiter.transfer(1000)
+        self.assertAlmostEqual(2.0, self.clock.now - start)
+
+
+if __name__ == "__main__":
+    unittest.main()
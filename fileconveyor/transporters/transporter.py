@@ -22,8 +22,8 @@ class InvalidActionError(TransporterError): pass
 
 import threading
 import Queue
-import time
 import os.path
+import time
 import logging
 from sets import Set, ImmutableSet
 
@@ -37,6 +37,15 @@ class Transporter(threading.Thread):
         "DELETE"     : 0x00000002,
     }
 
+    # Whether the storage's _save() overwrites an existing file. If so, files
+    # are saved without checking whether they exist and deleting them first.
+    supports_overwrite = False
+
+    # Whether delete_batch() deletes several files with a single request, and
+    # how many files at most.
+    supports_batch_delete = False
+    batch_delete_size     = 1000
+
 
     def __init__(self, settings, callback, error_callback, parent_logger):
         if not callable(callback):
@@ -47,11 +56,22 @@ class Transporter(threading.Thread):
         self.settings       = settings
         self.storage        = None
         self.lock           = threading.Lock()
-        self.queue          = Queue.Queue()
+        self.queue          = Queue.Queue() # May be shared by several transporters.
         self.callback       = callback
         self.error_callback = error_callback
         self.logger         = logging.getLogger(".".join([parent_logger, "Transporter"]))
         self.die            = False
+        self.busy           = False
+        self.last_used      = time.time()
+        self.last_keepalive = time.time()
+        # Seconds between keepalives while idle, None disables them.
+        self.keepalive_interval = None
+        # The AIMDController of the server, if any.
+        self.controller     = None
+        # The RateLimiter of the server, if any.
+        self.limiter        = None
+        # The TransporterPool this transporter belongs to, if any.
+        self.pool           = None
 
         # Validate settings.
         self.validate_settings()
@@ -61,53 +81,221 @@ class Transporter(threading.Thread):
 
     def run(self):
         while not self.die:
-            # Sleep a little bit if there's no work.
-            if self.queue.qsize() == 0:
-                time.sleep(0.5)
+            # Only take a file when the pool's window allows another transport
+            # to the server, so a smaller window immediately means fewer
+            # simultaneous transports.
+            if self.pool is not None and not self.pool.acquire_slot(timeout=0.5):
+                continue
+            try:
+                self.__run_once()
+            finally:
+                if self.pool is not None:
+                    self.pool.release_slot()
+
+
+    def __run_once(self):
+        """transport the next file (or batch of files) from the queue"""
+        # Wait for work, but wake up regularly to notice stop().
+        try:
+            item = self.queue.get(timeout=0.5)
+        except Queue.Empty:
+            self.__keepalive()
+            return
+        if item is None:
+            # Woken up by stop().
+            return
+        self.busy = True
+        start = time.time()
+        if self.limiter is not None:
+            waited = self.limiter.get_waited()
+        if isinstance(item, list):
+            success = self.__delete_batch(item)
+            size = 0
+        else:
+            success = self.__sync(*item)
+            size = self.__get_size(item)
+        if self.controller is not None:
+            # Waiting for the rate limits isn't latency of the server.
+            duration = time.time() - start
+            if self.limiter is not None:
+                duration -= self.limiter.get_waited() - waited
+            self.controller.record(success, duration, size)
+        self.busy = False
+        self.last_used = self.last_keepalive = time.time()
+
+
+    def __get_size(self, item):
+        """the number of bytes transported for a file"""
+        (src, dst, action, callback, error_callback, exists) = item
+        if action != Transporter.ADD_MODIFY:
+            return 0
+        try:
+            return os.path.getsize(src)
+        except OSError:
+            return 0
+
+
+    def __keepalive(self):
+        """keep the connection alive while idle"""
+        if self.keepalive_interval is None or time.time() - self.last_keepalive < self.keepalive_interval:
+            return
+        self.last_keepalive = time.time()
+        try:
+            self.keepalive()
+        except Exception, e:
+            # The storage reconnects when it transports the next file.
+            self.logger.warning("The transporter '%s' has lost its connection, it will reconnect. Error: '%s'." % (self.name, e))
+
+
+    def get_idle_slots(self):
+        """the number of files that could be transported right away
+
+        Transporters that transport several files simultaneously override
+        this.
+        """
+        if self.busy:
+            return 0
+        return 1
+
+
+    def keepalive(self):
+        """check that the connection is alive and reconnect if it's not
+
+        Transporters that keep a connection open override this.
+        """
+        pass
+
+
+    def __sync(self, src, dst, action, callback, error_callback, exists):
+        self.logger.debug("Running the transporter '%s' to sync '%s'." % (self.name, src))
+        try:
+            if self.limiter is not None:
+                self.limiter.request()
+            # Sync the file: either add/modify it, or delete it.
+            if action == Transporter.ADD_MODIFY:
+                # Sync the file, reading it no faster than the bandwidth limit
+                # of the server.
+                fp = open(src, "rb")
+                if self.limiter is not None:
+                    fp = self.limiter.wrap(fp)
+                f = File(fp)
+                try:
+                    self.save(dst, f, exists)
+                finally:
+                    f.close()
+                # Calculate the URL.
+                url = self.storage.url(dst)
+                url = self.alter_url(url)
             else:
-                self.lock.acquire()
-                (src, dst, action, callback, error_callback) = self.queue.get()
-                self.lock.release()
+                self.delete(dst, exists)
+                url = None
 
-                self.logger.debug("Running the transporter '%s' to sync '%s'." % (self.name, src))
-                try:
-                    # Sync the file: either add/modify it, or delete it.
-                    if action == Transporter.ADD_MODIFY:
-                        # Sync the file.
-                        f = File(open(src, "rb"))
-                        if self.storage.exists(dst):
-                            self.storage.delete(dst)
-                        self.storage.save(dst, f)
-                        f.close()
-                        # Calculate the URL.
-                        url = self.storage.url(dst)
-                        url = self.alter_url(url)
-                    else:
-                        if self.storage.exists(dst):
-                            self.storage.delete(dst)
-                        url = None
-
-                    self.logger.debug("The transporter '%s' has synced '%s'." % (self.name, src))
-
-                    # Call the callback function. Use the callback function
-                    # defined for this Transporter (self.callback), unless
-                    # an alternative one was defined for this file (callback).
-                    if not callback is None:
-                        callback(src, dst, url, action)
-                    else:
-                        self.callback(src, dst, url, action)
-
-                except Exception, e:
-                    self.logger.error("The transporter '%s' has failed while transporting the file '%s' (action: %d). Error: '%s'." % (self.name, src, action, e))
-
-                    # Call the error_callback function. Use the error_callback
-                    # function defined for this Transporter
-                    # (self.error_callback), unless an alternative one was
-                    # defined for this file (error_callback).
-                    if not callback is None:
-                        error_callback(src, dst, action)
-                    else:
-                        self.error_callback(src, dst, action)
+            self.logger.debug("The transporter '%s' has synced '%s'." % (self.name, src))
+
+            # Call the callback function. Use the callback function
+            # defined for this Transporter (self.callback), unless
+            # an alternative one was defined for this file (callback).
+            if not callback is None:
+                callback(src, dst, url, action)
+            else:
+                self.callback(src, dst, url, action)
+            return True
+
+        except Exception, e:
+            self.logger.error("The transporter '%s' has failed while transporting the file '%s' (action: %d). Error: '%s'." % (self.name, src, action, e))
+
+            # Call the error_callback function. Use the error_callback
+            # function defined for this Transporter
+            # (self.error_callback), unless an alternative one was
+            # defined for this file (error_callback).
+            if not callback is None:
+                error_callback(src, dst, action)
+            else:
+                self.error_callback(src, dst, action)
+            return False
+
+
+    def __delete_batch(self, items):
+        """delete a batch of files, then call the callback of every file,
+        returns whether any file was deleted
+        """
+        self.logger.debug("Running the transporter '%s' to delete a batch of %d files." % (self.name, len(items)))
+        dsts = [dst for (src, dst, action, callback, error_callback, exists) in items]
+        try:
+            if self.limiter is not None:
+                self.limiter.request()
+            failed = Set(self.delete_batch(dsts))
+        except Exception, e:
+            self.logger.error("The transporter '%s' has failed while deleting a batch of %d files. Error: '%s'." % (self.name, len(items), e))
+            failed = Set(dsts)
+
+        for (src, dst, action, callback, error_callback, exists) in items:
+            if not dst in failed:
+                self.logger.debug("The transporter '%s' has synced '%s'." % (self.name, src))
+                if not callback is None:
+                    callback(src, dst, None, action)
+                else:
+                    self.callback(src, dst, None, action)
+            else:
+                self.logger.error("The transporter '%s' has failed while transporting the file '%s' (action: %d)." % (self.name, src, action))
+                if not error_callback is None:
+                    error_callback(src, dst, action)
+                else:
+                    self.error_callback(src, dst, action)
+        return len(failed) < len(items)
+
+
+    def save(self, dst, f, exists=None):
+        """save a file, overwriting dst if it exists
+
+        exists tells whether dst is known to exist (True or False) or not
+        (None). Storages that overwrite files don't need to know this.
+        """
+        if self.__class__.supports_overwrite:
+            self.storage._save(dst, f)
+            return
+        if exists or (exists is None and self.storage.exists(dst)):
+            self.storage.delete(dst)
+        name = self.storage.save(dst, f)
+        if name != dst.replace("\\", "/"):
+            # dst existed after all, so the storage picked another name.
+            self.logger.warning("The transporter '%s' has found '%s', which it did not expect to exist, overwriting it." % (self.name, dst))
+            self.storage.delete(name)
+            self.storage.delete(dst)
+            f.seek(0)
+            self.storage.save(dst, f)
+
+
+    def delete(self, dst, exists=None):
+        """delete dst if it exists
+
+        exists tells whether dst is known to exist (True or False) or not
+        (None).
+        """
+        if exists is None:
+            exists = self.storage.exists(dst)
+        if not exists:
+            return
+        try:
+            self.storage.delete(dst)
+        except Exception:
+            # Only fail if dst still exists.
+            if self.storage.exists(dst):
+                raise
+
+
+    def delete_batch(self, dsts):
+        """delete several files, returns the ones that could not be deleted
+
+        Transporters that support batch deletes override this.
+        """
+        failed = []
+        for dst in dsts:
+            try:
+                self.delete(dst)
+            except Exception:
+                failed.append(dst)
+        return failed
 
 
     def alter_url(self, url):
@@ -119,6 +307,8 @@ class Transporter(threading.Thread):
         self.lock.acquire()
         self.die = True
         self.lock.release()
+        # Wake up run().
+        self.queue.put(None)
 
 
     def validate_settings(self):
@@ -135,7 +325,7 @@ class Transporter(threading.Thread):
             raise MissingSettingError
 
 
-    def sync_file(self, src, dst=None, action=None, callback=None, error_callback=None):
+    def sync_file(self, src, dst=None, action=None, callback=None, error_callback=None, exists=None):
         # Set the default value here because Python won't allow it sooner.
         if dst is None:
             dst = src
@@ -149,7 +339,23 @@ class Transporter(threading.Thread):
             dst = dst[1:]
 
         self.lock.acquire()
-        self.queue.put((src, dst, action, callback, error_callback))
+        self.queue.put((src, dst, action, callback, error_callback, exists))
+        self.lock.release()
+
+
+    def delete_files(self, files):
+        """queue a batch of files to be deleted, as (src, dst, callback,
+        error_callback, exists) tuples
+        """
+        items = []
+        for (src, dst, callback, error_callback, exists) in files:
+            # If dst is relative to the root, strip the leading slash.
+            if dst.startswith("/"):
+                dst = dst[1:]
+            items.append((src, dst, Transporter.DELETE, callback, error_callback, exists))
+
+        self.lock.acquire()
+        self.queue.put(items)
         self.lock.release()
 
 
@@ -160,6 +366,164 @@ class Transporter(threading.Thread):
         return qsize
 
 
+class TransporterPool(object):
+    """a pool of transporters for a server, which take files from one shared
+    queue; transporters are started on demand and stopped when idle
+    """
+
+
+    def __init__(self, create, max_transporters=0, idle_timeout=300, keepalive_interval=60, controller=None, limiter=None):
+        self.create             = create
+        self.max_transporters   = max_transporters
+        self.controller         = controller
+        self.limiter            = limiter
+        self.idle_timeout       = idle_timeout
+        self.keepalive_interval = keepalive_interval
+        self.queue              = Queue.Queue()
+        self.transporters       = []
+        self.lock               = threading.Lock()
+        self.slot_freed         = threading.Condition(self.lock)
+        # Transports in progress (or transporters waiting for a file).
+        self.active             = 0
+        # Connections that transporters use in addition to their own.
+        self.extra_connections  = 0
+
+
+    def __len__(self):
+        return len(self.transporters)
+
+
+    def add(self, transporter):
+        """start a transporter that has been created already"""
+        transporter.queue = self.queue
+        transporter.keepalive_interval = self.keepalive_interval
+        transporter.controller = self.controller
+        transporter.limiter = self.limiter
+        transporter.pool = self
+        self.transporters.append(transporter)
+        transporter.start()
+
+
+    def get_limit(self):
+        """the maximum number of transporters (0 means unlimited), which is
+        the window of the controller if there is one
+        """
+        if self.controller is not None:
+            return self.controller.window
+        return self.max_transporters
+
+
+    def acquire_connections(self, count):
+        """reserve at most count connections for a transporter, in addition
+        to its own (e.g. for the parts of a multipart upload), returns the
+        number of connections reserved
+
+        Every transporter and every reserved connection counts towards the
+        limit.
+        """
+        self.lock.acquire()
+        limit = self.get_limit()
+        if limit != 0:
+            count = max(0, min(count, limit - len(self.transporters) - self.extra_connections))
+        self.extra_connections += count
+        self.lock.release()
+        return count
+
+
+    def release_connections(self, count):
+        """release connections reserved with acquire_connections()"""
+        self.lock.acquire()
+        self.extra_connections -= count
+        self.slot_freed.notify_all()
+        self.lock.release()
+
+
+    def __has_free_slot(self):
+        limit = self.get_limit()
+        return limit == 0 or self.active + self.extra_connections < limit
+
+
+    def acquire_slot(self, timeout):
+        """wait at most timeout seconds for a slot to transport a file, i.e.
+        until fewer transports are in progress than the limit allows, returns
+        whether a slot was taken
+        """
+        self.lock.acquire()
+        try:
+            if not self.__has_free_slot():
+                # The window may also grow meanwhile, hence the timeout.
+                self.slot_freed.wait(timeout)
+                if not self.__has_free_slot():
+                    return False
+            self.active += 1
+            return True
+        finally:
+            self.lock.release()
+
+
+    def release_slot(self):
+        """release a slot taken with acquire_slot()"""
+        self.lock.acquire()
+        self.active -= 1
+        self.slot_freed.notify()
+        self.lock.release()
+
+
+    def start_transporter(self):
+        """start a new transporter, if allowed, returns it"""
+        limit = self.get_limit()
+        if limit != 0 and len(self.transporters) + self.extra_connections >= limit:
+            return None
+        transporter = self.create()
+        if not transporter:
+            return None
+        self.add(transporter)
+        return transporter
+
+
+    def get_transporter(self):
+        """get a transporter that is running"""
+        return self.transporters[0]
+
+
+    def idle(self):
+        """the number of files the transporters could transport right away"""
+        return sum([transporter.get_idle_slots() for transporter in self.transporters])
+
+
+    def qsize(self):
+        return self.queue.qsize()
+
+
+    def reap(self, minimum=1):
+        """stop the transporters that have been idle for too long or that
+        exceed the limit, but keep at least a minimum number running, returns
+        the number stopped
+        """
+        now = time.time()
+        reaped = 0
+        for transporter in list(self.transporters):
+            if len(self.transporters) <= minimum:
+                break
+            limit = self.get_limit()
+            too_many = limit != 0 and len(self.transporters) + self.extra_connections > limit
+            idle_too_long = self.queue.qsize() == 0 and now - transporter.last_used > self.idle_timeout
+            if not transporter.busy and (too_many or idle_too_long):
+                self.transporters.remove(transporter)
+                transporter.stop()
+                reaped += 1
+        return reaped
+
+
+    def stop(self):
+        """stop all transporters and wait for them to end"""
+        for transporter in self.transporters:
+            transporter.stop()
+        for transporter in self.transporters:
+            transporter.join()
+        self.transporters = []
+
+
 # Make EVENTS' members directly accessible through the class dictionary.
 for name, mask in Transporter.ACTIONS.iteritems():
     setattr(Transporter, name, mask)
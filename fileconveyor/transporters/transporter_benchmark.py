@@ -0,0 +1,159 @@
+"""transporter_benchmark.py Benchmark for the round trips of transporters
+
+Syncs files through a transporter whose storage is a local directory that
+injects latency in every storage operation, as a stand-in for a remote
+storage. A part of the files has been synced before, i.e. they exist in the
+storage already. Compares syncing without knowing whether files exist (as
+before), with the hint from the synced files DB, and with a storage that
+overwrites files.
+
+Usage: python transporter_benchmark.py [--files=200] [--latency=10]
+    [--synced=0.5]
+"""
+
+
+__author__ = "Wim Leers (work@wimleers.com)"
+__version__ = "$Rev$"
+__date__ = "$Date$"
+__license__ = "GPL"
+
+
+from transporter import *
+from django.conf import settings
+if not settings.configured:
+    settings.configure()
+from django.core.files.storage import FileSystemStorage
+import optparse
+import os
+import shutil
+import tempfile
+import time
+
+
+class LatencyStorage(FileSystemStorage):
+    """a local storage that sleeps for every round trip to the storage"""
+
+
+    def __init__(self, location, base_url, latency):
+        FileSystemStorage.__init__(self, location, base_url)
+        self.latency     = latency
+        self.round_trips = 0
+
+
+    def round_trip(self):
+        self.round_trips += 1
+        time.sleep(self.latency)
+
+
+    def exists(self, name):
+        self.round_trip()
+        return FileSystemStorage.exists(self, name)
+
+
+    def delete(self, name):
+        self.round_trip()
+        return FileSystemStorage.delete(self, name)
+
+
+    def _save(self, name, content):
+        self.round_trip()
+        return FileSystemStorage._save(self, name, content)
+
+
+class OverwritingLatencyStorage(LatencyStorage):
+    """a LatencyStorage whose _save() overwrites existing files"""
+
+
+    def _save(self, name, content):
+        if os.path.exists(self.path(name)):
+            os.remove(self.path(name))
+        return LatencyStorage._save(self, name, content)
+
+
+class TransporterBenchmark(Transporter):
+
+
+    name              = 'BENCHMARK'
+    valid_settings    = ImmutableSet(["location", "url", "latency"])
+    required_settings = ImmutableSet(["location", "url", "latency"])
+    storage_class     = LatencyStorage
+
+
+    def __init__(self, settings, callback, error_callback, parent_logger=None):
+        Transporter.__init__(self, settings, callback, error_callback, parent_logger)
+        self.storage = self.__class__.storage_class(self.settings["location"], self.settings["url"], self.settings["latency"])
+
+
+class TransporterBenchmarkOverwrite(TransporterBenchmark):
+
+
+    supports_overwrite = True
+    storage_class      = OverwritingLatencyStorage
+
+
+def benchmark(transporter_class, files, synced, location, latency, use_hint):
+    """sync all files, returns the duration and the number of round trips"""
+    # Files that have been synced before exist in the storage already.
+    if os.path.exists(location):
+        shutil.rmtree(location)
+    os.makedirs(location)
+    for filename in synced:
+        shutil.copyfile(filename, os.path.join(location, os.path.basename(filename)))
+
+    done = threading.Semaphore(0)
+    def callback(src, dst, url, action):
+        done.release()
+    def error_callback(src, dst, action):
+        print "Failed to sync '%s'." % (src)
+        done.release()
+
+    settings = {"location" : location, "url" : "http://cdn.example.com/", "latency" : latency}
+    transporter = transporter_class(settings, callback, error_callback, "TransporterBenchmark")
+    transporter.start()
+    start = time.time()
+    for filename in files:
+        exists = None
+        if use_hint:
+            exists = filename in synced
+        transporter.sync_file(filename, os.path.basename(filename), Transporter.ADD_MODIFY, None, None, exists)
+    for filename in files:
+        done.acquire()
+    duration = time.time() - start
+    transporter.stop()
+    transporter.join()
+    return (duration, transporter.storage.round_trips)
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option("--files", type="int", default=200, help="number of files to sync")
+    parser.add_option("--latency", type="float", default=10.0, help="latency of a round trip to the storage, in ms")
+    parser.add_option("--synced", type="float", default=0.5, help="fraction of the files that has been synced before")
+    (options, args) = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        source_dir = os.path.join(tmp_dir, "source")
+        os.makedirs(source_dir)
+        files = []
+        for i in range(options.files):
+            filename = os.path.join(source_dir, "file%d.txt" % (i))
+            f = open(filename, "w")
+            f.write("file %d\n" % (i) * 100)
+            f.close()
+            files.append(filename)
+        synced = set(files[:int(options.files * options.synced)])
+
+        location = os.path.join(tmp_dir, "storage")
+        latency = options.latency / 1000
+        results = []
+        results.append(("exists() and delete() (before)",) + benchmark(TransporterBenchmark, files, synced, location, latency, False))
+        results.append(("synced files DB hint",) + benchmark(TransporterBenchmark, files, synced, location, latency, True))
+        results.append(("overwrite",) + benchmark(TransporterBenchmarkOverwrite, files, synced, location, latency, True))
+
+        print "%d files (%d synced before), %.1f ms latency per round trip:" % (options.files, len(synced), options.latency)
+        for (name, duration, round_trips) in results:
+            print "%-32s %10.1f ms per file %6.2f round trips per file" % (name, 1000 * duration / options.files, float(round_trips) / options.files)
+    finally:
+        shutil.rmtree(tmp_dir)
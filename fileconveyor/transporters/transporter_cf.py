@@ -9,7 +9,7 @@ class TransporterCF(TransporterS3):
 
 
     name              = 'CF'
-    valid_settings    = ImmutableSet(["access_key_id", "secret_access_key", "bucket_name", "distro_domain_name", "bucket_prefix"])
+    valid_settings    = ImmutableSet(["access_key_id", "secret_access_key", "bucket_name", "distro_domain_name", "bucket_prefix", "multipart_threshold", "multipart_part_size", "multipart_connections"])
     required_settings = ImmutableSet(["access_key_id", "secret_access_key", "bucket_name", "distro_domain_name"])
 
 
@@ -10,6 +10,7 @@ class TransporterCloudFiles(Transporter):
     name              = 'Cloud Files'
     valid_settings    = ImmutableSet(["username", "api_key", "container"])
     required_settings = ImmutableSet(["username", "api_key", "container"])
+    supports_overwrite = True
 
 
     def __init__(self, settings, callback, error_callback, parent_logger=None):
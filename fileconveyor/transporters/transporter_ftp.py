@@ -11,6 +11,7 @@ class TransporterFTP(Transporter):
     name              = 'FTP'
     valid_settings    = ImmutableSet(["host", "username", "password", "url", "port", "path"])
     required_settings = ImmutableSet(["host", "username", "password", "url"])
+    supports_overwrite = True
 
 
     def __init__(self, settings, callback, error_callback, parent_logger=None):
@@ -30,3 +31,8 @@ class TransporterFTP(Transporter):
             self.storage._start_connection()
         except Exception, e:            
             raise ConnectionError(e)
+
+
+    def keepalive(self):
+        # Checks the connection and reconnects if it has been closed.
+        self.storage._start_connection()
@@ -0,0 +1,186 @@
+from transporter import *
+from http_engine import HTTPEngine, Request
+import base64
+import mimetypes
+import urllib
+import urlparse
+
+
+TRANSPORTER_CLASS = "TransporterHTTP"
+
+
+class TransporterHTTP(Transporter):
+    """transports files with HTTP PUT and DELETE requests, e.g. to a WebDAV
+    server; many files are in flight at the same time, in a single thread
+    """
+
+
+    name              = 'HTTP'
+    valid_settings    = ImmutableSet(["upload_url", "url", "username", "password", "connections", "timeout"])
+    required_settings = ImmutableSet(["upload_url", "url"])
+    supports_overwrite = True
+
+
+    def __init__(self, settings, callback, error_callback, parent_logger=None):
+        Transporter.__init__(self, settings, callback, error_callback, parent_logger)
+
+        # Fill out defaults if necessary.
+        configured_settings = Set(self.settings.keys())
+        if not "connections" in configured_settings:
+            self.settings["connections"] = 8
+        if not "timeout" in configured_settings:
+            self.settings["timeout"] = 60
+
+        # Files are uploaded to upload_url, over at most "connections"
+        # persistent connections. Only plain HTTP is supported.
+        upload_url = urlparse.urlsplit(self.settings["upload_url"])
+        if upload_url.scheme != "http" or not upload_url.hostname:
+            raise InvalidSettingError("upload_url must be an http:// URL.")
+        self.path = urllib.quote(upload_url.path.encode('utf-8'))
+        if not self.path.endswith("/"):
+            self.path += "/"
+        self.headers = {}
+        if "username" in configured_settings:
+            credentials = "%s:%s" % (self.settings["username"], self.settings.get("password", ""))
+            self.headers["Authorization"] = "Basic " + base64.b64encode(credentials.encode('utf-8'))
+        # Settings are unicode, but requests are sent as bytes.
+        host = upload_url.hostname.encode('idna')
+        self.engine = HTTPEngine(host, upload_url.port or 80, int(self.settings["connections"]), int(self.settings["timeout"]), self.logger.name)
+
+        # Test the connection, which is then kept open for the first file.
+        result = []
+        self.engine.submit(Request("OPTIONS", self.path, self.headers, callback=lambda response, error: result.append((response, error))))
+        while not result:
+            self.engine.poll()
+        (response, error) = result[0]
+        if error is None and response.status in (401, 403):
+            error = "%d %s" % (response.status, response.reason)
+        if error is not None:
+            raise ConnectionError(error)
+
+
+    def run(self):
+        # Take as many files from the queue as there are free connections,
+        # then run the engine's event loop to transport them. The AIMD
+        # controller doesn't apply: the engine's connections are the
+        # concurrency. The engine applies the rate limits without waiting for
+        # them, so the event loop is never blocked.
+        self.engine.limiter = self.limiter
+        while not self.die or self.engine.in_flight() > 0:
+            while not self.die and self.engine.free_slots() > 0:
+                try:
+                    if self.engine.in_flight() > 0:
+                        item = self.queue.get_nowait()
+                    else:
+                        item = self.queue.get(timeout=0.5)
+                except Queue.Empty:
+                    break
+                if item is None:
+                    # Woken up by stop().
+                    continue
+                self.busy = True
+                if isinstance(item, list):
+                    for (src, dst, action, callback, error_callback, exists) in item:
+                        self.__start(src, dst, action, callback, error_callback)
+                else:
+                    (src, dst, action, callback, error_callback, exists) = item
+                    self.__start(src, dst, action, callback, error_callback)
+            self.engine.poll()
+            self.busy = self.engine.in_flight() > 0
+        self.engine.close()
+
+
+    def get_idle_slots(self):
+        return self.engine.free_slots()
+
+
+    def __start(self, src, dst, action, callback, error_callback):
+        """start transporting a file"""
+        self.logger.debug("Running the transporter '%s' to sync '%s'." % (self.name, src))
+        transport = (src, dst, action, callback, error_callback)
+        if isinstance(dst, unicode):
+            dst = dst.encode('utf-8')
+        path = self.path + urllib.quote(dst)
+
+        if action == Transporter.DELETE:
+            self.engine.submit(Request("DELETE", path, self.headers, callback=lambda response, error: self.__finish(transport, None, response, error)))
+            return
+
+        try:
+            f = open(src, "rb")
+            size = os.path.getsize(src)
+        except (IOError, OSError), e:
+            self.__finish(transport, None, None, e)
+            return
+        headers = self.headers.copy()
+        headers["Content-Type"] = mimetypes.guess_type(dst)[0] or "application/octet-stream"
+        self.__put(transport, path, f, size, headers, False)
+
+
+    def __put(self, transport, path, f, size, headers, created_collections):
+        def done(response, error):
+            # WebDAV servers refuse files in collections (directories) that
+            # don't exist: create them, then try again.
+            if error is None and response.status == 409 and not created_collections:
+                def created(error):
+                    if error is None:
+                        self.__put(transport, path, f, size, headers, True)
+                    else:
+                        self.__finish(transport, f, None, error)
+                self.__create_collections(path, created)
+            else:
+                self.__finish(transport, f, response, error)
+        self.engine.submit(Request("PUT", path, headers, f, size, done))
+
+
+    def __create_collections(self, path, callback):
+        """create the collections that contain path, one after another"""
+        collections = []
+        offset = len(self.path)
+        while path.find("/", offset) != -1:
+            offset = path.find("/", offset) + 1
+            collections.append(path[:offset])
+
+        def create(response, error):
+            # 405 means that the collection exists already.
+            if error is None and response is not None and not response.status in (201, 405):
+                error = "MKCOL: %d %s" % (response.status, response.reason)
+            if error is not None or not collections:
+                callback(error)
+            else:
+                self.engine.submit(Request("MKCOL", collections.pop(0), self.headers, callback=create))
+        create(None, None)
+
+
+    def __finish(self, transport, f, response, error):
+        """call the callback or the error callback of a transport"""
+        (src, dst, action, callback, error_callback) = transport
+        if f is not None:
+            f.close()
+        self.last_used = time.time()
+        # A file that doesn't exist doesn't have to be deleted.
+        if error is None and not (200 <= response.status < 300 or (action == Transporter.DELETE and response.status == 404)):
+            error = "%d %s" % (response.status, response.reason)
+
+        if error is None:
+            url = None
+            if action == Transporter.ADD_MODIFY:
+                name = dst
+                if isinstance(name, unicode):
+                    name = name.encode('utf-8')
+                url = urlparse.urljoin(self.settings["url"], urllib.quote(name))
+            self.logger.debug("The transporter '%s' has synced '%s'." % (self.name, src))
+            try:
+                if not callback is None:
+                    callback(src, dst, url, action)
+                else:
+                    self.callback(src, dst, url, action)
+                return
+            except Exception, e:
+                error = e
+
+        self.logger.error("The transporter '%s' has failed while transporting the file '%s' (action: %d). Error: '%s'." % (self.name, src, action, error))
+        if not error_callback is None:
+            error_callback(src, dst, action)
+        else:
+            self.error_callback(src, dst, action)
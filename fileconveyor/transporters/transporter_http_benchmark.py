@@ -0,0 +1,142 @@
+"""transporter_http_benchmark.py Benchmark for the HTTP transporter
+
+Uploads files to a local WebDAV stand-in that injects latency in every
+upload, as a stand-in for a remote destination with a high latency. It runs
+in its own process, so it doesn't compete with the engines for the GIL.
+Compares
+the thread engine (a pool of transporters, each a thread with a blocking
+connection) with the event engine of the HTTP transporter (one thread with
+a pool of connections), for several numbers of simultaneous uploads.
+
+Usage: python transporter_http_benchmark.py [--files=2000] [--latency=100]
+    [--connections=10,50,200]
+"""
+
+
+__author__ = "Wim Leers (work@wimleers.com)"
+__version__ = "$Rev$"
+__date__ = "$Date$"
+__license__ = "GPL"
+
+
+from transporter import *
+from transporter_http import TransporterHTTP
+from http_engine_test import WebDAVStandIn
+from django.conf import settings
+if not settings.configured:
+    settings.configure()
+from django.core.files.storage import Storage
+import httplib
+import multiprocessing
+import optparse
+import os
+import shutil
+import tempfile
+import urlparse
+
+
+class BlockingHTTPStorage(Storage):
+    """a storage that uploads with HTTP PUT over a persistent, blocking
+    connection
+    """
+
+
+    def __init__(self, host, port, base_url):
+        self.connection = httplib.HTTPConnection(host, port)
+        self.base_url   = base_url
+
+
+    def _save(self, name, content):
+        self.connection.request("PUT", "/" + name, content.read(), {"Content-Length" : str(content.size)})
+        response = self.connection.getresponse()
+        response.read()
+        if response.status != 201:
+            raise IOError("%d %s" % (response.status, response.reason))
+        return name
+
+
+    def url(self, name):
+        return urlparse.urljoin(self.base_url, name)
+
+
+class TransporterBlockingHTTP(Transporter):
+
+
+    name              = 'BLOCKING_HTTP'
+    valid_settings    = ImmutableSet(["host", "port", "url"])
+    required_settings = ImmutableSet(["host", "port", "url"])
+    supports_overwrite = True
+
+
+    def __init__(self, settings, callback, error_callback, parent_logger=None):
+        Transporter.__init__(self, settings, callback, error_callback, parent_logger)
+        self.storage = BlockingHTTPStorage(self.settings["host"], self.settings["port"], self.settings["url"])
+
+
+def serve(latency, ports):
+    """run the WebDAV stand-in, puts its port in the ports queue"""
+    server = WebDAVStandIn(latency)
+    ports.put(server.server_address[1])
+    server.serve_forever()
+
+
+def benchmark(engine, files, port, connections):
+    """upload all files, returns the duration"""
+    done = threading.Semaphore(0)
+    def callback(src, dst, url, action):
+        done.release()
+    def error_callback(src, dst, action):
+        print "Failed to sync '%s'." % (src)
+        done.release()
+
+    if engine == "threads":
+        settings = {"host" : "127.0.0.1", "port" : port, "url" : "http://cdn.example.com/"}
+        create = lambda: TransporterBlockingHTTP(settings, callback, error_callback, "TransporterHTTPBenchmark")
+        pool = TransporterPool(create, connections)
+        for i in range(connections):
+            pool.start_transporter()
+    else:
+        settings = {"upload_url" : "http://127.0.0.1:%d/" % (port), "url" : "http://cdn.example.com/", "connections" : connections}
+        pool = TransporterPool(None, 1)
+        pool.add(TransporterHTTP(settings, callback, error_callback, "TransporterHTTPBenchmark"))
+
+    start = time.time()
+    for filename in files:
+        pool.get_transporter().sync_file(filename, os.path.basename(filename))
+    for filename in files:
+        done.acquire()
+    duration = time.time() - start
+    pool.stop()
+    return duration
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option("--files", type="int", default=2000, help="number of files to upload")
+    parser.add_option("--latency", type="float", default=100.0, help="latency of an upload, in ms")
+    parser.add_option("--connections", default="10,50,200", help="comma separated numbers of simultaneous uploads")
+    (options, args) = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    ports = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(options.latency / 1000, ports))
+    server.start()
+    port = ports.get()
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        files = []
+        for i in range(options.files):
+            filename = os.path.join(tmp_dir, "file%d.txt" % (i))
+            f = open(filename, "w")
+            f.write("file %d\n" % (i) * 100)
+            f.close()
+            files.append(filename)
+
+        print "%d files, %.1f ms latency per upload:" % (options.files, options.latency)
+        for connections in [int(c) for c in options.connections.split(",")]:
+            for (engine, threads) in (("threads", connections), ("events", 1)):
+                duration = benchmark(engine, files, port, connections)
+                print "%-7s %3d simultaneous uploads, %3d threads: %8.1f files/s %8.1f ms per file" % (engine, connections, threads, options.files / duration, 1000 * duration / options.files)
+    finally:
+        shutil.rmtree(tmp_dir)
+        server.terminate()
@@ -1,5 +1,8 @@
 from transporter import *
 from storages.backends.s3boto import S3BotoStorage
+from boto.s3.connection import S3Connection
+import mimetypes
+import multipart
 
 
 TRANSPORTER_CLASS = "TransporterS3"
@@ -9,8 +12,10 @@ class TransporterS3(Transporter):
 
 
     name              = 'S3'
-    valid_settings    = ImmutableSet(["access_key_id", "secret_access_key", "bucket_name", "bucket_prefix"])
+    valid_settings    = ImmutableSet(["access_key_id", "secret_access_key", "bucket_name", "bucket_prefix", "multipart_threshold", "multipart_part_size", "multipart_connections"])
     required_settings = ImmutableSet(["access_key_id", "secret_access_key", "bucket_name"])
+    supports_overwrite = True
+    supports_batch_delete = True
     headers = {
         'Expires':       'Tue, 20 Jan 2037 03:00:00 GMT', # UNIX timestamps will stop working somewhere in 2038.
         'Cache-Control': 'max-age=315360000',             # Cache for 10 years.
@@ -25,6 +30,17 @@ class TransporterS3(Transporter):
         configured_settings = Set(self.settings.keys())
         if not "bucket_prefix" in configured_settings:
             self.settings["bucket_prefix"] = ""
+        # Files of at least multipart_threshold MB are uploaded in parts of
+        # multipart_part_size MB, over multipart_connections connections.
+        if not "multipart_threshold" in configured_settings:
+            self.settings["multipart_threshold"] = 64
+        if not "multipart_part_size" in configured_settings:
+            self.settings["multipart_part_size"] = 16
+        if not "multipart_connections" in configured_settings:
+            self.settings["multipart_connections"] = 4
+        self.multipart_threshold   = int(float(self.settings["multipart_threshold"]) * 1024 * 1024)
+        self.multipart_part_size   = max(int(float(self.settings["multipart_part_size"]) * 1024 * 1024), multipart.MIN_PART_SIZE)
+        self.multipart_connections = int(self.settings["multipart_connections"])
 
         # Map the settings to the format expected by S3Storage.
         try:
@@ -38,3 +54,43 @@ class TransporterS3(Transporter):
             )
         except Exception, e:            
             raise ConnectionError(e)
+
+
+    def save(self, dst, f, exists=None):
+        """save a file, in parts if it's large"""
+        if f.size < self.multipart_threshold:
+            return Transporter.save(self, dst, f, exists)
+        # Use the same key name and headers as S3BotoStorage.
+        name = self.storage._normalize_name(self.storage._clean_name(dst))
+        headers = self.__class__.headers.copy()
+        headers["Content-Type"] = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        upload = multipart.S3MultipartUpload(self.connect, name, headers, "public-read")
+        # The parts are uploaded over connections of their own: this
+        # transporter's and those that the server's limit allows on top.
+        extra_connections = self.multipart_connections - 1
+        if self.pool is not None:
+            extra_connections = self.pool.acquire_connections(extra_connections)
+        try:
+            multipart.upload_file(f.name, upload, self.multipart_part_size, 1 + extra_connections, limiter=self.limiter)
+        finally:
+            if self.pool is not None:
+                self.pool.release_connections(extra_connections)
+
+
+    def connect(self):
+        """open a new connection to the bucket"""
+        connection = S3Connection(self.settings["access_key_id"].encode('utf-8'), self.settings["secret_access_key"].encode('utf-8'))
+        return connection.get_bucket(self.settings["bucket_name"].encode('utf-8'), validate=False)
+
+
+    def delete_batch(self, dsts):
+        """delete up to 1,000 files with a single request"""
+        def utf8(name):
+            if isinstance(name, unicode):
+                return name.encode('utf-8')
+            return name
+        names = {}
+        for dst in dsts:
+            names[utf8(self.storage._normalize_name(self.storage._clean_name(dst)))] = dst
+        result = self.storage.bucket.delete_keys(names.keys(), quiet=True)
+        return [names[utf8(error.key)] for error in result.errors]
@@ -11,6 +11,7 @@ class TransporterSFTP(Transporter):
     name              = 'SFTP'
     valid_settings    = ImmutableSet(["host", "username", "password", "url", "port", "path", "key"])
     required_settings = ImmutableSet(["host", "username", "url"])
+    supports_overwrite = True
 
     def __init__(self, settings, callback, error_callback, parent_logger=None):
         Transporter.__init__(self, settings, callback, error_callback, parent_logger)
@@ -38,3 +39,8 @@ class TransporterSFTP(Transporter):
             self.storage._start_connection()
         except Exception, e:
             raise ConnectionError(e)
+
+
+    def keepalive(self):
+        # Checks the connection and reconnects if it has been closed.
+        self.storage._start_connection()